@@ -0,0 +1,345 @@
+"""
+Analítica de cumplimiento sobre las auditorías guardadas (NumPy).
+Las respuestas de muchas auditorías se cargan por lotes en una matriz
+preguntas × auditorías de códigos int8 y todo se calcula de forma vectorizada:
+tasas de cumplimiento, rachas de no conformidad (mismos largos que el motor
+de reglas de calcular_no_conformidades), mapa de calor de fallas por
+pregunta y periodo, y tendencias. Los resultados se guardan en un caché TTL.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from reglas_auditoria import obtener_motor
+
+# Códigos de respuesta en la matriz (0 = la auditoría no tiene esa pregunta)
+SIN_RESPUESTA = 0
+CUMPLE = 1
+NO_CUMPLE = 2
+PARCIAL = 3
+NO_APLICA = 4
+
+CODIGOS = {
+    "Cumple": CUMPLE,
+    "No Cumple": NO_CUMPLE,
+    "Cumple Parcialmente": PARCIAL,
+    "No Aplica": NO_APLICA,
+}
+
+# Valores por defecto; los vigentes salen del motor de reglas (reglas_auditoria.json)
+LARGO_RACHA = 3
+MENORES_POR_MAYOR = 3
+MAYORES_POR_SANCION = 3
+
+PERIODOS = {
+    'dia': 'D',
+    'semana': 'W',
+    'mes': 'M',
+}
+
+TAMANO_LOTE = 500
+TTL_ANALITICA = float(os.environ.get('ANALITICA_TTL', 60))
+MAX_ENTRADAS_CACHE = 64
+
+_cache = {}
+_lock = threading.Lock()
+
+
+# --- Carga ---
+
+class MatrizAuditorias:
+    """Respuestas codificadas de un conjunto de auditorías"""
+
+    def __init__(self, preguntas, ids, fechas, codigos, secuencia):
+        self.preguntas = preguntas      # list[str], en orden de aparición
+        self.ids = ids                  # int64 (n_auditorias,)
+        self.fechas = fechas            # datetime64[s] (n_auditorias,)
+        self.codigos = codigos          # int8 (n_preguntas, n_auditorias)
+        self.secuencia = secuencia      # int32: posición de la pregunta dentro de cada auditoría
+
+    @property
+    def vacia(self):
+        return self.codigos.shape[1] == 0
+
+
+def cargar_matriz(conn, email=None, desde=None, hasta=None):
+    """Lee las auditorías con un cursor de servidor (por lotes) y arma la matriz"""
+    filtros = ["TRUE"]
+    params = []
+    if email:
+        filtros.append("a.id_usuario = (SELECT id_usuario FROM Usuario WHERE email = %s)")
+        params.append(email)
+    if desde:
+        filtros.append("a.fecha_auditoria >= %s")
+        params.append(desde)
+    if hasta:
+        filtros.append("a.fecha_auditoria < %s::date + 1")
+        params.append(hasta)
+
+    cursor = conn.cursor(name="analitica_auditorias")
+    cursor.itersize = TAMANO_LOTE
+    try:
+        cursor.execute(f"""
+            SELECT a.id_auditoria, a.fecha_auditoria, a.datos_auditoria
+            FROM Auditoria a
+            WHERE {' AND '.join(filtros)}
+            ORDER BY a.fecha_auditoria, a.id_auditoria
+        """, params)
+        return construir_matriz(cursor)
+    finally:
+        cursor.close()
+
+
+def construir_matriz(filas):
+    """Matriz a partir de (id_auditoria, fecha, datos_auditoria) en cualquier iterable"""
+    indice_pregunta = {}
+    ids = []
+    fechas = []
+    columnas = []   # por auditoría: (índices de pregunta, códigos)
+
+    for id_auditoria, fecha, datos in filas:
+        if isinstance(datos, str):
+            try:
+                datos = json.loads(datos)
+            except ValueError:
+                datos = {}
+        respuestas = (datos or {}).get('respuestas') or {}
+        posiciones = np.empty(len(respuestas), dtype=np.int32)
+        valores = np.empty(len(respuestas), dtype=np.int8)
+        for n, (pregunta, respuesta) in enumerate(respuestas.items()):
+            posicion = indice_pregunta.get(pregunta)
+            if posicion is None:
+                posicion = indice_pregunta[pregunta] = len(indice_pregunta)
+            posiciones[n] = posicion
+            valores[n] = CODIGOS.get(respuesta, SIN_RESPUESTA)
+        if getattr(fecha, 'tzinfo', None) is not None:
+            fecha = fecha.replace(tzinfo=None)
+        ids.append(id_auditoria)
+        fechas.append(np.datetime64(fecha, 's') if fecha is not None else np.datetime64('NaT'))
+        columnas.append((posiciones, valores))
+
+    codigos = np.zeros((len(indice_pregunta), len(columnas)), dtype=np.int8)
+    secuencia = np.full(codigos.shape, np.iinfo(np.int32).max, dtype=np.int32)
+    for n, (posiciones, valores) in enumerate(columnas):
+        codigos[posiciones, n] = valores
+        secuencia[posiciones, n] = np.arange(len(posiciones), dtype=np.int32)
+
+    return MatrizAuditorias(
+        list(indice_pregunta),
+        np.asarray(ids, dtype=np.int64),
+        np.asarray(fechas, dtype='datetime64[s]'),
+        codigos,
+        secuencia,
+    )
+
+
+# --- Cálculos vectorizados ---
+
+def _tasa(numerador, denominador):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tasa = np.where(denominador > 0, numerador / np.maximum(denominador, 1) * 100, 0.0)
+    return np.round(tasa, 2)
+
+
+def tasas_cumplimiento(codigos, eje):
+    """Porcentajes sobre preguntas aplicables; eje=0 por auditoría, eje=1 por pregunta"""
+    aplicables = np.isin(codigos, (CUMPLE, NO_CUMPLE, PARCIAL)).sum(axis=eje)
+    return {
+        "aplicables": aplicables,
+        "cumplimiento": _tasa((codigos == CUMPLE).sum(axis=eje), aplicables),
+        "no_cumplimiento": _tasa((codigos == NO_CUMPLE).sum(axis=eje), aplicables),
+        "parcial": _tasa((codigos == PARCIAL).sum(axis=eje), aplicables),
+    }
+
+
+def _compactar(codigos, secuencia):
+    """Reordena cada columna en el orden en que se contestó esa auditoría.
+
+    Las rachas dependen del orden de las preguntas en cada checklist (el de
+    calcular_no_conformidades); las preguntas que la auditoría no tiene quedan
+    al final y no cortan rachas.
+    """
+    orden = np.argsort(secuencia, axis=0, kind='stable')
+    return np.take_along_axis(codigos, orden, axis=0), orden
+
+
+def rachas(mascara, largo=LARGO_RACHA):
+    """Rachas de True por columna.
+
+    Devuelve (auditoría, inicio, fin) de cada racha y cuántos bloques de
+    `largo` completa cada una (la regla reinicia el contador al llegar a 3).
+    """
+    n_preguntas, n_auditorias = mascara.shape
+    relleno = np.zeros((n_auditorias, 1), dtype=np.int8)
+    bordes = np.diff(np.hstack([relleno, mascara.T.astype(np.int8), relleno]), axis=1)
+    auditoria_inicio, inicio = np.nonzero(bordes == 1)
+    _, fin = np.nonzero(bordes == -1)
+    return auditoria_inicio, inicio, fin, (fin - inicio) // largo
+
+
+def no_conformidades(codigos, secuencia):
+    """Menores, mayores, sanción y buenas prácticas por auditoría, más cobertura por pregunta"""
+    n_preguntas, n_auditorias = codigos.shape
+    compacta, orden = _compactar(codigos, secuencia)
+
+    motor = obtener_motor()
+    largo_nc = motor.largo_racha('menores', LARGO_RACHA)
+    largo_bp = motor.largo_racha('buenas_practicas', LARGO_RACHA)
+
+    auditoria, inicio, fin, bloques = rachas(np.isin(compacta, (NO_CUMPLE, PARCIAL)), largo_nc)
+    menores = np.bincount(auditoria, weights=bloques, minlength=n_auditorias).astype(np.int64)
+    mayores = (menores >= motor.cantidad_escalamiento('mayores', MENORES_POR_MAYOR)).astype(np.int64)
+    sancion = mayores >= motor.cantidad_escalamiento('sancion', MAYORES_POR_SANCION)
+
+    auditoria_bp, _, _, bloques_bp = rachas(compacta == CUMPLE, largo_bp)
+    buenas_practicas = np.bincount(auditoria_bp, weights=bloques_bp, minlength=n_auditorias).astype(np.int64)
+
+    # Preguntas que quedan dentro de una racha de no conformidad: +1 al inicio,
+    # -1 al final y suma acumulada; luego se regresa al orden original de filas
+    largas = bloques > 0
+    marcas = np.zeros((n_auditorias, n_preguntas + 1), dtype=np.int32)
+    np.add.at(marcas, (auditoria[largas], inicio[largas]), 1)
+    np.add.at(marcas, (auditoria[largas], fin[largas]), -1)
+    en_racha_compacta = (np.cumsum(marcas, axis=1)[:, :n_preguntas] > 0).T
+    en_racha = np.zeros_like(en_racha_compacta)
+    np.put_along_axis(en_racha, orden, en_racha_compacta, axis=0)
+
+    return {
+        "menores": menores,
+        "mayores": mayores,
+        "sancion": sancion,
+        "buenas_practicas": buenas_practicas,
+        "en_racha": en_racha,
+    }
+
+
+def _indices_periodo(fechas, periodo):
+    unidad = PERIODOS.get(periodo, 'M')
+    cubetas = fechas.astype(f'datetime64[{unidad}]')
+    etiquetas, indices = np.unique(cubetas, return_inverse=True)
+    return [str(e) for e in etiquetas], indices
+
+
+def mapa_calor(codigos, fechas, periodo='mes'):
+    """% de fallas (No Cumple + Parcial) por pregunta y periodo"""
+    etiquetas, indices = _indices_periodo(fechas, periodo)
+    pertenece = np.zeros((codigos.shape[1], len(etiquetas)), dtype=np.float64)
+    pertenece[np.arange(codigos.shape[1]), indices] = 1.0
+    fallas = np.isin(codigos, (NO_CUMPLE, PARCIAL)).astype(np.float64) @ pertenece
+    aplicables = np.isin(codigos, (CUMPLE, NO_CUMPLE, PARCIAL)).astype(np.float64) @ pertenece
+    return etiquetas, _tasa(fallas, aplicables), aplicables.astype(np.int64)
+
+
+def pendientes(serie):
+    """Pendiente de mínimos cuadrados de cada fila contra el número de periodo"""
+    n = serie.shape[1]
+    if n < 2:
+        return np.zeros(serie.shape[0])
+    x = np.arange(n, dtype=np.float64)
+    x -= x.mean()
+    return (serie - serie.mean(axis=1, keepdims=True)) @ x / (x @ x)
+
+
+# --- Reporte ---
+
+def analizar(matriz, periodo='mes', top=10):
+    """Resumen serializable a JSON para la API"""
+    if matriz.vacia:
+        return {"total_auditorias": 0, "total_preguntas": 0, "periodos": [], "auditorias": [],
+                "preguntas": [], "mapa_calor": [], "tendencia": {}}
+
+    codigos = matriz.codigos
+    por_auditoria = tasas_cumplimiento(codigos, eje=0)
+    por_pregunta = tasas_cumplimiento(codigos, eje=1)
+    nc = no_conformidades(codigos, matriz.secuencia)
+    etiquetas, calor, aplicables_periodo = mapa_calor(codigos, matriz.fechas, periodo)
+
+    # Tendencia global por periodo
+    _, indices = _indices_periodo(matriz.fechas, periodo)
+    auditorias_periodo = np.bincount(indices, minlength=len(etiquetas))
+    cumplimiento_periodo = _tasa(
+        np.bincount(indices, weights=(codigos == CUMPLE).sum(axis=0), minlength=len(etiquetas)),
+        np.bincount(indices, weights=por_auditoria["aplicables"], minlength=len(etiquetas)),
+    )
+    menores_periodo = np.round(
+        np.bincount(indices, weights=nc["menores"], minlength=len(etiquetas)) / np.maximum(auditorias_periodo, 1), 2
+    )
+
+    # Preguntas que más empeoran (pendiente de % de fallas, solo periodos con datos)
+    con_datos = aplicables_periodo > 0
+    media = np.where(con_datos, calor, 0).sum(axis=1, keepdims=True) / np.maximum(con_datos.sum(axis=1, keepdims=True), 1)
+    serie = np.where(con_datos, calor, media)
+    tendencia_pregunta = pendientes(serie)
+    peores = np.argsort(-tendencia_pregunta)[:top]
+
+    veces_en_racha = nc["en_racha"].sum(axis=1)
+    fallas_totales = np.isin(codigos, (NO_CUMPLE, PARCIAL)).sum(axis=1)
+
+    return {
+        "total_auditorias": int(codigos.shape[1]),
+        "total_preguntas": int(codigos.shape[0]),
+        "cumplimiento_promedio": round(float(por_auditoria["cumplimiento"].mean()), 2),
+        "auditorias_con_mayor": int((nc["mayores"] > 0).sum()),
+        "auditorias_con_sancion": int(nc["sancion"].sum()),
+        "periodos": etiquetas,
+        "auditorias": [
+            {
+                "id_auditoria": int(matriz.ids[n]),
+                "fecha": str(matriz.fechas[n]),
+                "porcentaje_cumplimiento": float(por_auditoria["cumplimiento"][n]),
+                "total_menores": int(nc["menores"][n]),
+                "total_mayores": int(nc["mayores"][n]),
+                "sancion": bool(nc["sancion"][n]),
+                "total_buenas_practicas": int(nc["buenas_practicas"][n]),
+            }
+            for n in range(codigos.shape[1])
+        ],
+        "preguntas": [
+            {
+                "pregunta": matriz.preguntas[p],
+                "aplicables": int(por_pregunta["aplicables"][p]),
+                "porcentaje_cumplimiento": float(por_pregunta["cumplimiento"][p]),
+                "porcentaje_no_cumplimiento": float(por_pregunta["no_cumplimiento"][p]),
+                "porcentaje_parcial": float(por_pregunta["parcial"][p]),
+                "fallas": int(fallas_totales[p]),
+                "veces_en_no_conformidad": int(veces_en_racha[p]),
+            }
+            for p in range(codigos.shape[0])
+        ],
+        "mapa_calor": calor.tolist(),
+        "tendencia": {
+            "auditorias": auditorias_periodo.tolist(),
+            "porcentaje_cumplimiento": cumplimiento_periodo.tolist(),
+            "menores_promedio": menores_periodo.tolist(),
+            "preguntas_empeorando": [
+                {"pregunta": matriz.preguntas[p], "pendiente": round(float(tendencia_pregunta[p]), 3)}
+                for p in peores if tendencia_pregunta[p] > 0
+            ],
+        },
+    }
+
+
+def obtener_analitica(conn, email=None, desde=None, hasta=None, periodo='mes'):
+    """analizar() sobre la BD con caché TTL por combinación de filtros"""
+    clave = (email, str(desde), str(hasta), periodo)
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _cache.get(clave)
+        if entrada and entrada[0] > ahora:
+            return entrada[1]
+
+    resultado = analizar(cargar_matriz(conn, email, desde, hasta), periodo)
+
+    with _lock:
+        if len(_cache) >= MAX_ENTRADAS_CACHE:
+            _cache.pop(min(_cache, key=lambda k: _cache[k][0]))
+        _cache[clave] = (ahora + TTL_ANALITICA, resultado)
+    return resultado
+
+
+def invalidar_analitica():
+    with _lock:
+        _cache.clear()
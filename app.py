@@ -1,5 +1,6 @@
-from flask import Flask, session, jsonify, request, send_file, render_template, send_from_directory
+from flask import Flask, session, jsonify, request, send_file, render_template, send_from_directory, Response
 import os
+import sys
 import json
 import io
 
@@ -16,8 +17,15 @@ from db_config import (
     realizar_transaccion_saldo,
     guardar_auditoria,
     obtener_datos_auditoria,
-    obtener_historial_auditorias
+    obtener_historial_auditorias,
+    obtener_auditorias_exportar,
+    obtener_analitica_auditorias,
+    obtener_auditorias_con_falla
 )
+from servicio_hash import ServicioSaturado
+from reglas_auditoria import obtener_motor
+import instrumentacion_sql
+import observabilidad
 
 # --- 1. INICIALIZACIÓN ---
 app = Flask(__name__, static_url_path='/static', static_folder='static')
@@ -28,6 +36,77 @@ app.config["SESSION_COOKIE_SAMESITE"] = "None"
 app.config["SESSION_COOKIE_SECURE"] = True
 app.config["PERMANENT_SESSION_LIFETIME"] = 3600  # 1 hora
 
+# Compilar las reglas de auditoría al arrancar (un archivo inválido falla aquí, no al guardar)
+obtener_motor()
+
+# --- 3. INSTRUMENTACIÓN (SQL por petición y latencias por ruta, ver instrumentacion_sql.py y observabilidad.py) ---
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+@app.before_request
+def _iniciar_medicion():
+    ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+    instrumentacion_sql.iniciar_peticion(ruta)
+    observabilidad.iniciar_peticion(ruta)
+
+@app.after_request
+def _cabecera_server_timing(response):
+    medicion = instrumentacion_sql.peticion_actual()
+    if medicion is not None:
+        response.headers["Server-Timing"] = medicion.server_timing()
+        instrumentacion_sql.terminar_peticion(request.method, response.status_code)
+        observabilidad.terminar_peticion(medicion.ruta, request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def _cerrar_medicion(error=None):
+    # after_request no corre si la vista lanzó una excepción sin manejar
+    medicion = instrumentacion_sql.peticion_actual()
+    if medicion is not None:
+        instrumentacion_sql.terminar_peticion(request.method, 500)
+        observabilidad.terminar_peticion(medicion.ruta, request.method, 500)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Contadores del worker en formato de texto de Prometheus (Bearer METRICS_TOKEN si está definido)"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("no autorizado\n", status=401, mimetype="text/plain")
+
+    from db_pool import obtener_pool
+    from servicio_hash import metricas_hash
+    extras = {}
+    pool = obtener_pool()
+    if pool:
+        estado = pool.estadisticas()
+        extras["casino_db_pool_conexiones"] = ("gauge", "Conexiones del pool por estado", [
+            ({"estado": "libres"}, estado["libres"]),
+            ({"estado": "en_uso"}, estado["en_uso"]),
+        ])
+        extras["casino_db_pool_maximo"] = ("gauge", "Tamaño máximo del pool", [(None, estado["maximo"])])
+    # Pool asíncrono, solo si el worker corre en modo ASGI (asgi.py)
+    db_async = sys.modules.get("db_async")
+    estado_async = db_async.estadisticas_pool() if db_async else None
+    if estado_async:
+        extras["casino_db_pool_async_conexiones"] = ("gauge", "Conexiones del pool asíncrono por estado", [
+            ({"estado": "libres"}, estado_async["libres"]),
+            ({"estado": "en_uso"}, estado_async["en_uso"]),
+            ({"estado": "esperando"}, estado_async["esperando"]),
+        ])
+    hash_estado = metricas_hash()
+    extras["casino_hash_completadas_total"] = ("counter", "Hashes Argon2 completados",
+                                               [(None, hash_estado.get("completadas", 0))])
+    extras["casino_hash_rechazadas_total"] = ("counter", "Hashes rechazados por cola saturada",
+                                              [(None, hash_estado.get("rechazadas", 0))])
+    extras["casino_hash_pendientes"] = ("gauge", "Hashes en cola o en proceso",
+                                        [(None, hash_estado.get("pendientes", 0))])
+    cuantiles = []
+    for (ruta, metodo, estado), h in sorted(observabilidad.latencias().items()):
+        etiquetas = {"ruta": ruta, "metodo": metodo, "estado": estado}
+        for p in observabilidad.PERCENTILES:
+            cuantiles.append(({**etiquetas, "quantile": p / 100}, h.percentil(p) / 1_000_000))
+    extras["casino_http_latencia_segundos"] = ("gauge", "Latencia por ruta (percentiles HDR, todos los workers)", cuantiles)
+    return Response(instrumentacion_sql.exportar_prometheus(extras),
+                    mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 # ==========================================
 # SECCIÓN 1: RUTAS BÁSICAS Y AUTENTICACIÓN
 # ==========================================
@@ -84,6 +163,8 @@ def api_registrar():
         codigo = 200 if resultado["exito"] else 400
         return jsonify(resultado), codigo
 
+    except ServicioSaturado as e:
+        return jsonify({"exito": False, "mensaje": str(e)}), 503, {"Retry-After": "2"}
     except Exception as e:
         print(f"🔥 ERROR INTERNO: {e}")
         return jsonify({"exito": False, "mensaje": f"Error servidor: {str(e)}"}), 500
@@ -121,6 +202,9 @@ def api_login():
             print(f"❌ LOGIN FALLIDO - Email: {email}")
             return jsonify({"exito": False, "mensaje": "Credenciales incorrectas"}), 401
             
+    except ServicioSaturado as e:
+        print(f"⏳ LOGIN RECHAZADO (cola de hashing llena): {e}")
+        return jsonify({"exito": False, "mensaje": str(e)}), 503, {"Retry-After": "2"}
     except Exception as e:
         print(f"🔥 ERROR EN LOGIN: {e}")
         return jsonify({"exito": False, "mensaje": str(e)}), 400
@@ -157,6 +241,8 @@ def api_update_perfil():
         if actualizar_datos_usuario(email, nombre, apellido, password):
             return jsonify({"exito": True, "mensaje": "Datos actualizados"})
         return jsonify({"exito": False, "mensaje": "Error al actualizar"}), 400
+    except ServicioSaturado as e:
+        return jsonify({"exito": False, "mensaje": str(e)}), 503, {"Retry-After": "2"}
     except Exception as e:
         return jsonify({"exito": False, "mensaje": str(e)}), 500
 
@@ -167,8 +253,10 @@ def api_transaccion():
         email = data.get("email")
         monto = float(data.get("monto", 0))
         tipo = data.get("tipo") # "deposito" o "retiro"
+        # Reintentos desde App Inventor: misma clave = misma transacción
+        clave = data.get("clave_idempotencia") or request.headers.get("Idempotency-Key")
         
-        resultado = realizar_transaccion_saldo(email, monto, tipo)
+        resultado = realizar_transaccion_saldo(email, monto, tipo, clave)
         return jsonify(resultado)
     except Exception as e:
         return jsonify({"exito": False, "mensaje": str(e)}), 400
@@ -225,104 +313,11 @@ def historial_auditoria():
 
 # Función para calcular no conformidades y buenas prácticas
 def calcular_no_conformidades(respuestas):
-    """Calcula no conformidades menores, mayores, sanciones y buenas prácticas"""
-    consecutivas_no_cumple = 0
-    consecutivas_cumple = 0
-    no_conformidades_menores = []
-    no_conformidades_mayores = []
-    buenas_practicas = []
-    preguntas_lista = list(respuestas.items())
-    
-    # Contadores para métricas
-    total_preguntas = len(preguntas_lista)
-    cumple_count = 0
-    no_cumple_count = 0
-    parcial_count = 0
-    no_aplica_count = 0
-    
-    for i, (pregunta, respuesta) in enumerate(preguntas_lista):
-        # Contar respuestas
-        if respuesta == "Cumple":
-            cumple_count += 1
-        elif respuesta == "No Cumple":
-            no_cumple_count += 1
-        elif respuesta == "Cumple Parcialmente":
-            parcial_count += 1
-        elif respuesta == "No Aplica":
-            no_aplica_count += 1
-        
-        # Detectar No Conformidades
-        if respuesta in ["No Cumple", "Cumple Parcialmente"]:
-            consecutivas_no_cumple += 1
-            consecutivas_cumple = 0
-            
-            if consecutivas_no_cumple >= 3:
-                inicio = max(0, i - 2)
-                preguntas_afectadas = [preguntas_lista[j][0] for j in range(inicio, i + 1)]
-                no_conformidades_menores.append({
-                    "tipo": "menor",
-                    "descripcion": f"No Conformidad Menor: {consecutivas_no_cumple} incumplimientos consecutivos",
-                    "preguntas": preguntas_afectadas,
-                    "ubicacion": f"Preguntas {inicio + 1} a {i + 1}"
-                })
-                consecutivas_no_cumple = 0
-        # Detectar Buenas Prácticas
-        elif respuesta == "Cumple":
-            consecutivas_cumple += 1
-            consecutivas_no_cumple = 0
-            
-            if consecutivas_cumple >= 3:
-                inicio = max(0, i - 2)
-                preguntas_afectadas = [preguntas_lista[j][0] for j in range(inicio, i + 1)]
-                buenas_practicas.append({
-                    "descripcion": f"Buena Práctica: {consecutivas_cumple} cumplimientos consecutivos",
-                    "preguntas": preguntas_afectadas,
-                    "ubicacion": f"Preguntas {inicio + 1} a {i + 1}"
-                })
-                consecutivas_cumple = 0
-        else:
-            consecutivas_no_cumple = 0
-            consecutivas_cumple = 0
-    
-    # Verificar no conformidades mayores (3 menores = 1 mayor)
-    if len(no_conformidades_menores) >= 3:
-        no_conformidades_mayores.append({
-            "tipo": "mayor",
-            "descripcion": f"No Conformidad Mayor: {len(no_conformidades_menores)} NC menores acumuladas",
-            "nc_menores_relacionadas": len(no_conformidades_menores)
-        })
-    
-    # Verificar sanción económica (3 mayores)
-    sancion = False
-    if len(no_conformidades_mayores) >= 3:
-        sancion = True
-    
-    # Calcular porcentajes
-    preguntas_aplicables = total_preguntas - no_aplica_count
-    porcentaje_cumplimiento = (cumple_count / preguntas_aplicables * 100) if preguntas_aplicables > 0 else 0
-    porcentaje_no_cumplimiento = (no_cumple_count / preguntas_aplicables * 100) if preguntas_aplicables > 0 else 0
-    porcentaje_parcial = (parcial_count / preguntas_aplicables * 100) if preguntas_aplicables > 0 else 0
-    
-    return {
-        "menores": no_conformidades_menores,
-        "mayores": no_conformidades_mayores,
-        "sancion": sancion,
-        "total_menores": len(no_conformidades_menores),
-        "total_mayores": len(no_conformidades_mayores),
-        "buenas_practicas": buenas_practicas,
-        "total_buenas_practicas": len(buenas_practicas),
-        "metricas": {
-            "total_preguntas": total_preguntas,
-            "preguntas_aplicables": preguntas_aplicables,
-            "cumple": cumple_count,
-            "no_cumple": no_cumple_count,
-            "parcial": parcial_count,
-            "no_aplica": no_aplica_count,
-            "porcentaje_cumplimiento": round(porcentaje_cumplimiento, 2),
-            "porcentaje_no_cumplimiento": round(porcentaje_no_cumplimiento, 2),
-            "porcentaje_parcial": round(porcentaje_parcial, 2)
-        }
-    }
+    """Calcula no conformidades menores, mayores, sanciones y buenas prácticas.
+
+    Las reglas viven en reglas_auditoria.json (ver reglas_auditoria.py).
+    """
+    return obtener_motor().evaluar(respuestas)
 
 
 # D. API PARA GUARDAR LOS DATOS EN NEON
@@ -354,6 +349,10 @@ def api_guardar_checklist():
         id_audit = guardar_auditoria(email, f"Auditoría {data.get('fecha')}", datos_json)
         
         if id_audit:
+            # Generar el PDF en segundo plano para que la primera descarga ya esté en caché
+            from cache_reportes import precalentar
+            precalentar(id_audit)
+
             # URL para descargar el PDF
             pdf_url = f"/api/pdf_auditoria/{id_audit}"
             return jsonify({"exito": True, "mensaje": "Guardado", "pdf_url": pdf_url})
@@ -369,22 +368,180 @@ def api_guardar_checklist():
 def ver_pdf_page(id_auditoria):
     return render_template("auditor-ver-pdf.html", id_auditoria=id_auditoria)
 
+def _enviar_pdf_auditoria(ruta, id_auditoria, etag):
+    response = send_file(
+        ruta, 
+        as_attachment=False, 
+        download_name=f"reporte_{id_auditoria}.pdf", 
+        mimetype='application/pdf',
+        etag=etag,
+        conditional=True,
+        max_age=0
+    )
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+def _estado_trabajo_json(trabajo, id_auditoria=None):
+    datos = {
+        "id_trabajo": trabajo["id"],
+        "estado": trabajo["estado"],
+        "progreso": trabajo["progreso"],
+        "error": trabajo.get("error")
+    }
+    if trabajo["estado"] == "terminado" and id_auditoria is not None:
+        datos["pdf_url"] = f"/api/pdf_auditoria/{id_auditoria}"
+    return datos
+
 @app.route("/api/pdf_auditoria/<int:id_auditoria>", methods=["GET"])
 def generar_pdf(id_auditoria):
-    from pdf_generator import generar_pdf_profesional
+    """PDF de la auditoría. El render ocurre en la cola de trabajos, nunca en el worker web.
+
+    Sin caché, espera (sin CPU) hasta PDF_ESPERA_SEG a que la cola termine; con ?asincrono=1
+    responde 202 de inmediato con el trabajo para consultar su progreso.
+    """
+    from cache_reportes import etag_conocido, buscar_en_cache
+    from cola_trabajos import encolar_pdf_auditoria, esperar_trabajo
+
+    # Las auditorías no cambian: si el visor ya tiene esta versión, 304 sin tocar la BD
+    etag = etag_conocido(id_auditoria)
+    if etag and etag in request.if_none_match:
+        return "", 304, {"ETag": f'"{etag}"'}
     
     datos = obtener_datos_auditoria(id_auditoria)
     if not datos:
         return "Auditoría no encontrada", 404
     
-    buffer = generar_pdf_profesional(datos, id_auditoria)
-    
-    return send_file(
-        buffer, 
-        as_attachment=False, 
-        download_name=f"reporte_{id_auditoria}.pdf", 
-        mimetype='application/pdf'
-    )
+    ruta, etag = buscar_en_cache(datos, id_auditoria)
+    if ruta:
+        return _enviar_pdf_auditoria(ruta, id_auditoria, etag)
+
+    trabajo = encolar_pdf_auditoria(datos, id_auditoria)
+    if request.args.get('asincrono') not in ('1', 'true', 'si'):
+        trabajo = esperar_trabajo(trabajo["id"], float(os.environ.get('PDF_ESPERA_SEG', 60)))
+
+    if trabajo["estado"] == "terminado" and trabajo.get("resultado") and os.path.exists(trabajo["resultado"]):
+        return _enviar_pdf_auditoria(trabajo["resultado"], id_auditoria, etag)
+    if trabajo["estado"] == "error":
+        return jsonify(_estado_trabajo_json(trabajo)), 500
+
+    estado_url = f"/api/reportes/trabajos/{trabajo['id']}?id_auditoria={id_auditoria}"
+    return jsonify({**_estado_trabajo_json(trabajo), "estado_url": estado_url}), 202, {"Location": estado_url}
+
+@app.route("/api/reportes/trabajos/<id_trabajo>", methods=["GET"])
+def api_estado_trabajo(id_trabajo):
+    """Estado y progreso (0-100) de un trabajo de la cola de reportes"""
+    from cola_trabajos import obtener_trabajo
+    trabajo = obtener_trabajo(id_trabajo)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(_estado_trabajo_json(trabajo, request.args.get('id_auditoria', type=int)))
+
+# F. EXPORTACIÓN MASIVA (ZIP o PDF combinado)
+@app.route("/api/auditor/exportar", methods=["GET"])
+def api_exportar_auditorias():
+    """Todas las auditorías del periodo en un ZIP (o un PDF) que se transmite mientras se renderiza.
+
+    Parámetros: formato=zip|pdf, desde/hasta=YYYY-MM-DD, ids=1,2,3 (opcional)
+    """
+    from datetime import date
+    from exportacion_reportes import exportar_zip, exportar_pdf_combinado, EXPORT_PDF_MAX
+
+    email = session.get("user_id")
+    if not email or email == "Invitado":
+        return jsonify({"exito": False, "mensaje": "No logueado"}), 401
+
+    try:
+        desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else None
+        hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else None
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"exito": False, "mensaje": "Parámetros inválidos"}), 400
+
+    formato = request.args.get('formato', 'zip')
+    if formato not in ('zip', 'pdf'):
+        return jsonify({"exito": False, "mensaje": "Formato inválido"}), 400
+
+    auditorias = obtener_auditorias_exportar(email, desde, hasta, ids or None)
+    if not auditorias:
+        return jsonify({"exito": False, "mensaje": "No hay auditorías en ese periodo"}), 404
+    if formato == 'pdf' and len(auditorias) > EXPORT_PDF_MAX:
+        # El combinado se arma en memoria: para periodos grandes, el ZIP sí se transmite
+        return jsonify({"exito": False, "mensaje": f"El PDF combinado admite hasta {EXPORT_PDF_MAX} auditorías; usa formato=zip"}), 400
+
+    periodo = f"{desde or 'inicio'}_{hasta or date.today()}"
+    if formato == 'pdf':
+        generador, mimetype, nombre = exportar_pdf_combinado(auditorias), 'application/pdf', f"auditorias_{periodo}.pdf"
+    else:
+        generador, mimetype, nombre = exportar_zip(auditorias), 'application/zip', f"auditorias_{periodo}.zip"
+
+    return Response(generador, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{nombre}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+# G. ANALÍTICA DE CUMPLIMIENTO
+@app.route("/api/auditor/analitica", methods=["GET"])
+def api_analitica_auditorias():
+    """Tasas de cumplimiento, no conformidades, mapa de calor y tendencias.
+
+    El auditor ve sus auditorías; el administrador ve todas (o las de ?email=).
+    Parámetros: desde/hasta=YYYY-MM-DD, periodo=dia|semana|mes
+    """
+    from datetime import date
+
+    email = session.get("user_id")
+    if not email or email == "Invitado":
+        return jsonify({"exito": False, "mensaje": "No logueado"}), 401
+    if session.get("rol") == "Administrador":
+        email = request.args.get('email') or None
+
+    try:
+        desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else None
+        hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else None
+    except ValueError:
+        return jsonify({"exito": False, "mensaje": "Parámetros inválidos"}), 400
+
+    periodo = request.args.get('periodo', 'mes')
+    if periodo not in ('dia', 'semana', 'mes'):
+        return jsonify({"exito": False, "mensaje": "Periodo inválido"}), 400
+
+    analitica = obtener_analitica_auditorias(email, desde, hasta, periodo)
+    if analitica is None:
+        return jsonify({"exito": False, "mensaje": "Error calculando analítica"}), 500
+    return jsonify({"exito": True, **analitica})
+
+@app.route("/api/auditor/fallas", methods=["GET"])
+def api_auditorias_con_falla():
+    """Auditorías que fallaron una pregunta. Parámetros: pregunta=texto o posicion=N, desde, hasta"""
+    from datetime import date
+
+    email = session.get("user_id")
+    if not email or email == "Invitado":
+        return jsonify({"exito": False, "mensaje": "No logueado"}), 401
+    if session.get("rol") == "Administrador":
+        email = request.args.get('email') or None
+
+    try:
+        posicion = request.args.get('posicion', type=int)
+        desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else None
+        hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else None
+        limite = min(max(int(request.args.get('limite', 200)), 1), 1000)
+    except ValueError:
+        return jsonify({"exito": False, "mensaje": "Parámetros inválidos"}), 400
+
+    pregunta = request.args.get('pregunta')
+    if not pregunta and not posicion:
+        return jsonify({"exito": False, "mensaje": "Falta pregunta o posicion"}), 400
+
+    filas = obtener_auditorias_con_falla(pregunta, posicion, email, desde, hasta, limite)
+    if filas is None:
+        return jsonify({"exito": False, "mensaje": "Error consultando auditorías"}), 500
+    for fila in filas:
+        if fila.get('fecha_auditoria'):
+            fila['fecha_auditoria'] = fila['fecha_auditoria'].isoformat()
+    return jsonify({"exito": True, "auditorias": filas})
 
 # ==========================================
 # SECCIÓN 4: PANEL DE ADMINISTRADOR
@@ -443,9 +600,17 @@ def admin_configuracion():
 @app.route("/api/admin/usuarios", methods=["GET"])
 @admin_required
 def api_admin_usuarios():
+    """Página de usuarios: q (prefijo), orden, dir (asc/desc), limite, cursor, estimado=1"""
     from db_config import obtener_todos_usuarios
-    users = obtener_todos_usuarios()
-    return jsonify({"users": users})
+    pagina = obtener_todos_usuarios(
+        buscar=(request.args.get('q') or '').strip() or None,
+        orden=request.args.get('orden', 'id'),
+        descendente=request.args.get('dir', 'desc') != 'asc',
+        limite=request.args.get('limite', type=int),
+        cursor_pagina=request.args.get('cursor') or None,
+        con_estimado=request.args.get('estimado') in ('1', 'true', 'si')
+    )
+    return jsonify(pagina)
 
 @app.route("/api/admin/games", methods=["GET", "POST"])
 @admin_required
@@ -470,6 +635,169 @@ def api_admin_metrics():
     metrics = obtener_metricas()
     return jsonify({"success": True, **metrics})
 
+@app.route("/api/admin/metricas/serie", methods=["GET"])
+@admin_required
+def api_admin_metricas_serie():
+    """Serie para gráficas. Parámetros: clave=depositos|retiros|usuarios_nuevos, granularidad=hora|dia, dias=N"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    from datetime import datetime, timedelta
+    from db_config import obtener_serie_metricas
+    from metricas_admin import SERIES, GRANULARIDADES
+
+    clave = request.args.get('clave', 'depositos')
+    granularidad = request.args.get('granularidad', 'hora')
+    if clave not in SERIES or granularidad not in GRANULARIDADES:
+        return jsonify({"success": False, "error": "Parámetros inválidos"}), 400
+    dias = min(max(request.args.get('dias', 1 if granularidad == 'hora' else 30, type=int), 1), 366)
+
+    hasta = datetime.now()
+    desde = hasta - timedelta(days=dias)
+    serie = obtener_serie_metricas(clave, desde, hasta, granularidad)
+    return jsonify({"success": True, "clave": clave, "granularidad": granularidad, "serie": serie})
+
+def _rango_reporte():
+    """(granularidad, desde, hasta, tipos) de los parámetros, o lanza ValueError"""
+    from datetime import date, datetime, timedelta
+    from reportes_financieros import GRANULARIDADES
+
+    granularidad = request.args.get('granularidad', 'dia')
+    if granularidad not in GRANULARIDADES:
+        raise ValueError("granularidad")
+    hasta = datetime.fromisoformat(request.args['hasta']) if request.args.get('hasta') else datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    dias_defecto = {'hora': 2, 'dia': 30, 'mes': 365}[granularidad]
+    desde = datetime.fromisoformat(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=dias_defecto)
+    if desde >= hasta:
+        raise ValueError("rango")
+    tipos = [t for t in request.args.get('tipos', '').split(',') if t.strip()] or None
+    return granularidad, desde, hasta, tipos
+
+@app.route("/api/admin/reportes/financieros", methods=["GET"])
+@admin_required
+def api_admin_reporte_financiero():
+    """Curvas de depósitos, retiros, neto y GGR. Parámetros: granularidad=hora|dia|mes, desde, hasta, tipos
+
+    ggr_configurado=false (y GGR en null) si no hay REPORTES_TIPOS_APUESTA.
+    """
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    from db_config import obtener_reporte_financiero
+    from reportes_financieros import GGR_CONFIGURADO
+    try:
+        granularidad, desde, hasta, tipos = _rango_reporte()
+    except ValueError:
+        return jsonify({"success": False, "error": "Parámetros inválidos"}), 400
+
+    curvas = obtener_reporte_financiero(granularidad, desde, hasta, tipos)
+    if curvas is None:
+        return jsonify({"success": False, "error": "Error consultando reportes"}), 500
+    return jsonify({"success": True, "granularidad": granularidad, "desde": desde.isoformat(),
+                    "hasta": hasta.isoformat(), "ggr_configurado": GGR_CONFIGURADO, "curvas": curvas})
+
+@app.route("/api/admin/reportes/financieros/exportar", methods=["GET"])
+@admin_required
+def api_admin_exportar_reporte_financiero():
+    """Rollups en CSV o JSON transmitidos por bloques (formato=csv|json)"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    from db_config import iterar_reporte_financiero
+    from reportes_financieros import exportar_csv, exportar_json
+    try:
+        granularidad, desde, hasta, tipos = _rango_reporte()
+    except ValueError:
+        return jsonify({"success": False, "error": "Parámetros inválidos"}), 400
+
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'json'):
+        return jsonify({"success": False, "error": "Formato inválido"}), 400
+
+    filas = iterar_reporte_financiero(granularidad, desde, hasta, tipos)
+    nombre = f"reporte_{granularidad}_{desde.date()}_{hasta.date()}.{formato}"
+    if formato == 'csv':
+        generador, mimetype = exportar_csv(filas), 'text/csv'
+    else:
+        generador, mimetype = exportar_json(filas), 'application/json'
+    return Response(generador, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{nombre}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route("/api/admin/consultas-lentas", methods=["GET"])
+@admin_required
+def api_admin_consultas_lentas():
+    """Consultas SQL lentas recientes de este worker, con su huella normalizada"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    return jsonify({
+        "success": True,
+        "umbral_ms": instrumentacion_sql.SQL_LENTA_MS,
+        "consultas": instrumentacion_sql.consultas_lentas()
+    })
+
+@app.route("/api/admin/latencias", methods=["GET"])
+@admin_required
+def api_admin_latencias():
+    """p50/p90/p99/p99.9 por ruta, método y estado (todos los workers). Parámetro opcional: ruta"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    return jsonify({"success": True, "rutas": observabilidad.resumen_latencias(request.args.get('ruta') or None)})
+
+@app.route("/api/admin/perfilador", methods=["GET", "POST", "DELETE"])
+@admin_required
+def api_admin_perfilador():
+    """Estado (GET), encendido (POST {porcentaje, duracion_seg, rutas}) y apagado (DELETE) del perfilador"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    if request.method == "GET":
+        return jsonify({"success": True, **observabilidad.estado_perfilador()})
+
+    if request.method == "DELETE":
+        return jsonify({"success": True, **observabilidad.configurar_perfilador(0)})
+
+    datos = request.get_json(silent=True) or {}
+    try:
+        porcentaje = float(datos.get('porcentaje', 1))
+        duracion = min(float(datos.get('duracion_seg', 300)), 3600)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Parámetros inválidos"}), 400
+    rutas = datos.get('rutas') or []
+    if isinstance(rutas, str):
+        rutas = [rutas]
+    return jsonify({"success": True, **observabilidad.configurar_perfilador(porcentaje, duracion, rutas)})
+
+@app.route("/api/admin/perfilador/flamegraph", methods=["GET"])
+@admin_required
+def api_admin_perfilador_flamegraph():
+    """Pilas colapsadas de la sesión actual (entrada de flamegraph.pl / speedscope)"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    return Response(observabilidad.pilas_colapsadas(), mimetype="text/plain", headers={
+        'Content-Disposition': 'attachment; filename="perfil.collapsed.txt"',
+        'Cache-Control': 'no-store'
+    })
+
+@app.route("/api/admin/ruteo-tickets", methods=["GET"])
+@admin_required
+def api_admin_ruteo_tickets():
+    """Política de ruteo automático y carga por agente que ve este worker"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    from ruteo_tickets import obtener_motor
+    motor = obtener_motor()
+    if motor is None:
+        return jsonify({"success": True, "politica": None})
+    return jsonify({"success": True, **motor.estado()})
+
+@app.route("/api/admin/hash-metricas", methods=["GET"])
+@admin_required
+def api_admin_hash_metricas():
+    """Estado de la cola de hashing de contraseñas de este worker"""
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    from servicio_hash import metricas_hash
+    return jsonify({"success": True, **metricas_hash()})
+
 @app.route("/api/admin/promos", methods=["GET", "POST"])
 @admin_required
 def api_admin_promos():
@@ -486,6 +814,30 @@ def api_admin_promos():
             return jsonify({"success": True})
         return jsonify({"error": "Error al crear promoción"}), 500
 
+@app.route("/api/admin/billetera/lote", methods=["POST"])
+@admin_required
+def api_admin_billetera_lote():
+    """Aplicar muchas operaciones de saldo a la vez: {"operaciones": [{email|id_usuario, monto, tipo, clave}]}"""
+    from db_config import realizar_transacciones_lote
+    from billetera import MAX_OPERACIONES_LOTE
+    if session.get("rol") != "Administrador":
+        return jsonify({"success": False, "error": "Solo administradores"}), 403
+    try:
+        data = request.get_json(force=True, silent=True) or {}
+        operaciones = data.get("operaciones")
+        if not isinstance(operaciones, list) or not operaciones:
+            return jsonify({"success": False, "error": "Se requiere una lista de operaciones"}), 400
+        if len(operaciones) > MAX_OPERACIONES_LOTE:
+            return jsonify({"success": False, "error": f"Máximo {MAX_OPERACIONES_LOTE} operaciones por lote"}), 400
+
+        resultado = realizar_transacciones_lote(operaciones)
+        if not resultado["exito"]:
+            return jsonify({"success": False, "error": resultado["mensaje"]}), 500
+        return jsonify({"success": True, "resumen": resultado["resumen"], "resultados": resultado["resultados"]})
+    except Exception as e:
+        print(f"Error en lote de billetera: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route("/admin/usuarios/perfil")
 @admin_required
 def admin_usuario_perfil_page():
@@ -517,6 +869,8 @@ def api_admin_actualizar_usuario(id_usuario):
         if actualizar_usuario_admin(id_usuario, nombre, apellido, nueva_password):
             return jsonify({"success": True, "mensaje": "Usuario actualizado correctamente"})
         return jsonify({"success": False, "error": "No se pudo actualizar el usuario"}), 500
+    except ServicioSaturado as e:
+        return jsonify({"success": False, "error": str(e)}), 503, {"Retry-After": "2"}
     except Exception as e:
         print(f"Error actualizando usuario: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -604,20 +958,20 @@ def panel_agente_wrapper():
         
         # Solo hacer auto-login si no hay sesión o es diferente usuario
         if not session.get('user_id') or session.get('user_id') != user_email_param:
-            from db_config import get_db_connection
-            conn = get_db_connection()
-            if conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT u.id_usuario, u.nombre, u.apellido, u.email, r.nombre as nombre_rol
-                    FROM Usuario u
-                    JOIN Rol r ON u.id_rol = r.id_rol
-                    WHERE u.email = %s AND u.activo = true
-                """, (user_email_param,))
-                
-                usuario = cursor.fetchone()
-                conn.close()
+            from db_config import conexion_db
+            with conexion_db() as conn:
+                usuario = None
+                if conn:
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT u.id_usuario, u.nombre, u.apellido, u.email, r.nombre as nombre_rol
+                        FROM Usuario u
+                        JOIN Rol r ON u.id_rol = r.id_rol
+                        WHERE u.email = %s AND u.activo = true
+                    """, (user_email_param,))
+                    usuario = cursor.fetchone()
                 
+            if conn:
                 if usuario:
                     session.clear()
                     session.permanent = True
@@ -698,129 +1052,60 @@ def agente_mis_chats():
 @app.route("/api/agente/dashboard/<int:id_agente>", methods=["GET"])
 def api_agente_dashboard(id_agente):
     """Obtener métricas del dashboard para un agente"""
+    from db_config import obtener_dashboard_agente
     try:
-        from db_config import get_db_connection
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Error de conexión"}), 500
-        
-        cursor = conn.cursor()
-        
-        # Tickets pendientes (Abiertos sin asignar)
-        cursor.execute("""
-            SELECT COUNT(*) FROM Soporte 
-            WHERE estado = 'Abierto' AND id_agente IS NULL
-        """)
-        tickets_pendientes = cursor.fetchone()[0]
-        
-        # Mis tickets (asignados a este agente)
-        cursor.execute("""
-            SELECT COUNT(*) FROM Soporte 
-            WHERE id_agente = %s AND estado != 'Cerrado'
-        """, (id_agente,))
-        mis_tickets = cursor.fetchone()[0]
-        
-        # Chats en espera (graceful fallback if Chat table doesn't exist)
-        chats_esperando = 0
-        mis_chats = 0
-        try:
-            cursor.execute("""
-                SELECT COUNT(*) FROM Chat 
-                WHERE estado = 'Esperando'
-            """)
-            chats_esperando = cursor.fetchone()[0]
-            
-            # Mis chats activos
-            cursor.execute("""
-                SELECT COUNT(*) FROM Chat 
-                WHERE id_agente = %s AND estado = 'Activo'
-            """, (id_agente,))
-            mis_chats = cursor.fetchone()[0]
-        except Exception as chat_err:
-            print(f"Chat table query failed (may not exist): {chat_err}")
-        
-        # Cerrados hoy
-        cursor.execute("""
-            SELECT COUNT(*) FROM Soporte 
-            WHERE id_agente = %s 
-              AND estado = 'Cerrado' 
-              AND DATE(fecha_cierre) = CURRENT_DATE
-        """, (id_agente,))
-        cerrados_hoy = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return jsonify({
-            "tickets_pendientes": tickets_pendientes,
-            "mis_tickets": mis_tickets,
-            "chats_esperando": chats_esperando,
-            "mis_chats": mis_chats,
-            "cerrados_hoy": cerrados_hoy
-        })
+        return jsonify(obtener_dashboard_agente(id_agente))
     except Exception as e:
         print(f"Error dashboard agente: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/agente/changes", methods=["GET"])
+def api_agente_cambios():
+    """Feed de cambios: since=clave@versión,... -> {"versiones": solo las claves que cambiaron}"""
+    from db_config import obtener_cambios
+    from versiones_cambio import parsear_since
+    versiones = obtener_cambios(parsear_since(request.args.get('since')))
+    if versiones is None:
+        return jsonify({"error": "Feed de cambios no disponible"}), 503
+    return jsonify({"versiones": versiones})
+
 # Tickets
 @app.route("/api/agente/tickets", methods=["GET"])
 def api_agente_tickets():
-    """Obtener todos los tickets con filtros opcionales"""
+    """Obtener una página de tickets con filtros opcionales
+
+    Parámetros: estado, asignado (si/no), q (busca en asunto), limite,
+    cursor (siguiente_cursor de la página anterior) y total=1 para incluir el conteo.
+    """
+    from db_config import obtener_tickets
     try:
-        from db_config import get_db_connection
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"tickets": []}), 500
-        
-        cursor = conn.cursor()
-        estado = request.args.get('estado', None)
-        asignado = request.args.get('asignado', None)
-        
-        query = """
-            SELECT 
-                s.id_ticket,
-                s.asunto,
-                s.mensaje,
-                s.estado,
-                s.fecha_creacion,
-                COALESCE(uj.nombre, 'Usuario') || ' ' || COALESCE(uj.apellido, 'Desconocido') as nombre_usuario,
-                ua.nombre || ' ' || ua.apellido as nombre_agente
-            FROM Soporte s
-            LEFT JOIN Usuario uj ON s.id_jugador = uj.id_usuario
-            LEFT JOIN Usuario ua ON s.id_agente = ua.id_usuario
-            WHERE 1=1
-        """
-        
-        params = []
-        if estado:
-            query += " AND s.estado = %s"
-            params.append(estado)
-        
-        if asignado == 'si':
-            query += " AND s.id_agente IS NOT NULL"
-        elif asignado == 'no':
-            query += " AND s.id_agente IS NULL"
-        
-        query += " ORDER BY s.fecha_creacion DESC"
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
+        pagina = obtener_tickets(
+            estado=request.args.get('estado') or None,
+            asignado=request.args.get('asignado') or None,
+            buscar=(request.args.get('q') or '').strip() or None,
+            limite=request.args.get('limite', type=int),
+            cursor_pagina=request.args.get('cursor') or None,
+            con_total=request.args.get('total') in ('1', 'true', 'si')
+        )
+
         tickets = []
-        for row in rows:
+        for ticket in pagina['tickets']:
             tickets.append({
-                "id_ticket": row[0],
-                "asunto": row[1],
-                "mensaje": row[2],
-                "estado": row[3],
-                "fecha_creacion": row[4].isoformat() if row[4] else None,
-                "nombre_usuario": row[5],
-                "nombre_agente": row[6] if row[6] else None
+                "id_ticket": ticket['id_ticket'],
+                "asunto": ticket['asunto'],
+                "mensaje": ticket['mensaje'],
+                "estado": ticket['estado'],
+                "fecha_creacion": ticket['fecha_creacion'].isoformat() if ticket['fecha_creacion'] else None,
+                "nombre_usuario": ticket['nombre_usuario'],
+                "nombre_agente": ticket['nombre_agente'] if ticket['nombre_agente'] else None
             })
-        
-        conn.close()
-        return jsonify({"tickets": tickets})
+
+        respuesta = {"tickets": tickets, "siguiente_cursor": pagina['siguiente_cursor']}
+        if 'total' in pagina:
+            respuesta['total'] = pagina['total']
+        return jsonify(respuesta)
         
     except Exception as e:
         print(f"Error obtener tickets: {e}")
@@ -830,15 +1115,26 @@ def api_agente_tickets():
 
 @app.route("/api/agente/ticket/<int:id_ticket>", methods=["GET"])
 def api_agente_ticket_detalle(id_ticket):
-    """Obtener detalles de un ticket y sus respuestas"""
-    from db_config import obtener_ticket_por_id, obtener_respuestas_ticket
+    """Ticket y sus respuestas (solo las posteriores a since=id_respuesta).
+
+    Con If-None-Match de la versión que ya tiene el cliente y sin cambios: 304 sin cuerpo.
+    """
+    from db_config import obtener_detalle_ticket, version_en_etag, etag_ticket
     try:
-        ticket = obtener_ticket_por_id(id_ticket)
-        if not ticket:
+        data = obtener_detalle_ticket(
+            id_ticket,
+            version=version_en_etag(request.headers.get('If-None-Match'), id_ticket),
+            desde_id=request.args.get('since', type=int)
+        )
+        if not data:
             return jsonify({"error": "Ticket no encontrado"}), 404
-        
-        respuestas = obtener_respuestas_ticket(id_ticket)
-        return jsonify({"ticket": ticket, "respuestas": respuestas})
+
+        etag = etag_ticket(id_ticket, data['version'])
+        if data.get('sin_cambios'):
+            return "", 304, {"ETag": etag}
+        respuesta = jsonify(data)
+        respuesta.headers['ETag'] = etag
+        return respuesta
     except Exception as e:
         print(f"Error obteniendo ticket: {e}")
         return jsonify({"error": str(e)}), 500
@@ -871,15 +1167,25 @@ def api_agente_asignar_ticket():
 
 @app.route("/api/agente/responder-ticket", methods=["POST"])
 def api_agente_responder_ticket():
-    """Agregar una respuesta a un ticket"""
-    from db_config import responder_ticket
+    """Agregar una respuesta a un ticket. 409 si el ticket ya está cerrado."""
+    from db_config import responder_ticket, RESPONDIDO, TICKET_CERRADO, TICKET_NO_EXISTE
     try:
-        id_ticket = request.form.get('id_ticket')
-        id_agente = request.form.get('id_agente')
-        mensaje = request.form.get('mensaje')
-        
-        if responder_ticket(int(id_ticket), int(id_agente), mensaje, es_agente=True):
+        id_ticket = request.form.get('id_ticket', type=int)
+        id_agente = request.form.get('id_agente', type=int)
+        mensaje = request.form.get('mensaje') or ''
+
+        if id_ticket is None or id_agente is None:
+            return jsonify({"success": False, "error": "Parámetros inválidos"}), 400
+        if not mensaje.strip():
+            return jsonify({"success": False, "error": "El mensaje no puede estar vacío"}), 400
+
+        resultado = responder_ticket(id_ticket, id_agente, mensaje, es_agente=True)
+        if resultado == RESPONDIDO:
             return jsonify({"success": True})
+        if resultado == TICKET_CERRADO:
+            return jsonify({"success": False, "error": "El ticket ya está cerrado"}), 409
+        if resultado == TICKET_NO_EXISTE:
+            return jsonify({"success": False, "error": "Ticket no encontrado"}), 404
         return jsonify({"success": False, "error": "No se pudo responder"}), 500
     except Exception as e:
         print(f"Error respondiendo ticket: {e}")
@@ -904,9 +1210,10 @@ def api_agente_cerrar_ticket():
 def api_agente_chats_esperando():
     """Obtener chats en espera"""
     from db_config import obtener_chats_esperando
+    from despacho_chats import AUTOASIGNAR
     try:
         chats = obtener_chats_esperando()
-        return jsonify({"chats": chats})
+        return jsonify({"chats": chats, "autoasignacion": AUTOASIGNAR})
     except Exception as e:
         print(f"Error obteniendo chats en espera: {e}")
         return jsonify({"error": str(e)}), 500
@@ -924,32 +1231,189 @@ def api_agente_mis_chats(id_agente):
 
 @app.route("/api/agente/chat-mensajes/<int:id_chat>", methods=["GET"])
 def api_agente_chat_mensajes(id_chat):
-    """Obtener mensajes de un chat"""
+    """Obtener mensajes de un chat (todos, o solo los nuevos con since_id/since_ts)"""
     from db_config import obtener_mensajes_chat
     try:
-        data = obtener_mensajes_chat(id_chat)
-        if not data['chat']:
+        since_id = request.args.get('since_id', type=int)
+        since_ts = request.args.get('since_ts')
+        chat_etag = request.args.get('chat_etag')
+
+        data = obtener_mensajes_chat(id_chat, desde_id=since_id, desde_ts=since_ts, chat_etag=chat_etag)
+        if not data.get('chat') and not data.get('chat_sin_cambios'):
             return jsonify({"error": "Chat no encontrado"}), 404
+
         return jsonify(data)
     except Exception as e:
         print(f"Error obteniendo mensajes: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _sse_ocupado():
+    """503 cuando el worker ya tiene todos sus streams SSE: EventSource no reintenta y la página sondea"""
+    return jsonify({"error": "Demasiados streams abiertos en este servidor"}), 503, {"Retry-After": "60"}
+
+@app.route("/api/agente/chat-stream/<int:id_chat>", methods=["GET"])
+def api_agente_chat_stream(id_chat):
+    """Server-Sent Events: empuja al agente solo los mensajes nuevos del chat"""
+    from db_config import obtener_mensajes_nuevos
+    from chat_eventos import suscribir, desuscribir, evento_sse, tomar_stream, soltar_stream, INTERVALO_PING
+    import queue
+    import time
+
+    if not tomar_stream():
+        return _sse_ocupado()
+
+    # EventSource reenvía Last-Event-ID al reconectar; si no, usar el cursor del query string
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id', 0)
+    try:
+        ultimo_id = int(ultimo_id)
+    except (TypeError, ValueError):
+        ultimo_id = 0
+
+    # Cerrar el stream periódicamente para que el navegador reconecte y libere el hilo
+    duracion = int(os.environ.get('SSE_DURACION', 300))
+
+    def generar():
+        nonlocal ultimo_id
+        cola = suscribir(id_chat)
+        try:
+            yield "retry: 3000\n\n"
+            pendiente = True  # ponerse al día con lo que llegó antes de suscribirse
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin:
+                if not pendiente:
+                    try:
+                        evento = cola.get(timeout=INTERVALO_PING)
+                    except queue.Empty:
+                        yield ": ping\n\n"
+                        continue
+
+                    # Agrupar ráfagas de notificaciones en una sola consulta
+                    eventos = [evento]
+                    while True:
+                        try:
+                            eventos.append(cola.get_nowait())
+                        except queue.Empty:
+                            break
+                    for ev in eventos:
+                        if ev.get('tipo') == 'estado':
+                            yield evento_sse('estado', {"estado": ev.get('estado')})
+                    pendiente = any(ev.get('tipo') in ('mensaje', 'resync') for ev in eventos)
+
+                if pendiente:
+                    for mensaje in obtener_mensajes_nuevos(id_chat, ultimo_id):
+                        ultimo_id = mensaje['id_mensaje']
+                        yield evento_sse('mensaje', mensaje, ultimo_id)
+                    pendiente = False
+        finally:
+            desuscribir(id_chat, cola)
+
+    respuesta = Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # close() llega aunque el generador nunca haya arrancado
+    respuesta.call_on_close(soltar_stream)
+    return respuesta
+
 @app.route("/api/agente/tomar-chat", methods=["POST"])
 def api_agente_tomar_chat():
-    """Tomar un chat (asignar al agente)"""
+    """Tomar un chat (asignar al agente). 409 si otro agente lo tomó primero."""
     from db_config import tomar_chat
+    from despacho_chats import TOMADO, PERDIDO, NO_EXISTE
     try:
         id_chat = request.form.get('id_chat')
         id_agente = request.form.get('id_agente')
         
-        if tomar_chat(int(id_chat), int(id_agente)):
-            return jsonify({"success": True})
+        resultado = tomar_chat(int(id_chat), int(id_agente))
+        if resultado == TOMADO:
+            return jsonify({"success": True, "resultado": resultado})
+        if resultado == PERDIDO:
+            return jsonify({"success": False, "resultado": resultado, "error": "Otro agente ya tomó este chat"}), 409
+        if resultado == NO_EXISTE:
+            return jsonify({"success": False, "resultado": resultado, "error": "Chat no encontrado"}), 404
         return jsonify({"success": False, "error": "No se pudo tomar el chat"}), 500
     except Exception as e:
         print(f"Error tomando chat: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/agente/tomar-siguiente-chat", methods=["POST"])
+def api_agente_tomar_siguiente_chat():
+    """Tomar el chat que más tiempo lleva esperando"""
+    from db_config import tomar_siguiente_chat
+    try:
+        id_agente = request.form.get('id_agente')
+
+        id_chat = tomar_siguiente_chat(int(id_agente))
+        if id_chat is None:
+            return jsonify({"success": False, "error": "No hay chats en espera"}), 404
+        return jsonify({"success": True, "id_chat": id_chat})
+    except Exception as e:
+        print(f"Error tomando siguiente chat: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/agente/disponibilidad", methods=["POST"])
+def api_agente_disponibilidad():
+    """Recibir (o dejar de recibir) chats por asignación automática"""
+    from db_config import marcar_disponibilidad_agente
+    try:
+        id_agente = request.form.get('id_agente')
+        disponible = request.form.get('disponible') in ('1', 'true', 'si')
+
+        if marcar_disponibilidad_agente(int(id_agente), disponible):
+            return jsonify({"success": True, "disponible": disponible})
+        return jsonify({"success": False, "error": "No se pudo actualizar"}), 500
+    except Exception as e:
+        print(f"Error actualizando disponibilidad: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/agente/cola-stream", methods=["GET"])
+def api_agente_cola_stream():
+    """Server-Sent Events de la cola de espera: cuándo recargar la lista y qué chats se asignaron al agente"""
+    from db_config import registrar_latido_agente
+    from chat_eventos import suscribir, desuscribir, tomar_stream, soltar_stream, COLA_CHATS, INTERVALO_PING
+    from despacho_chats import sse_cola
+    import queue
+    import time
+
+    if not tomar_stream():
+        return _sse_ocupado()
+
+    id_agente = request.args.get('id_agente', type=int)
+    duracion = int(os.environ.get('SSE_DURACION', 300))
+
+    def generar():
+        cola = suscribir(COLA_CHATS)
+        try:
+            yield "retry: 3000\n\n"
+            ultimo_latido = 0.0
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin:
+                # El stream abierto es el latido del agente para la asignación automática
+                if id_agente and time.monotonic() - ultimo_latido >= INTERVALO_PING:
+                    registrar_latido_agente(id_agente)
+                    ultimo_latido = time.monotonic()
+                try:
+                    evento = cola.get(timeout=INTERVALO_PING)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                eventos = [evento]
+                while True:
+                    try:
+                        eventos.append(cola.get_nowait())
+                    except queue.Empty:
+                        break
+                yield from sse_cola(eventos, id_agente)
+        finally:
+            desuscribir(COLA_CHATS, cola)
+
+    respuesta = Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    respuesta.call_on_close(soltar_stream)
+    return respuesta
+
 @app.route("/api/agente/enviar-mensaje-chat", methods=["POST"])
 def api_agente_enviar_mensaje_chat():
     """Enviar un mensaje en el chat"""
@@ -989,21 +1453,20 @@ def user_tickets_page():
 def api_get_active_tickets(id_jugador):
     """Obtener tickets activos de un usuario específico"""
     try:
-        from db_config import get_db_connection
-        conn = get_db_connection()
-        if not conn:
-            return jsonify([])
-        
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id_ticket, asunto, estado, fecha_creacion
-            FROM Soporte
-            WHERE id_jugador = %s AND estado != 'Cerrado'
-            ORDER BY fecha_creacion DESC
-        """, (id_jugador,))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        from db_config import conexion_db
+        with conexion_db() as conn:
+            if not conn:
+                return jsonify([])
+
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id_ticket, asunto, estado, fecha_creacion
+                FROM Soporte
+                WHERE id_jugador = %s AND estado != 'Cerrado'
+                ORDER BY fecha_creacion DESC
+            """, (id_jugador,))
+
+            rows = cursor.fetchall()
         
         tickets = []
         for row in rows:
@@ -0,0 +1,287 @@
+"""
+Punto de entrada ASGI (modo asíncrono), alternativo a `app:app`:
+
+    gunicorn asgi:app -k uvicorn_worker.UvicornWorker --workers 2 --bind 0.0.0.0:$PORT
+    uvicorn asgi:app --port 10000        # desarrollo
+
+Las lecturas del panel de agente que se consultan en bucle o quedan abiertas
+(streams SSE del chat y de la cola, feed de cambios, mensajes, chats, tickets
+y dashboard) se atienden aquí con corrutinas y el pool asíncrono de
+db_async.py: una pestaña ociosa cuesta un socket y una cola, no un hilo del
+worker. Todo lo demás (login, billetera, PDF, admin, páginas) lo sigue
+sirviendo la app Flask de app.py en un pool de HILOS_WSGI hilos. Argon2 y
+los PDF ya corren en pools de procesos (servicio_hash.py, cola_trabajos.py),
+así que tampoco bloquean el loop.
+
+Las respuestas tienen el mismo formato que las rutas Flask equivalentes.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import db_async
+import instrumentacion_sql
+import observabilidad
+from app import app as app_flask
+from chat_eventos import evento_sse, COLA_CHATS, INTERVALO_PING
+from db_config import etag_ticket, version_en_etag
+from despacho_chats import AUTOASIGNAR, asegurar_despachador, sse_cola
+from ruteo_tickets import asegurar_ruteador
+from versiones_cambio import parsear_since
+
+# Hilos para las rutas que siguen en Flask (mismo total que gthread en render.yaml)
+HILOS_WSGI = int(os.environ.get('ASGI_HILOS_WSGI', 16))
+
+
+def _json(datos, estado=200):
+    # El proveedor JSON de Flask: mismas fechas y decimales que jsonify()
+    cuerpo = app_flask.json.dumps(datos, separators=(",", ":")) + "\n"
+    return Response(cuerpo, status_code=estado, media_type="application/json")
+
+
+def _medida(ruta):
+    """Server-Timing, contadores SQL y latencia por ruta, como los hooks de app.py.
+
+    `ruta` usa la sintaxis de Flask para que ambos modos sumen al mismo histograma.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        async def envoltura(request):
+            medicion = instrumentacion_sql.iniciar_peticion(ruta)
+            estado = 500
+            try:
+                respuesta = await vista(request)
+                estado = respuesta.status_code
+                respuesta.headers["Server-Timing"] = medicion.server_timing()
+                return respuesta
+            finally:
+                instrumentacion_sql.terminar_peticion(request.method, estado)
+                observabilidad.registrar_latencia(ruta, request.method, estado,
+                                                  (time.perf_counter() - medicion.inicio) * 1_000_000)
+        return envoltura
+    return decorador
+
+
+def _entero(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+# --- Dashboard ---
+
+@_medida("/api/agente/dashboard/<int:id_agente>")
+async def api_agente_dashboard(request):
+    return _json(await db_async.obtener_dashboard_agente(request.path_params['id_agente']))
+
+
+@_medida("/api/agente/changes")
+async def api_agente_cambios(request):
+    versiones = await db_async.obtener_cambios(parsear_since(request.query_params.get('since')))
+    if versiones is None:
+        return _json({"error": "Feed de cambios no disponible"}, 503)
+    return _json({"versiones": versiones})
+
+
+# --- Tickets ---
+
+@_medida("/api/agente/tickets")
+async def api_agente_tickets(request):
+    asegurar_ruteador()
+    args = request.query_params
+    pagina = await db_async.obtener_tickets(
+        estado=args.get('estado') or None,
+        asignado=args.get('asignado') or None,
+        buscar=(args.get('q') or '').strip() or None,
+        limite=_entero(args.get('limite')),
+        cursor_pagina=args.get('cursor') or None,
+        con_total=args.get('total') in ('1', 'true', 'si')
+    )
+    tickets = [{
+        "id_ticket": ticket['id_ticket'],
+        "asunto": ticket['asunto'],
+        "mensaje": ticket['mensaje'],
+        "estado": ticket['estado'],
+        "fecha_creacion": ticket['fecha_creacion'].isoformat() if ticket['fecha_creacion'] else None,
+        "nombre_usuario": ticket['nombre_usuario'],
+        "nombre_agente": ticket['nombre_agente'] if ticket['nombre_agente'] else None
+    } for ticket in pagina['tickets']]
+
+    respuesta = {"tickets": tickets, "siguiente_cursor": pagina['siguiente_cursor']}
+    if 'total' in pagina:
+        respuesta['total'] = pagina['total']
+    return _json(respuesta)
+
+
+@_medida("/api/agente/ticket/<int:id_ticket>")
+async def api_agente_ticket_detalle(request):
+    id_ticket = request.path_params['id_ticket']
+    data = await db_async.obtener_detalle_ticket(
+        id_ticket,
+        version=version_en_etag(request.headers.get('If-None-Match'), id_ticket),
+        desde_id=_entero(request.query_params.get('since'))
+    )
+    if not data:
+        return _json({"error": "Ticket no encontrado"}, 404)
+
+    etag = etag_ticket(id_ticket, data['version'])
+    if data.get('sin_cambios'):
+        return Response(status_code=304, headers={"ETag": etag})
+    respuesta = _json(data)
+    respuesta.headers["ETag"] = etag
+    return respuesta
+
+
+@_medida("/api/agente/mis-tickets/<int:id_agente>")
+async def api_agente_mis_tickets(request):
+    asegurar_ruteador()
+    return _json({"tickets": await db_async.obtener_tickets_agente(request.path_params['id_agente'])})
+
+
+# --- Chats ---
+
+@_medida("/api/agente/chats-esperando")
+async def api_agente_chats_esperando(request):
+    asegurar_despachador()
+    return _json({"chats": await db_async.obtener_chats_esperando(), "autoasignacion": AUTOASIGNAR})
+
+
+@_medida("/api/agente/mis-chats/<int:id_agente>")
+async def api_agente_mis_chats(request):
+    return _json({"chats": await db_async.obtener_chats_agente(request.path_params['id_agente'])})
+
+
+@_medida("/api/agente/chat-mensajes/<int:id_chat>")
+async def api_agente_chat_mensajes(request):
+    args = request.query_params
+    data = await db_async.obtener_mensajes_chat(
+        request.path_params['id_chat'],
+        desde_id=_entero(args.get('since_id')),
+        desde_ts=args.get('since_ts'),
+        chat_etag=args.get('chat_etag')
+    )
+    if not data.get('chat') and not data.get('chat_sin_cambios'):
+        return _json({"error": "Chat no encontrado"}, 404)
+    return _json(data)
+
+
+@_medida("/api/agente/chat-stream/<int:id_chat>")
+async def api_agente_chat_stream(request):
+    """Server-Sent Events como en app.py, pero esperando en una cola asyncio en lugar de un hilo"""
+    id_chat = request.path_params['id_chat']
+    ultimo_id = _entero(request.headers.get('Last-Event-ID') or request.query_params.get('ultimo_id')) or 0
+    # Sin hilo que liberar, el stream puede durar más; igual se recicla por si cambia el worker
+    duracion = int(os.environ.get('SSE_DURACION_ASGI', 1800))
+
+    async def generar():
+        nonlocal ultimo_id
+        cola = db_async.suscribir(id_chat)
+        try:
+            yield "retry: 3000\n\n"
+            pendiente = True  # ponerse al día con lo que llegó antes de suscribirse
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin:
+                if not pendiente:
+                    try:
+                        evento = await asyncio.wait_for(cola.get(), INTERVALO_PING)
+                    except asyncio.TimeoutError:
+                        yield ": ping\n\n"
+                        continue
+
+                    # Agrupar ráfagas de notificaciones en una sola consulta
+                    eventos = [evento]
+                    while not cola.empty():
+                        eventos.append(cola.get_nowait())
+                    for ev in eventos:
+                        if ev.get('tipo') == 'estado':
+                            yield evento_sse('estado', {"estado": ev.get('estado')})
+                    pendiente = any(ev.get('tipo') in ('mensaje', 'resync') for ev in eventos)
+
+                if pendiente:
+                    for mensaje in await db_async.obtener_mensajes_nuevos(id_chat, ultimo_id):
+                        ultimo_id = mensaje['id_mensaje']
+                        yield evento_sse('mensaje', mensaje, ultimo_id)
+                    pendiente = False
+        finally:
+            db_async.desuscribir(id_chat, cola)
+
+    return StreamingResponse(generar(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@_medida("/api/agente/cola-stream")
+async def api_agente_cola_stream(request):
+    """Server-Sent Events de la cola de espera (ver app.py); el stream abierto es el latido del agente"""
+    id_agente = _entero(request.query_params.get('id_agente'))
+    duracion = int(os.environ.get('SSE_DURACION_ASGI', 1800))
+
+    async def generar():
+        cola = db_async.suscribir(COLA_CHATS)
+        try:
+            yield "retry: 3000\n\n"
+            ultimo_latido = 0.0
+            fin = time.monotonic() + duracion
+            while time.monotonic() < fin:
+                if id_agente and time.monotonic() - ultimo_latido >= INTERVALO_PING:
+                    await db_async.registrar_latido_agente(id_agente)
+                    ultimo_latido = time.monotonic()
+                try:
+                    evento = await asyncio.wait_for(cola.get(), INTERVALO_PING)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                eventos = [evento]
+                while not cola.empty():
+                    eventos.append(cola.get_nowait())
+                for linea in sse_cola(eventos, id_agente):
+                    yield linea
+        finally:
+            db_async.desuscribir(COLA_CHATS, cola)
+
+    return StreamingResponse(generar(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# --- Aplicación ---
+
+@asynccontextmanager
+async def _ciclo_de_vida(aplicacion):
+    # Por worker: uvicorn corre el lifespan después del fork
+    await db_async.abrir_pool()
+    db_async.iniciar_escucha()
+    try:
+        yield
+    finally:
+        await db_async.detener_escucha()
+        await db_async.cerrar_pool()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/agente/dashboard/{id_agente:int}", api_agente_dashboard),
+        Route("/api/agente/changes", api_agente_cambios),
+        Route("/api/agente/tickets", api_agente_tickets),
+        Route("/api/agente/ticket/{id_ticket:int}", api_agente_ticket_detalle),
+        Route("/api/agente/mis-tickets/{id_agente:int}", api_agente_mis_tickets),
+        Route("/api/agente/chats-esperando", api_agente_chats_esperando),
+        Route("/api/agente/mis-chats/{id_agente:int}", api_agente_mis_chats),
+        Route("/api/agente/chat-mensajes/{id_chat:int}", api_agente_chat_mensajes),
+        Route("/api/agente/chat-stream/{id_chat:int}", api_agente_chat_stream),
+        Route("/api/agente/cola-stream", api_agente_cola_stream),
+        # Todo lo demás: la app Flask de siempre
+        Mount("/", app=WSGIMiddleware(app_flask, workers=HILOS_WSGI)),
+    ],
+    lifespan=_ciclo_de_vida,
+)
@@ -0,0 +1,48 @@
+"""
+Carga Auditoria_Respuesta para las auditorías guardadas antes de la
+migración 007. Procesa por lotes con commit en cada uno, así que se puede
+interrumpir y volver a correr: solo toma auditorías que aún no tienen renglones.
+
+    python backfill_respuestas.py [--lote 500] [--pausa 0.2]
+"""
+import argparse
+import time
+
+from db_config import get_db_connection
+from respuestas_auditoria import backfill_lote, TAMANO_LOTE_BACKFILL
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normaliza las respuestas de auditorías existentes")
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE_BACKFILL, help="auditorías por transacción")
+    parser.add_argument('--pausa', type=float, default=0.2, help="segundos entre lotes (alivia la BD)")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if not conn:
+        print("No se pudo conectar a la base de datos.")
+        return
+
+    total_auditorias = 0
+    total_respuestas = 0
+    ultimo_id = 0
+    inicio = time.monotonic()
+    try:
+        while True:
+            ultimo_id, auditorias, respuestas = backfill_lote(conn, ultimo_id, args.lote)
+            if ultimo_id is None:
+                break
+            total_auditorias += auditorias
+            total_respuestas += respuestas
+            print(f"  hasta id {ultimo_id}: {total_auditorias} auditorías, {total_respuestas} respuestas")
+            if args.pausa:
+                time.sleep(args.pausa)
+    finally:
+        conn.close()
+
+    print(f"Listo: {total_auditorias} auditorías, {total_respuestas} respuestas "
+          f"en {time.monotonic() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
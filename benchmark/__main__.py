@@ -0,0 +1,141 @@
+"""
+CLI de benchmarks: preparar | correr | comparar (ver benchmark/__init__.py)
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+MANIFIESTO = os.path.join(RAIZ, 'benchmark', 'manifiesto.json')
+
+
+def _esperar_puerto(puerto, segundos=30):
+    limite = time.time() + segundos
+    while time.time() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", puerto), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.3)
+    return False
+
+
+def _arrancar_servidor(dsn, puerto, workers, hilos):
+    """gunicorn con la misma configuración que render.yaml, apuntando a la base de benchmarks"""
+    entorno = dict(os.environ, DATABASE_URL=dsn, PORT=str(puerto))
+    proceso = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{puerto}',
+        '--workers', str(workers), '--worker-class', 'gthread', '--threads', str(hilos),
+        '--timeout', '120', '--log-level', 'warning',
+    ], cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL)
+    if not _esperar_puerto(puerto):
+        proceso.terminate()
+        raise RuntimeError("gunicorn no abrió el puerto a tiempo")
+    return proceso
+
+
+def cmd_preparar(args):
+    from benchmark.datos import preparar, ESCALAS, BaseNoVacia, BorradoNoConfirmado
+    ajustes = {clave: getattr(args, clave) for clave in ESCALAS['pequena']}
+    try:
+        datos = preparar(args.dsn, args.escala, args.semilla, ajustes, args.manifiesto, args.reiniciar,
+                         args.confirmar_borrado)
+    except (BaseNoVacia, BorradoNoConfirmado) as e:
+        sys.exit(str(e))
+    print(f"Listo en {datos['segundos_preparacion']}s: {datos['escala']}")
+
+
+def cmd_correr(args):
+    from benchmark.carga import correr, formatear
+    with open(args.manifiesto, encoding='utf-8') as f:
+        manifiesto = json.load(f)
+
+    servidor = None
+    url = args.url
+    if args.arrancar:
+        if not args.dsn:
+            sys.exit("--arrancar necesita --dsn")
+        servidor = _arrancar_servidor(args.dsn, args.puerto, args.workers, args.hilos)
+        url = f"http://127.0.0.1:{args.puerto}"
+    try:
+        resultados = correr(url, manifiesto, args.mezcla, args.usuarios, args.duracion,
+                            args.calentamiento, args.pausa, args.semilla)
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+    print(formatear(resultados, base))
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"Resultados en {args.salida}")
+
+
+def cmd_comparar(args):
+    from benchmark.carga import formatear
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding='utf-8') as f:
+        nuevo = json.load(f)
+    print(formatear(nuevo, base))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmarks reproducibles del servidor")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("preparar", help="crear esquema y datos sintéticos en el Postgres local")
+    p.add_argument('--dsn', required=True)
+    p.add_argument('--escala', default='pequena', choices=['pequena', 'mediana', 'grande'])
+    p.add_argument('--semilla', type=int, default=42)
+    p.add_argument('--manifiesto', default=MANIFIESTO)
+    p.add_argument('--reiniciar', action='store_true', help="borrar el esquema public antes de cargar")
+    p.add_argument('--confirmar-borrado', action='store_true',
+                   help="permitir --reiniciar contra un host que no es localhost ni socket unix")
+    for clave in ('jugadores', 'agentes', 'auditores', 'tickets', 'chats', 'mensajes_por_chat',
+                  'auditorias', 'transacciones'):
+        p.add_argument(f"--{clave.replace('_', '-')}", dest=clave, type=int, help="ajusta la escala")
+    p.set_defaults(funcion=cmd_preparar)
+
+    p = sub.add_parser("correr", help="generar carga y reportar throughput y percentiles")
+    p.add_argument('--url', default="http://127.0.0.1:10000")
+    p.add_argument('--dsn', help="base de benchmarks (para --arrancar)")
+    p.add_argument('--arrancar', action='store_true', help="levantar gunicorn para la corrida")
+    p.add_argument('--puerto', type=int, default=10100)
+    p.add_argument('--workers', type=int, default=2)
+    p.add_argument('--hilos', type=int, default=16)
+    p.add_argument('--manifiesto', default=MANIFIESTO)
+    p.add_argument('--mezcla', default='mixta', choices=['mixta', 'agentes', 'jugadores', 'auditores'])
+    p.add_argument('--usuarios', type=int, default=20)
+    p.add_argument('--duracion', type=float, default=60)
+    p.add_argument('--calentamiento', type=float, default=10)
+    p.add_argument('--pausa', type=float, default=0.5, help="segundos promedio entre operaciones por usuario")
+    p.add_argument('--semilla', type=int, default=42)
+    p.add_argument('--salida', help="guardar resultados JSON")
+    p.add_argument('--comparar', help="resultados JSON de una corrida base")
+    p.set_defaults(funcion=cmd_correr)
+
+    p = sub.add_parser("comparar", help="comparar dos resultados guardados")
+    p.add_argument('base')
+    p.add_argument('nuevo')
+    p.set_defaults(funcion=cmd_comparar)
+
+    args = parser.parse_args()
+    args.funcion(args)
+
+
+if __name__ == "__main__":
+    main()
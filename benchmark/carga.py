@@ -0,0 +1,294 @@
+"""
+Generador de carga contra el servidor Flask (gunicorn o app.run).
+Cada usuario virtual es un hilo con su propia sesión (cookie) que inicia
+sesión con una cuenta del manifiesto y repite operaciones de su perfil
+(agente, jugador, auditor) según los pesos de la mezcla elegida. Las
+latencias se registran por operación en histogramas HDR (los mismos de
+observabilidad.py) y al final se reporta throughput y percentiles.
+
+Solo usa la biblioteca estándar para no sumar dependencias al servidor.
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from uuid import uuid4
+
+from observabilidad import Histograma
+
+# Perfil -> [(operación, peso)]
+PERFILES = {
+    'agente': [
+        ('agente_dashboard', 3),
+        ('agente_tickets', 4),
+        ('agente_tickets_filtro', 2),
+        ('agente_chats_esperando', 4),
+        ('agente_chat_mensajes', 3),
+        ('agente_ticket_detalle', 1),
+    ],
+    'jugador': [
+        ('jugador_perfil', 3),
+        ('jugador_deposito', 2),
+        ('jugador_retiro', 1),
+        ('jugador_tickets_activos', 2),
+        ('jugador_login', 1),
+    ],
+    'auditor': [
+        ('auditor_pdf', 3),
+        ('auditor_analitica', 1),
+        ('auditor_fallas', 1),
+    ],
+}
+
+# Mezcla -> {perfil: fracción de usuarios virtuales}
+MEZCLAS = {
+    'agentes': {'agente': 1.0},
+    'jugadores': {'jugador': 1.0},
+    'auditores': {'auditor': 1.0},
+    'mixta': {'agente': 0.3, 'jugador': 0.6, 'auditor': 0.1},
+}
+
+
+class Cliente:
+    """Sesión HTTP con cookies de un usuario virtual"""
+
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def pedir(self, metodo, ruta, cuerpo=None, cabeceras=None):
+        """(estado, bytes de la respuesta)"""
+        datos = json.dumps(cuerpo).encode('utf-8') if cuerpo is not None else None
+        peticion = urllib.request.Request(self.base_url + ruta, data=datos, method=metodo)
+        if datos is not None:
+            peticion.add_header('Content-Type', 'application/json')
+        for nombre, valor in (cabeceras or {}).items():
+            peticion.add_header(nombre, valor)
+        try:
+            with self._opener.open(peticion, timeout=self.timeout) as respuesta:
+                return respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class UsuarioVirtual(threading.Thread):
+    def __init__(self, corrida, perfil, cuenta, aleatorio):
+        super().__init__(daemon=True)
+        self.corrida = corrida
+        self.perfil = perfil
+        self.cuenta = cuenta
+        self.aleatorio = aleatorio
+        self.cliente = Cliente(corrida.base_url)
+        operaciones, pesos = zip(*PERFILES[perfil])
+        self._operaciones = operaciones
+        self._pesos = pesos
+
+    def _login(self):
+        return self.cliente.pedir('POST', '/api/login', {
+            "email": self.cuenta["email"], "password": self.corrida.manifiesto["password"]
+        })
+
+    def _ruta(self, operacion):
+        m = self.corrida.manifiesto
+        a = self.aleatorio
+        cuenta = self.cuenta
+        if operacion == 'agente_dashboard':
+            return 'GET', f"/api/agente/dashboard/{cuenta['id_usuario']}", None
+        if operacion == 'agente_tickets':
+            return 'GET', "/api/agente/tickets", None
+        if operacion == 'agente_tickets_filtro':
+            return 'GET', f"/api/agente/tickets?estado={a.choice(['Abierto', 'En%20Proceso', 'Cerrado'])}&total=1", None
+        if operacion == 'agente_chats_esperando':
+            return 'GET', "/api/agente/chats-esperando", None
+        if operacion == 'agente_chat_mensajes':
+            return 'GET', f"/api/agente/chat-mensajes/{a.choice(m['chats_activos'])}", None
+        if operacion == 'agente_ticket_detalle':
+            return 'GET', f"/api/agente/ticket/{a.choice(m['tickets'])}", None
+        if operacion == 'jugador_perfil':
+            return 'POST', "/api/perfil", {"email": cuenta["email"]}
+        if operacion in ('jugador_deposito', 'jugador_retiro'):
+            return 'POST', "/api/transaccion", {
+                "email": cuenta["email"],
+                "monto": round(a.uniform(5, 100), 2),
+                "tipo": "deposito" if operacion == 'jugador_deposito' else "retiro",
+                "clave_idempotencia": uuid4().hex,
+            }
+        if operacion == 'jugador_tickets_activos':
+            return 'GET', f"/api/support/tickets/active/{cuenta['id_usuario']}", None
+        if operacion == 'auditor_pdf':
+            return 'GET', f"/api/pdf_auditoria/{a.choice(m['auditorias'])}", None
+        if operacion == 'auditor_analitica':
+            return 'GET', f"/api/auditor/analitica?periodo={a.choice(['dia', 'semana', 'mes'])}", None
+        if operacion == 'auditor_fallas':
+            return 'GET', f"/api/auditor/fallas?posicion={a.randint(1, 10)}", None
+        raise ValueError(operacion)
+
+    def run(self):
+        corrida = self.corrida
+        estado, _ = corrida.medir('login', self._login)
+        if estado != 200:
+            corrida.error_login(self.cuenta["email"], estado)
+        while not corrida.detener.is_set():
+            operacion = self.aleatorio.choices(self._operaciones, weights=self._pesos)[0]
+            if operacion == 'jugador_login':
+                corrida.medir('login', self._login)
+            else:
+                metodo, ruta, cuerpo = self._ruta(operacion)
+                corrida.medir(operacion, lambda: self.cliente.pedir(metodo, ruta, cuerpo))
+            if corrida.pausa:
+                # Tiempo de "lectura" exponencial alrededor de la pausa configurada
+                corrida.detener.wait(self.aleatorio.expovariate(1 / corrida.pausa))
+
+
+class Corrida:
+    def __init__(self, base_url, manifiesto, pausa=0.0):
+        self.base_url = base_url
+        self.manifiesto = manifiesto
+        self.pausa = pausa
+        self.detener = threading.Event()
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._errores = {}
+        self._estados = {}
+        self.errores_login = []
+        self.midiendo = False
+
+    def medir(self, operacion, funcion):
+        inicio = time.perf_counter()
+        try:
+            estado, cuerpo = funcion()
+        except Exception as e:
+            estado, cuerpo = type(e).__name__, b""
+        microsegundos = (time.perf_counter() - inicio) * 1_000_000
+        # La billetera y el login responden 200 con {"exito": false} en errores de negocio
+        if estado == 200 and cuerpo[:1] == b"{" and b'"exito"' in cuerpo:
+            try:
+                if json.loads(cuerpo).get("exito") is False:
+                    estado = "200-exito-false"
+            except ValueError:
+                pass
+        if self.midiendo:
+            with self._lock:
+                histograma = self._histogramas.get(operacion)
+                if histograma is None:
+                    histograma = self._histogramas[operacion] = Histograma()
+                histograma.registrar(microsegundos)
+                clave = (operacion, str(estado))
+                self._estados[clave] = self._estados.get(clave, 0) + 1
+                if not (isinstance(estado, int) and estado < 400):
+                    self._errores[operacion] = self._errores.get(operacion, 0) + 1
+        return estado, None
+
+    def error_login(self, email, estado):
+        with self._lock:
+            self.errores_login.append({"email": email, "estado": estado})
+
+    def resultados(self, segundos):
+        with self._lock:
+            operaciones = {}
+            for operacion, h in sorted(self._histogramas.items()):
+                operaciones[operacion] = {
+                    **h.resumen(),
+                    "rps": round(h.total / segundos, 2) if segundos else 0,
+                    "errores": self._errores.get(operacion, 0),
+                    "estados": {e: n for (op, e), n in self._estados.items() if op == operacion},
+                }
+            total = Histograma()
+            for h in self._histogramas.values():
+                total.combinar(h)
+        return {
+            "segundos": round(segundos, 2),
+            "total": {**total.resumen(), "rps": round(total.total / segundos, 2) if segundos else 0,
+                      "errores": sum(self._errores.values())},
+            "operaciones": operaciones,
+            "errores_login": self.errores_login[:20],
+        }
+
+
+def _cuentas(manifiesto, perfil):
+    return {
+        'agente': manifiesto['agentes'],
+        'jugador': manifiesto['jugadores'],
+        'auditor': manifiesto['auditores'],
+    }[perfil]
+
+
+def correr(base_url, manifiesto, mezcla='mixta', usuarios=20, duracion=60, calentamiento=10,
+           pausa=0.5, semilla=42):
+    """Ejecuta la carga y devuelve el dict de resultados (solo cuenta después del calentamiento)"""
+    aleatorio = random.Random(semilla)
+    corrida = Corrida(base_url, manifiesto, pausa)
+
+    hilos = []
+    fracciones = MEZCLAS[mezcla]
+    restantes = usuarios
+    for n, (perfil, fraccion) in enumerate(fracciones.items()):
+        cantidad = restantes if n == len(fracciones) - 1 else round(usuarios * fraccion)
+        restantes -= cantidad
+        cuentas = _cuentas(manifiesto, perfil)
+        for i in range(cantidad):
+            cuenta = cuentas[i % len(cuentas)]
+            hilos.append(UsuarioVirtual(corrida, perfil, cuenta, random.Random(aleatorio.random())))
+
+    for hilo in hilos:
+        hilo.start()
+    if calentamiento:
+        print(f"Calentando {calentamiento}s con {len(hilos)} usuarios virtuales...")
+        time.sleep(calentamiento)
+    corrida.midiendo = True
+    inicio = time.perf_counter()
+    print(f"Midiendo {duracion}s (mezcla {mezcla})...")
+    time.sleep(duracion)
+    corrida.midiendo = False
+    segundos = time.perf_counter() - inicio
+    corrida.detener.set()
+    for hilo in hilos:
+        hilo.join(timeout=5)
+
+    resultados = corrida.resultados(segundos)
+    resultados["config"] = {
+        "url": base_url, "mezcla": mezcla, "usuarios": usuarios, "duracion": duracion,
+        "calentamiento": calentamiento, "pausa": pausa, "semilla": semilla,
+        "escala": manifiesto.get("escala"),
+    }
+    return resultados
+
+
+# --- Reporte ---
+
+def _fila(nombre, datos, base=None):
+    columnas = [
+        f"{nombre:<26}", f"{datos.get('conteo', 0):>8}", f"{datos.get('rps', 0):>8.1f}",
+        f"{datos.get('errores', 0):>6}",
+    ]
+    for clave in ('p50_ms', 'p90_ms', 'p99_ms', 'p99.9_ms', 'max_ms'):
+        valor = datos.get(clave, 0)
+        texto = f"{valor:>9.1f}"
+        if base and base.get(clave):
+            cambio = (valor - base[clave]) / base[clave] * 100
+            texto += f" ({cambio:+.0f}%)"
+        columnas.append(texto)
+    return "  ".join(columnas)
+
+
+def formatear(resultados, base=None):
+    """Tabla de texto; con `base` (resultados anteriores) agrega el cambio porcentual de cada percentil"""
+    encabezado = "  ".join([
+        f"{'operación':<26}", f"{'n':>8}", f"{'req/s':>8}", f"{'err':>6}",
+        f"{'p50 ms':>9}", f"{'p90 ms':>9}", f"{'p99 ms':>9}", f"{'p99.9 ms':>9}", f"{'max ms':>9}",
+    ])
+    base_ops = (base or {}).get("operaciones", {})
+    lineas = [encabezado, "-" * len(encabezado)]
+    for operacion, datos in resultados["operaciones"].items():
+        lineas.append(_fila(operacion, datos, base_ops.get(operacion)))
+    lineas.append("-" * len(encabezado))
+    lineas.append(_fila("TOTAL", resultados["total"], (base or {}).get("total")))
+    if resultados.get("errores_login"):
+        lineas.append(f"Logins fallidos: {len(resultados['errores_login'])} (ej. {resultados['errores_login'][0]})")
+    return "\n".join(lineas)
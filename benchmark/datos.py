@@ -0,0 +1,351 @@
+"""
+Preparación del Postgres local de benchmarks.
+Crea el esquema base, aplica migraciones/*.sql en orden, carga
+test_data_agente.sql como plantilla (sus cuentas fijas, con un hash Argon2
+real en lugar del de ejemplo) y genera un conjunto sintético del tamaño de
+la escala elegida. Todo se genera con semillas fijas: la misma escala y la
+misma semilla dan los mismos datos, así que dos corridas son comparables.
+
+Al final escribe un manifiesto JSON con las credenciales y los ids que usa
+benchmark.carga para armar las peticiones.
+"""
+import glob
+import json
+import os
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from reglas_auditoria import obtener_motor, reevaluar_archivo
+from respuestas_auditoria import backfill_lote
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ESQUEMA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'esquema_base.sql')
+PLANTILLA = os.path.join(RAIZ, 'test_data_agente.sql')
+HASH_EJEMPLO = '$argon2id$v=19$m=65536,t=3,p=4$somesalt$hash'
+
+# Hosts donde --reiniciar procede sin --confirmar-borrado (además de sockets unix)
+HOSTS_LOCALES = ('localhost', '127.0.0.1', '::1')
+
+# Contraseña de todas las cuentas del benchmark (plantilla y sintéticas)
+PASSWORD = 'bench123'
+
+ESCALAS = {
+    'pequena': {
+        'jugadores': 1_000, 'agentes': 5, 'auditores': 3, 'tickets': 2_000, 'chats': 1_000,
+        'mensajes_por_chat': 8, 'auditorias': 500, 'transacciones': 20_000,
+    },
+    'mediana': {
+        'jugadores': 20_000, 'agentes': 25, 'auditores': 10, 'tickets': 50_000, 'chats': 20_000,
+        'mensajes_por_chat': 12, 'auditorias': 10_000, 'transacciones': 500_000,
+    },
+    'grande': {
+        'jugadores': 200_000, 'agentes': 100, 'auditores': 30, 'tickets': 500_000, 'chats': 200_000,
+        'mensajes_por_chat': 15, 'auditorias': 100_000, 'transacciones': 5_000_000,
+    },
+}
+
+PREGUNTAS_AUDITORIA = [
+    "¿Las mesas de juego cuentan con supervisión permanente?",
+    "¿Se verifica la identidad de jugadores en depósitos mayores al umbral?",
+    "¿Los registros de caja cuadran al cierre de turno?",
+    "¿Las máquinas muestran el RTP autorizado?",
+    "¿Se registran las incidencias de seguridad en bitácora?",
+    "¿El personal conoce el protocolo de juego responsable?",
+    "¿Las cámaras cubren todas las zonas de efectivo?",
+    "¿Se aplican límites de apuesta según la normativa?",
+    "¿Los bonos activos tienen términos publicados?",
+    "¿Se atienden los tickets de soporte en menos de 24 horas?",
+    "¿Los retiros se procesan con doble autorización?",
+    "¿Existe respaldo diario de la base de datos?",
+    "¿Se revisan los accesos de administradores cada mes?",
+    "¿Los menores de edad son rechazados en el registro?",
+    "¿Se reportan operaciones inusuales a cumplimiento?",
+]
+RESPUESTAS = ["Cumple", "Cumple", "Cumple", "Cumple Parcialmente", "No Cumple", "No Aplica"]
+ASUNTOS = [
+    "No puedo depositar fondos", "Problema con retiro", "Cuenta bloqueada", "Consulta sobre bonos",
+    "Error al iniciar sesión", "Saldo incorrecto", "Juego se congeló", "Cambio de datos personales",
+]
+ESTADOS_TICKET = ["Abierto", "Abierto", "En Proceso", "Cerrado", "Cerrado", "Cerrado"]
+
+
+def _ejecutar_archivo(cursor, ruta, reemplazos=None):
+    with open(ruta, encoding='utf-8') as f:
+        sql = f.read()
+    for viejo, nuevo in (reemplazos or {}).items():
+        sql = sql.replace(viejo, nuevo)
+    cursor.execute(sql)
+
+
+class BorradoNoConfirmado(Exception):
+    """Se pidió reiniciar una base que no es local sin --confirmar-borrado"""
+
+
+def es_base_local(conn):
+    """True si la conexión va por socket unix o a localhost (el Postgres de benchmarks)"""
+    parametros = conn.get_dsn_parameters()
+    hosts = (parametros.get('hostaddr') or parametros.get('host') or '').split(',')
+    return all(not host or host.startswith('/') or host in HOSTS_LOCALES for host in hosts)
+
+
+def aplicar_esquema(conn, reiniciar=False, confirmar_borrado=False):
+    """Esquema base + migraciones en orden (idempotente: todo usa IF NOT EXISTS).
+
+    reiniciar borra el esquema public completo; contra un host que no es local
+    se rechaza salvo que se confirme explícitamente.
+    """
+    if reiniciar and not confirmar_borrado and not es_base_local(conn):
+        raise BorradoNoConfirmado(
+            f"--reiniciar borra el esquema public de {conn.get_dsn_parameters().get('host')}, "
+            "que no es local; agrega --confirmar-borrado si de verdad es la base de benchmarks"
+        )
+    conn.autocommit = True
+    cursor = conn.cursor()
+    if reiniciar:
+        cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    _ejecutar_archivo(cursor, ESQUEMA_BASE)
+    for ruta in sorted(glob.glob(os.path.join(RAIZ, 'migraciones', '*.sql'))):
+        print(f"  migración {os.path.basename(ruta)}")
+        _ejecutar_archivo(cursor, ruta)
+    cursor.close()
+    conn.autocommit = False
+
+
+def _ids_rol(cursor, rol):
+    cursor.execute("""
+        SELECT u.id_usuario, u.email FROM Usuario u JOIN Rol r ON u.id_rol = r.id_rol
+        WHERE r.nombre = %s ORDER BY u.id_usuario
+    """, (rol,))
+    return cursor.fetchall()
+
+
+def _crear_usuarios(cursor, rol, prefijo, cantidad, hash_password):
+    cursor.execute("""
+        INSERT INTO Usuario (id_rol, nombre, apellido, curp, email, password_hash, fecha_registro, activo)
+        SELECT (SELECT id_rol FROM Rol WHERE nombre = %(rol)s),
+               'Bench' || g, %(prefijo)s, 'BENC' || lpad(g::text, 14, '0'),
+               %(prefijo)s || g || '@bench.local', %(hash)s,
+               NOW() - (random() * interval '365 days'), random() > 0.03
+        FROM generate_series(1, %(cantidad)s) AS g
+        ON CONFLICT (email) DO NOTHING
+    """, {"rol": rol, "prefijo": prefijo, "cantidad": cantidad, "hash": hash_password})
+    cursor.execute("""
+        INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion)
+        SELECT id_usuario, round((random() * 5000)::numeric, 2), NOW()
+        FROM Usuario WHERE email LIKE %s
+        ON CONFLICT (id_usuario) DO NOTHING
+    """, (f"{prefijo}%@bench.local",))
+
+
+def _generar_soporte(cursor, escala):
+    cursor.execute("""
+        CREATE TEMP TABLE bench_jugadores AS
+        SELECT row_number() OVER (ORDER BY id_usuario) AS n, id_usuario
+        FROM Usuario WHERE email LIKE 'jugador%@bench.local';
+        CREATE TEMP TABLE bench_agentes AS
+        SELECT row_number() OVER (ORDER BY id_usuario) AS n, id_usuario
+        FROM Usuario WHERE email LIKE 'agente%@bench.local';
+    """)
+    cursor.execute("""
+        INSERT INTO Soporte (id_jugador, id_agente, asunto, mensaje, estado, fecha_creacion, fecha_cierre)
+        SELECT j.id_usuario,
+               CASE WHEN t.estado = 'Abierto' AND random() < 0.6 THEN NULL ELSE a.id_usuario END,
+               t.asunto, 'Detalle del problema reportado por el jugador (' || t.g || ').', t.estado, t.creado,
+               CASE WHEN t.estado = 'Cerrado' THEN t.creado + random() * interval '2 days' END
+        FROM (
+            SELECT g,
+                   (%(estados)s::text[])[1 + floor(random() * %(n_estados)s)::int] AS estado,
+                   (%(asuntos)s::text[])[1 + floor(random() * %(n_asuntos)s)::int] AS asunto,
+                   NOW() - random() * interval '180 days' AS creado,
+                   1 + floor(random() * %(jugadores)s)::int AS nj,
+                   1 + floor(random() * %(agentes)s)::int AS na
+            FROM generate_series(1, %(tickets)s) AS g
+        ) t
+        JOIN bench_jugadores j ON j.n = t.nj
+        JOIN bench_agentes a ON a.n = t.na
+    """, {
+        "estados": ESTADOS_TICKET, "n_estados": len(ESTADOS_TICKET),
+        "asuntos": ASUNTOS, "n_asuntos": len(ASUNTOS),
+        "jugadores": escala['jugadores'], "agentes": escala['agentes'], "tickets": escala['tickets'],
+    })
+    cursor.execute("""
+        INSERT INTO Chat (id_jugador, id_agente, estado, fecha_inicio, fecha_asignacion, fecha_cierre)
+        SELECT j.id_usuario,
+               CASE WHEN c.estado = 'Esperando' THEN NULL ELSE a.id_usuario END,
+               c.estado, c.inicio,
+               CASE WHEN c.estado <> 'Esperando' THEN c.inicio + interval '2 minutes' END,
+               CASE WHEN c.estado = 'Cerrado' THEN c.inicio + random() * interval '1 hour' END
+        FROM (
+            SELECT g,
+                   CASE WHEN r < 0.05 THEN 'Esperando' WHEN r < 0.15 THEN 'Activo' ELSE 'Cerrado' END AS estado,
+                   NOW() - random() * interval '90 days' AS inicio,
+                   1 + floor(random() * %(jugadores)s)::int AS nj,
+                   1 + floor(random() * %(agentes)s)::int AS na
+            FROM (SELECT g, random() AS r FROM generate_series(1, %(chats)s) AS g) s
+        ) c
+        JOIN bench_jugadores j ON j.n = c.nj
+        JOIN bench_agentes a ON a.n = c.na
+    """, {"jugadores": escala['jugadores'], "agentes": escala['agentes'], "chats": escala['chats']})
+    cursor.execute("""
+        INSERT INTO Mensaje_Chat (id_chat, id_usuario, mensaje, es_agente, fecha_mensaje, leido)
+        SELECT c.id_chat,
+               CASE WHEN m %% 2 = 0 AND c.id_agente IS NOT NULL THEN c.id_agente ELSE c.id_jugador END,
+               'Mensaje ' || m || ' del chat ' || c.id_chat,
+               m %% 2 = 0 AND c.id_agente IS NOT NULL,
+               c.fecha_inicio + m * interval '40 seconds',
+               c.estado = 'Cerrado' OR m < %(mensajes)s - 1
+        FROM Chat c
+        CROSS JOIN generate_series(1, %(mensajes)s) AS m
+        WHERE c.id_jugador IN (SELECT id_usuario FROM bench_jugadores)
+    """, {"mensajes": escala['mensajes_por_chat']})
+
+
+def _generar_transacciones(cursor, escala):
+    # Depósitos y retiros completados con algunos pendientes/rechazados, repartidos en un año
+    cursor.execute("""
+        INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, fecha_transaccion)
+        SELECT j.id_usuario,
+               CASE WHEN t.r < 0.6 THEN 'Depósito' ELSE 'Retiro' END,
+               round((10 + random() * 990)::numeric, 2),
+               CASE WHEN t.r2 < 0.95 THEN 'Completada' WHEN t.r2 < 0.98 THEN 'Pendiente' ELSE 'Rechazada' END,
+               NOW() - random() * interval '365 days'
+        FROM (
+            SELECT g, random() AS r, random() AS r2, 1 + floor(random() * %(jugadores)s)::int AS nj
+            FROM generate_series(1, %(transacciones)s) AS g
+        ) t
+        JOIN bench_jugadores j ON j.n = t.nj
+    """, {"jugadores": escala['jugadores'], "transacciones": escala['transacciones']})
+
+
+def _generar_auditorias(cursor, escala, semilla):
+    aleatorio = random.Random(semilla)
+    motor = obtener_motor()
+    auditores = [id_usuario for id_usuario, email in _ids_rol(cursor, 'Auditor') if email.endswith('@bench.local')]
+    ahora = time.time()
+    filas = []
+    for n in range(escala['auditorias']):
+        preguntas = aleatorio.sample(PREGUNTAS_AUDITORIA, aleatorio.randint(10, len(PREGUNTAS_AUDITORIA)))
+        respuestas = {p: aleatorio.choice(RESPUESTAS) for p in preguntas}
+        datos = {
+            "respuestas": respuestas,
+            "comentarios": {},
+            "no_conformidades": motor.evaluar(respuestas),
+        }
+        fecha = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ahora - aleatorio.random() * 365 * 86400))
+        filas.append((aleatorio.choice(auditores), f"Auditoría bench {n + 1}", json.dumps(datos, ensure_ascii=False), fecha))
+        if len(filas) >= 2000:
+            execute_values(cursor, "INSERT INTO Auditoria (id_usuario, resumen, datos_auditoria, fecha_auditoria) VALUES %s", filas)
+            filas = []
+    if filas:
+        execute_values(cursor, "INSERT INTO Auditoria (id_usuario, resumen, datos_auditoria, fecha_auditoria) VALUES %s", filas)
+
+
+def _manifiesto(cursor, semilla, escala, muestra=200):
+    aleatorio = random.Random(semilla)
+
+    def muestrear(filas):
+        return filas if len(filas) <= muestra else aleatorio.sample(filas, muestra)
+
+    jugadores = muestrear([{"email": e, "id_usuario": i} for i, e in _ids_rol(cursor, 'Jugador')])
+    agentes = [{"email": e, "id_usuario": i} for i, e in _ids_rol(cursor, 'Agente de Soporte')]
+    auditores = [{"email": e, "id_usuario": i} for i, e in _ids_rol(cursor, 'Auditor')]
+    cursor.execute("SELECT id_auditoria FROM Auditoria ORDER BY id_auditoria")
+    auditorias = muestrear([fila[0] for fila in cursor.fetchall()])
+    cursor.execute("SELECT id_chat FROM Chat WHERE estado = 'Activo' ORDER BY id_chat")
+    chats = muestrear([fila[0] for fila in cursor.fetchall()])
+    cursor.execute("SELECT id_ticket FROM Soporte ORDER BY id_ticket DESC LIMIT %s", (muestra,))
+    tickets = [fila[0] for fila in cursor.fetchall()]
+    return {
+        "password": PASSWORD,
+        "semilla": semilla,
+        "escala": escala,
+        "jugadores": jugadores,
+        "agentes": agentes,
+        "auditores": auditores,
+        "auditorias": auditorias,
+        "chats_activos": chats,
+        "tickets": tickets,
+    }
+
+
+class BaseNoVacia(Exception):
+    """La base ya tiene datos de benchmark y no se pidió reiniciarla"""
+
+
+def preparar(dsn, escala='pequena', semilla=42, ajustes=None, manifiesto=None, reiniciar=False,
+             confirmar_borrado=False):
+    """Crea el esquema y el conjunto de datos; devuelve el manifiesto (y lo escribe si se da ruta).
+
+    Con reiniciar=True borra el esquema public completo antes de empezar:
+    usar solo contra el Postgres local de benchmarks (otro host exige confirmar_borrado).
+    """
+    from servicio_hash import pwd_context
+
+    config = dict(ESCALAS[escala])
+    config.update({k: v for k, v in (ajustes or {}).items() if v is not None})
+    inicio = time.time()
+
+    conn = psycopg2.connect(dsn)
+    try:
+        print("Aplicando esquema base y migraciones...")
+        aplicar_esquema(conn, reiniciar, confirmar_borrado)
+        cursor = conn.cursor()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM Usuario WHERE email LIKE '%@bench.local')")
+        if cursor.fetchone()[0]:
+            raise BaseNoVacia("La base ya tiene datos de benchmark; usa --reiniciar para regenerarla")
+        conn.commit()
+
+        # Un solo hash real para todas las cuentas: calcular Argon2 por usuario tomaría horas
+        hash_password = pwd_context.hash(PASSWORD)
+        print("Cargando plantilla test_data_agente.sql...")
+        _ejecutar_archivo(cursor, PLANTILLA, {HASH_EJEMPLO: hash_password})
+        conn.commit()
+
+        cursor.execute("SELECT setseed(%s)", (((semilla % 2000) - 1000) / 1000.0,))
+        print(f"Generando datos sintéticos ({escala}): {config}")
+        _crear_usuarios(cursor, 'Jugador', 'jugador', config['jugadores'], hash_password)
+        _crear_usuarios(cursor, 'Agente de Soporte', 'agente', config['agentes'], hash_password)
+        _crear_usuarios(cursor, 'Auditor', 'auditor', config['auditores'], hash_password)
+        _crear_usuarios(cursor, 'Administrador', 'admin', 1, hash_password)
+        conn.commit()
+        _generar_soporte(cursor, config)
+        conn.commit()
+        print("  transacciones...")
+        _generar_transacciones(cursor, config)
+        conn.commit()
+        print("  auditorías...")
+        _generar_auditorias(cursor, config, semilla)
+        conn.commit()
+
+        # Normalizar y calificar las auditorías como en producción (migraciones 007 y 008)
+        ultimo_id = 0
+        while ultimo_id is not None:
+            ultimo_id, _, _ = backfill_lote(conn, ultimo_id)
+        reevaluar_archivo(conn, obtener_motor(), todas=True)
+
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("VACUUM ANALYZE")
+        conn.autocommit = False
+
+        datos = _manifiesto(cursor, semilla, {"nombre": escala, **config})
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Contadores y rollups materializados desde el libro recién cargado
+    os.environ['DATABASE_URL'] = dsn
+    from metricas_admin import reconciliar_ahora
+    from reportes_financieros import agregar_ahora
+    reconciliar_ahora(horas=None)
+    agregar_ahora()
+
+    datos["segundos_preparacion"] = round(time.time() - inicio, 1)
+    if manifiesto:
+        with open(manifiesto, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False, indent=2)
+        print(f"Manifiesto escrito en {manifiesto}")
+    return datos
@@ -0,0 +1,101 @@
+-- ===================================================================
+-- ESQUEMA BASE PARA EL POSTGRES LOCAL DE BENCHMARKS
+-- ===================================================================
+-- Las tablas originales se crearon a mano en Neon y el repositorio solo
+-- trae las migraciones incrementales. Este esquema reproduce las columnas
+-- que usan db_config.py, billetera.py y las plantillas; después se aplican
+-- migraciones/*.sql en orden, igual que en producción.
+
+CREATE TABLE IF NOT EXISTS Rol (
+    id_rol SERIAL PRIMARY KEY,
+    nombre VARCHAR(50) NOT NULL UNIQUE
+);
+
+INSERT INTO Rol (nombre)
+VALUES ('Jugador'), ('Administrador'), ('Auditor'), ('Agente de Soporte')
+ON CONFLICT (nombre) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS Usuario (
+    id_usuario SERIAL PRIMARY KEY,
+    id_rol INTEGER NOT NULL REFERENCES Rol (id_rol),
+    nombre VARCHAR(100) NOT NULL,
+    apellido VARCHAR(100) NOT NULL,
+    curp VARCHAR(18),
+    email VARCHAR(150) NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    fecha_registro TIMESTAMP DEFAULT NOW(),
+    activo BOOLEAN NOT NULL DEFAULT true
+);
+
+CREATE TABLE IF NOT EXISTS Saldo (
+    id_usuario INTEGER PRIMARY KEY REFERENCES Usuario (id_usuario) ON DELETE CASCADE,
+    saldo_actual NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    ultima_actualizacion TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS Transaccion (
+    id_transaccion SERIAL PRIMARY KEY,
+    id_usuario INTEGER NOT NULL REFERENCES Usuario (id_usuario) ON DELETE CASCADE,
+    tipo_transaccion VARCHAR(30) NOT NULL,
+    monto NUMERIC(12, 2) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'Completada',
+    fecha_transaccion TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS Juego (
+    id_juego SERIAL PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    descripcion TEXT,
+    rtp NUMERIC(5, 2),
+    min_apuesta NUMERIC(10, 2),
+    max_apuesta NUMERIC(10, 2),
+    activo BOOLEAN NOT NULL DEFAULT true
+);
+
+CREATE TABLE IF NOT EXISTS Bono (
+    id_bono SERIAL PRIMARY KEY,
+    nombre_bono VARCHAR(100) NOT NULL,
+    tipo VARCHAR(50),
+    descripcion TEXT,
+    fecha_expiracion DATE,
+    activo BOOLEAN NOT NULL DEFAULT true
+);
+
+CREATE TABLE IF NOT EXISTS Auditoria (
+    id_auditoria SERIAL PRIMARY KEY,
+    id_usuario INTEGER REFERENCES Usuario (id_usuario) ON DELETE SET NULL,
+    resumen TEXT,
+    datos_auditoria TEXT,
+    fecha_auditoria TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS Soporte (
+    id_ticket SERIAL PRIMARY KEY,
+    id_jugador INTEGER NOT NULL REFERENCES Usuario (id_usuario) ON DELETE CASCADE,
+    id_agente INTEGER REFERENCES Usuario (id_usuario) ON DELETE SET NULL,
+    asunto VARCHAR(200) NOT NULL,
+    mensaje TEXT,
+    estado VARCHAR(20) NOT NULL DEFAULT 'Abierto',
+    fecha_creacion TIMESTAMP DEFAULT NOW(),
+    fecha_cierre TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS Chat (
+    id_chat SERIAL PRIMARY KEY,
+    id_jugador INTEGER NOT NULL REFERENCES Usuario (id_usuario) ON DELETE CASCADE,
+    id_agente INTEGER REFERENCES Usuario (id_usuario) ON DELETE SET NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'Esperando',
+    fecha_inicio TIMESTAMP DEFAULT NOW(),
+    fecha_asignacion TIMESTAMP,
+    fecha_cierre TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS Mensaje_Chat (
+    id_mensaje SERIAL PRIMARY KEY,
+    id_chat INTEGER NOT NULL REFERENCES Chat (id_chat) ON DELETE CASCADE,
+    id_usuario INTEGER REFERENCES Usuario (id_usuario) ON DELETE SET NULL,
+    mensaje TEXT NOT NULL,
+    es_agente BOOLEAN NOT NULL DEFAULT false,
+    fecha_mensaje TIMESTAMP DEFAULT NOW(),
+    leido BOOLEAN NOT NULL DEFAULT false
+);
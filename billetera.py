@@ -0,0 +1,313 @@
+"""
+Operaciones de billetera (Saldo + libro Transaccion).
+Cada operación valida fondos y actualiza el saldo en UNA sentencia
+condicional (UPDATE ... WHERE saldo + delta >= 0 RETURNING) y escribe su
+renglón en Transaccion dentro de la misma transacción. Una clave de
+idempotencia opcional hace que los reintentos de la app no dupliquen cargos.
+"""
+import math
+
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+# Tipos que manda la app -> tipo_transaccion en el libro
+TIPOS_LIBRO = {
+    'deposito': 'Depósito',
+    'retiro': 'Retiro',
+}
+
+LARGO_MAX_CLAVE = 64
+
+SQL_OPERACION = """
+    WITH u AS (
+        SELECT us.id_usuario
+        FROM Usuario us
+        JOIN Saldo sa ON sa.id_usuario = us.id_usuario
+        WHERE us.email = %(email)s
+    ),
+    previa AS (
+        SELECT t.id_transaccion, t.saldo_resultante
+        FROM Transaccion t
+        JOIN u ON t.id_usuario = u.id_usuario
+        WHERE t.clave_idempotencia = %(clave)s
+    ),
+    upd AS (
+        UPDATE Saldo s
+        SET saldo_actual = s.saldo_actual + %(delta)s, ultima_actualizacion = NOW()
+        FROM u
+        WHERE s.id_usuario = u.id_usuario
+          AND s.saldo_actual + %(delta)s >= 0
+          AND NOT EXISTS (SELECT 1 FROM previa)
+        RETURNING s.id_usuario, s.saldo_actual
+    ),
+    ins AS (
+        INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, fecha_transaccion,
+                                 clave_idempotencia, saldo_resultante)
+        SELECT id_usuario, %(tipo_libro)s, %(monto)s, 'Completada', NOW(), %(clave)s, saldo_actual
+        FROM upd
+        RETURNING id_transaccion
+    )
+    SELECT u.id_usuario,
+           upd.saldo_actual,
+           ins.id_transaccion,
+           previa.id_transaccion AS id_previa,
+           previa.saldo_resultante AS saldo_previa
+    FROM u
+    LEFT JOIN upd ON true
+    LEFT JOIN ins ON true
+    LEFT JOIN previa ON true
+"""
+
+SQL_PREVIA = """
+    SELECT t.id_transaccion, t.saldo_resultante
+    FROM Transaccion t
+    JOIN Usuario u ON t.id_usuario = u.id_usuario
+    WHERE u.email = %s AND t.clave_idempotencia = %s
+"""
+
+
+def normalizar_clave(clave):
+    """Clave de idempotencia limpia o None"""
+    if clave is None:
+        return None
+    clave = str(clave).strip()
+    if not clave:
+        return None
+    return clave[:LARGO_MAX_CLAVE]
+
+
+def validar_operacion(monto, tipo):
+    """Mensaje de error si la operación no es válida, None si está bien"""
+    try:
+        monto = float(monto)
+    except (TypeError, ValueError):
+        return "Monto inválido"
+    # El libro guarda centavos: 0.004 se volvería un movimiento de 0.00
+    if not math.isfinite(monto) or round(monto, 2) <= 0:
+        return "El monto debe ser mayor a cero"
+    if not tipo:
+        return "Falta el tipo de transacción"
+    if not isinstance(tipo, str) or tipo not in TIPOS_LIBRO:
+        return "Tipo de transacción inválido"
+    return None
+
+
+def aplicar_operacion(conn, email, monto, tipo, clave=None):
+    """Aplica un depósito/retiro atómico y hace commit; devuelve el dict de respuesta de la API"""
+    error = validar_operacion(monto, tipo)
+    if error:
+        return {"exito": False, "mensaje": error}
+
+    monto = float(monto)
+    clave = normalizar_clave(clave)
+    params = {
+        "email": email,
+        "delta": -monto if tipo == "retiro" else monto,
+        "monto": monto,
+        "tipo_libro": TIPOS_LIBRO[tipo],
+        "clave": clave,
+    }
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_OPERACION, params)
+        fila = cursor.fetchone()
+        conn.commit()
+    except errors.UniqueViolation:
+        # Otro request con la misma clave ganó la carrera: devolver su resultado
+        conn.rollback()
+        cursor.execute(SQL_PREVIA, (email, clave))
+        previa = cursor.fetchone()
+        conn.commit()
+        if not previa:
+            raise
+        return {"exito": True, "mensaje": "Éxito", "nuevo_saldo": float(previa[1]),
+                "id_transaccion": previa[0], "repetida": True}
+
+    if not fila:
+        return {"exito": False, "mensaje": "Usuario no encontrado"}
+
+    id_usuario, nuevo_saldo, id_transaccion, id_previa, saldo_previa = fila
+    if id_previa is not None:
+        return {"exito": True, "mensaje": "Éxito", "nuevo_saldo": float(saldo_previa),
+                "id_transaccion": id_previa, "repetida": True}
+    if nuevo_saldo is None:
+        return {"exito": False, "mensaje": "Fondos insuficientes"}
+    return {"exito": True, "mensaje": "Éxito", "nuevo_saldo": float(nuevo_saldo),
+            "id_transaccion": id_transaccion}
+
+
+# --- OPERACIONES EN LOTE ---
+
+MAX_OPERACIONES_LOTE = 20000
+
+SQL_CREAR_LOTE = """
+    CREATE TEMP TABLE lote_billetera (
+        n INTEGER PRIMARY KEY,
+        id_usuario INTEGER,
+        email TEXT,
+        delta NUMERIC(12, 2) NOT NULL,
+        monto NUMERIC(12, 2) NOT NULL,
+        tipo_libro TEXT NOT NULL,
+        clave TEXT,
+        resultado TEXT,
+        saldo_resultante NUMERIC(12, 2),
+        id_transaccion INTEGER
+    ) ON COMMIT DROP
+"""
+
+SQL_PASOS_LOTE = [
+    # 1. Resolver usuarios por email
+    """
+    UPDATE lote_billetera l SET id_usuario = u.id_usuario
+    FROM Usuario u
+    WHERE l.id_usuario IS NULL AND u.email = l.email
+    """,
+    """
+    UPDATE lote_billetera l SET resultado = 'no_encontrado'
+    WHERE l.id_usuario IS NULL
+       OR NOT EXISTS (SELECT 1 FROM Saldo s WHERE s.id_usuario = l.id_usuario)
+    """,
+    # 2. Claves ya aplicadas anteriormente
+    """
+    UPDATE lote_billetera l
+    SET resultado = 'repetida', id_transaccion = t.id_transaccion, saldo_resultante = t.saldo_resultante
+    FROM Transaccion t
+    WHERE l.resultado IS NULL AND l.clave IS NOT NULL
+      AND t.id_usuario = l.id_usuario AND t.clave_idempotencia = l.clave
+    """,
+    # 3. Bloquear los saldos afectados en orden fijo (evita deadlocks con otros lotes)
+    """
+    SELECT s.id_usuario FROM Saldo s
+    WHERE s.id_usuario IN (SELECT id_usuario FROM lote_billetera WHERE resultado IS NULL)
+    ORDER BY s.id_usuario
+    FOR UPDATE
+    """,
+    # 4. Saldo corrido por usuario en el orden del lote; si en algún punto queda
+    #    negativo se rechazan todas las operaciones de ese usuario
+    """
+    WITH corrida AS (
+        SELECT l.n, l.id_usuario,
+               s.saldo_actual + SUM(l.delta) OVER (PARTITION BY l.id_usuario ORDER BY l.n) AS saldo_corrido
+        FROM lote_billetera l
+        JOIN Saldo s ON s.id_usuario = l.id_usuario
+        WHERE l.resultado IS NULL
+    ),
+    sin_fondos AS (
+        SELECT id_usuario FROM corrida GROUP BY id_usuario HAVING MIN(saldo_corrido) < 0
+    )
+    UPDATE lote_billetera l
+    SET resultado = CASE WHEN l.id_usuario IN (SELECT id_usuario FROM sin_fondos)
+                         THEN 'fondos_insuficientes' ELSE 'aplicada' END,
+        saldo_resultante = CASE WHEN l.id_usuario IN (SELECT id_usuario FROM sin_fondos)
+                                THEN NULL ELSE c.saldo_corrido END
+    FROM corrida c
+    WHERE c.n = l.n
+    """,
+    # 5. Un solo UPDATE de Saldo por usuario con la suma de sus operaciones
+    """
+    UPDATE Saldo s
+    SET saldo_actual = s.saldo_actual + t.total, ultima_actualizacion = NOW()
+    FROM (
+        SELECT id_usuario, SUM(delta) AS total
+        FROM lote_billetera
+        WHERE resultado = 'aplicada'
+        GROUP BY id_usuario
+    ) t
+    WHERE s.id_usuario = t.id_usuario
+    """,
+    # 6. Renglones del libro
+    """
+    INSERT INTO Transaccion (id_usuario, tipo_transaccion, monto, estado, fecha_transaccion,
+                             clave_idempotencia, saldo_resultante)
+    SELECT id_usuario, tipo_libro, monto, 'Completada', NOW(), clave, saldo_resultante
+    FROM lote_billetera
+    WHERE resultado = 'aplicada'
+    ORDER BY n
+    """,
+]
+
+MENSAJES_LOTE = {
+    'aplicada': "Éxito",
+    'repetida': "Ya aplicada (clave repetida)",
+    'no_encontrado': "Usuario no encontrado",
+    'fondos_insuficientes': "Fondos insuficientes",
+}
+
+
+def aplicar_lote(conn, operaciones):
+    """Aplica miles de operaciones {email|id_usuario, monto, tipo, clave} en una transacción.
+
+    Devuelve el resultado por renglón (en el mismo orden recibido) y un resumen.
+    """
+    resultados = [None] * len(operaciones)
+    filas = []
+    claves_vistas = set()
+
+    # Validación en Python: lo inválido no llega a la BD
+    for n, op in enumerate(operaciones):
+        if not isinstance(op, dict):
+            resultados[n] = {"indice": n, "resultado": "invalida", "mensaje": "Operación inválida"}
+            continue
+        tipo = op.get('tipo')
+        error = validar_operacion(op.get('monto'), tipo)
+        id_usuario = op.get('id_usuario')
+        email = op.get('email')
+        if not error and not id_usuario and not email:
+            error = "Falta email o id_usuario"
+        if not error and id_usuario is not None:
+            try:
+                id_usuario = int(id_usuario)
+            except (TypeError, ValueError):
+                error = "id_usuario inválido"
+        if error:
+            resultados[n] = {"indice": n, "resultado": "invalida", "mensaje": error}
+            continue
+
+        clave = normalizar_clave(op.get('clave_idempotencia') or op.get('clave'))
+        if clave:
+            identidad = (id_usuario or email, clave)
+            if identidad in claves_vistas:
+                resultados[n] = {"indice": n, "resultado": "invalida",
+                                 "mensaje": "Clave de idempotencia repetida en el lote"}
+                continue
+            claves_vistas.add(identidad)
+
+        monto = round(float(op['monto']), 2)
+        filas.append((n, id_usuario, email, -monto if tipo == 'retiro' else monto, monto,
+                      TIPOS_LIBRO[tipo], clave))
+
+    if filas:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SQL_CREAR_LOTE)
+            execute_values(
+                cursor,
+                "INSERT INTO lote_billetera (n, id_usuario, email, delta, monto, tipo_libro, clave) VALUES %s",
+                filas,
+                page_size=1000
+            )
+            for paso in SQL_PASOS_LOTE:
+                cursor.execute(paso)
+            cursor.execute("""
+                SELECT n, resultado, saldo_resultante, id_transaccion
+                FROM lote_billetera ORDER BY n
+            """)
+            for n, resultado, saldo, id_transaccion in cursor.fetchall():
+                fila = {"indice": n, "resultado": resultado, "mensaje": MENSAJES_LOTE.get(resultado, resultado)}
+                if saldo is not None:
+                    fila["saldo_resultante"] = float(saldo)
+                if id_transaccion is not None:
+                    fila["id_transaccion"] = id_transaccion
+                resultados[n] = fila
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    resumen = {}
+    for fila in resultados:
+        resumen[fila["resultado"]] = resumen.get(fila["resultado"], 0) + 1
+    return {"resultados": resultados, "resumen": resumen}
@@ -0,0 +1,184 @@
+"""
+Caché en disco de los PDF de auditoría.
+Las auditorías no cambian después de guardarse, así que el PDF se genera una
+sola vez por (id_auditoria, hash del contenido) y se sirve desde disco. El
+directorio tiene un límite de tamaño con desalojo LRU (por fecha de último uso)
+y el hash del contenido se usa como ETag para responder 304 al visor.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Cambiar al modificar pdf_generator.py para invalidar los PDF ya generados
+VERSION_GENERADOR = "1"
+
+DIRECTORIO = os.environ.get(
+    'REPORTES_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'bdcasino_reportes')
+)
+MAX_BYTES = int(float(os.environ.get('REPORTES_CACHE_MAX_MB', 200)) * 1024 * 1024)
+MAX_ETAGS_MEMORIA = 5000
+
+_etags = OrderedDict()      # id_auditoria -> etag (LRU en memoria para 304 sin tocar la BD)
+_locks_render = {}          # nombre de archivo -> Lock (evita renderizar dos veces lo mismo)
+_lock = threading.Lock()
+
+
+def hash_contenido(datos):
+    """Huella de todo lo que aparece en el PDF"""
+    datos_audit = datos.get('datos_auditoria')
+    if not isinstance(datos_audit, str):
+        datos_audit = json.dumps(datos_audit, sort_keys=True, default=str, ensure_ascii=False)
+    partes = [
+        VERSION_GENERADOR,
+        str(datos.get('id_auditoria')),
+        datos_audit or "",
+        str(datos.get('nombre')),
+        str(datos.get('apellido')),
+        str(datos.get('email')),
+        str(datos.get('fecha_auditoria')),
+    ]
+    return hashlib.sha256("\x1f".join(partes).encode('utf-8')).hexdigest()[:32]
+
+
+def etag_conocido(id_auditoria):
+    """ETag ya calculado para la auditoría en este worker (None si no se conoce)"""
+    with _lock:
+        etag = _etags.get(id_auditoria)
+        if etag:
+            _etags.move_to_end(id_auditoria)
+        return etag
+
+
+def _recordar_etag(id_auditoria, etag):
+    with _lock:
+        _etags[id_auditoria] = etag
+        _etags.move_to_end(id_auditoria)
+        while len(_etags) > MAX_ETAGS_MEMORIA:
+            _etags.popitem(last=False)
+
+
+def _ruta(id_auditoria, etag):
+    return os.path.join(DIRECTORIO, f"auditoria_{id_auditoria}_{etag}.pdf")
+
+
+def _lock_de(nombre):
+    with _lock:
+        lock = _locks_render.get(nombre)
+        if lock is None:
+            lock = _locks_render[nombre] = threading.Lock()
+        return lock
+
+
+def buscar_en_cache(datos, id_auditoria):
+    """(ruta, etag) si el PDF de esta versión ya está en disco; (None, etag) si no"""
+    etag = hash_contenido(datos)
+    ruta = _ruta(id_auditoria, etag)
+    _recordar_etag(id_auditoria, etag)
+    if os.path.exists(ruta):
+        try:
+            os.utime(ruta, None)
+        except OSError:
+            pass
+        return ruta, etag
+    return None, etag
+
+
+def obtener_pdf(datos, id_auditoria, generar=None):
+    """Ruta al PDF en caché (renderizándolo si no existe) y su ETag"""
+    etag = hash_contenido(datos)
+    ruta = _ruta(id_auditoria, etag)
+
+    if not os.path.exists(ruta):
+        with _lock_de(ruta):
+            if not os.path.exists(ruta):
+                if generar is None:
+                    from pdf_generator import generar_pdf_profesional as generar
+                buffer = generar(datos, id_auditoria)
+                guardar_pdf(ruta, buffer.getvalue())
+                limpiar_cache()
+        with _lock:
+            _locks_render.pop(ruta, None)
+    else:
+        # Marcar como usado recientemente para el LRU
+        try:
+            os.utime(ruta, None)
+        except OSError:
+            pass
+
+    _recordar_etag(id_auditoria, etag)
+    return ruta, etag
+
+
+def guardar_pdf(ruta, contenido):
+    """Escritura atómica: otro worker nunca ve un archivo a medias"""
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except Exception:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+
+
+def limpiar_cache():
+    """Borra los PDF usados hace más tiempo hasta quedar bajo MAX_BYTES"""
+    try:
+        entradas = []
+        total = 0
+        with os.scandir(DIRECTORIO) as it:
+            for entrada in it:
+                if not entrada.name.endswith('.pdf'):
+                    continue
+                info = entrada.stat()
+                entradas.append((info.st_mtime, info.st_size, entrada.path))
+                total += info.st_size
+        if total <= MAX_BYTES:
+            return
+        entradas.sort()
+        for _, tamano, ruta in entradas:
+            if total <= MAX_BYTES:
+                break
+            try:
+                os.remove(ruta)
+                total -= tamano
+            except OSError:
+                pass
+    except FileNotFoundError:
+        pass
+
+
+def estadisticas_cache():
+    archivos = 0
+    total = 0
+    try:
+        with os.scandir(DIRECTORIO) as it:
+            for entrada in it:
+                if entrada.name.endswith('.pdf'):
+                    archivos += 1
+                    total += entrada.stat().st_size
+    except FileNotFoundError:
+        pass
+    return {"archivos": archivos, "bytes": total, "max_bytes": MAX_BYTES, "directorio": DIRECTORIO}
+
+
+# --- Renderizado anticipado ---
+
+def precalentar(id_auditoria):
+    """Encola el PDF justo después de guardar la auditoría (lo genera un proceso de la cola)"""
+    try:
+        from db_config import obtener_datos_auditoria
+        from cola_trabajos import encolar_pdf_auditoria
+        datos = obtener_datos_auditoria(id_auditoria)
+        if datos:
+            encolar_pdf_auditoria(datos, id_auditoria)
+    except Exception as e:
+        print(f"Error precalentando PDF {id_auditoria}: {e}")
@@ -0,0 +1,151 @@
+"""
+Canal de eventos de chat en tiempo real (Postgres LISTEN/NOTIFY -> Server-Sent Events).
+Cada worker mantiene UNA conexión escuchando el canal y reparte las
+notificaciones a las colas de los agentes suscritos a cada chat, en lugar de
+que cada pestaña consulte la base de datos cada 3 segundos.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+CANAL = 'chat_eventos'
+# Clave de suscripción para los avisos de la cola de espera (no es un id_chat;
+# la usan el trigger de la migración 011 y despacho_chats.py)
+COLA_CHATS = 'cola'
+# Clave de los avisos de altas, asignaciones y cierres de tickets (migración 012,
+# ruteo_tickets.py)
+TICKETS = 'tickets'
+
+# Segundos sin notificaciones antes de mandar un comentario keep-alive
+INTERVALO_PING = 15
+# Streams SSE abiertos a la vez por worker gthread: cada uno ocupa un hilo
+# hasta SSE_DURACION. Los que no caben reciben 503 y la página cae a sondeo
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 8))
+
+_suscriptores = {}   # id_chat -> set(queue.Queue)
+_lock = threading.Lock()
+_hilo = None
+_hilo_pid = None
+_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+
+def notificar_chat(cursor, id_chat, tipo, **datos):
+    """Encola un NOTIFY dentro de la transacción actual (se entrega al hacer commit)"""
+    payload = json.dumps({"id_chat": id_chat, "tipo": tipo, **datos}, default=str)
+    cursor.execute("SELECT pg_notify(%s, %s)", (CANAL, payload))
+
+
+def notificar_cola(cursor, tipo, **datos):
+    """Aviso a los suscriptores de la cola de espera (paneles de agente y despachador)"""
+    notificar_chat(cursor, COLA_CHATS, tipo, **datos)
+
+
+# --- Suscripciones ---
+
+def suscribir(id_chat):
+    """Registra un oyente para un chat y devuelve su cola de eventos"""
+    _asegurar_escucha()
+    cola = queue.Queue(maxsize=100)
+    with _lock:
+        _suscriptores.setdefault(id_chat, set()).add(cola)
+    return cola
+
+
+def desuscribir(id_chat, cola):
+    with _lock:
+        colas = _suscriptores.get(id_chat)
+        if colas:
+            colas.discard(cola)
+            if not colas:
+                del _suscriptores[id_chat]
+
+
+def tomar_stream():
+    """Reserva el hilo de un stream SSE; False si el worker ya tiene SSE_MAX_STREAMS abiertos"""
+    return _streams.acquire(blocking=False)
+
+
+def soltar_stream():
+    _streams.release()
+
+
+def colas_destino(suscriptores, evento):
+    """Colas que deben recibir el evento (un resync va a todas)"""
+    if evento.get('tipo') == 'resync':
+        return [c for grupo in suscriptores.values() for c in grupo]
+    return list(suscriptores.get(evento.get('id_chat'), ()))
+
+
+def evento_sse(tipo, datos, id_evento=None):
+    """Un evento en formato text/event-stream"""
+    lineas = f"event: {tipo}\n"
+    if id_evento is not None:
+        lineas += f"id: {id_evento}\n"
+    return lineas + f"data: {json.dumps(datos, default=str, ensure_ascii=False)}\n\n"
+
+
+def _despachar(evento):
+    with _lock:
+        colas = colas_destino(_suscriptores, evento)
+    for cola in colas:
+        try:
+            cola.put_nowait(evento)
+        except queue.Full:
+            # El oyente va atrasado; igual volverá a leer desde su cursor
+            pass
+
+
+# --- Hilo que escucha a Postgres ---
+
+def _asegurar_escucha():
+    global _hilo, _hilo_pid
+    with _lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_escuchar, name="chat-listen", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
+
+
+def _escuchar():
+    """Conexión dedicada con LISTEN (no sale del pool: LISTEN es estado de sesión)"""
+    while True:
+        conn = None
+        try:
+            database_url = os.environ.get('DATABASE_URL')
+            if not database_url:
+                print("ERROR: Falta DATABASE_URL (chat_eventos)")
+                return
+            conn = psycopg2.connect(database_url)
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CANAL}")
+
+            # Si veníamos de una reconexión, que los oyentes se pongan al día
+            _despachar({"tipo": "resync"})
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notificacion = conn.notifies.pop(0)
+                    try:
+                        _despachar(json.loads(notificacion.payload))
+                    except ValueError:
+                        print(f"Payload de chat inválido: {notificacion.payload}")
+        except Exception as e:
+            print(f"Error escuchando eventos de chat: {e}")
+            time.sleep(2)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
@@ -0,0 +1,351 @@
+"""
+Cola local de trabajos de reportes (SQLite + pool de procesos).
+Los workers web solo encolan y consultan estado; el render con reportlab corre
+en procesos aparte. La cola vive en un archivo SQLite compartido por todos los
+workers de gunicorn del mismo servidor, y cada worker tiene un hilo despachador
+que reclama trabajos pendientes de forma atómica (BEGIN IMMEDIATE).
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cache_reportes
+
+RUTA_DB = os.environ.get(
+    'REPORTES_COLA_DB',
+    os.path.join(cache_reportes.DIRECTORIO, 'cola_trabajos.sqlite3')
+)
+# Procesos de render por worker web
+PDF_PROCESOS = int(os.environ.get('PDF_PROCESOS', 1))
+# Un trabajo "en_proceso" sin avances en este tiempo se considera abandonado
+TRABAJO_ABANDONADO_SEG = 300
+MAX_INTENTOS = 3
+# Trabajos terminados se borran de la cola después de este tiempo
+RETENCION_SEG = 24 * 3600
+
+ESTADOS_ACTIVOS = ('pendiente', 'en_proceso')
+
+_despachador = None
+_despachador_pid = None
+_pool = None
+_pool_pid = None
+_hay_trabajo = threading.Event()
+_lock = threading.Lock()
+
+
+# --- Almacenamiento ---
+
+def _conectar():
+    os.makedirs(os.path.dirname(RUTA_DB), exist_ok=True)
+    conn = sqlite3.connect(RUTA_DB, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _crear_tabla(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            progreso INTEGER NOT NULL DEFAULT 0,
+            resultado TEXT,
+            error TEXT,
+            intentos INTEGER NOT NULL DEFAULT 0,
+            creado REAL NOT NULL,
+            actualizado REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, creado)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_clave ON trabajos (clave, estado)")
+
+
+_tabla_lista = False
+
+
+def _db():
+    global _tabla_lista
+    conn = _conectar()
+    if not _tabla_lista:
+        _crear_tabla(conn)
+        _tabla_lista = True
+    return conn
+
+
+def _a_dict(fila):
+    if fila is None:
+        return None
+    trabajo = dict(fila)
+    trabajo.pop('payload', None)
+    return trabajo
+
+
+# --- API para los workers web ---
+
+def encolar_pdf_auditoria(datos, id_auditoria):
+    """Encola el render del PDF (o reutiliza el trabajo activo/terminado de la misma versión)"""
+    etag = cache_reportes.hash_contenido(datos)
+    clave = f"pdf_auditoria:{id_auditoria}:{etag}"
+    payload = json.dumps({"datos": dict(datos), "id_auditoria": id_auditoria}, default=str, ensure_ascii=False)
+    ahora = time.time()
+
+    conn = _db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        fila = conn.execute(
+            "SELECT * FROM trabajos WHERE clave = ? AND estado IN ('pendiente', 'en_proceso', 'terminado') "
+            "ORDER BY creado DESC LIMIT 1",
+            (clave,)
+        ).fetchone()
+        if fila and (fila['estado'] != 'terminado' or os.path.exists(fila['resultado'] or '')):
+            conn.execute("COMMIT")
+            trabajo = _a_dict(fila)
+        else:
+            id_trabajo = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO trabajos (id, tipo, clave, payload, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?)",
+                (id_trabajo, 'pdf_auditoria', clave, payload, ahora, ahora)
+            )
+            conn.execute("COMMIT")
+            trabajo = {"id": id_trabajo, "tipo": 'pdf_auditoria', "clave": clave, "estado": 'pendiente',
+                       "progreso": 0, "resultado": None, "error": None}
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if trabajo['estado'] == 'pendiente':
+        _asegurar_despachador()
+        _hay_trabajo.set()
+    return trabajo
+
+
+def obtener_trabajo(id_trabajo):
+    conn = _db()
+    try:
+        fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+        return _a_dict(fila)
+    finally:
+        conn.close()
+
+
+def obtener_trabajos(ids_trabajo):
+    """{id: trabajo} de varios trabajos en una sola consulta (los que ya no existen no aparecen)"""
+    ids_trabajo = list(ids_trabajo)
+    if not ids_trabajo:
+        return {}
+    conn = _db()
+    try:
+        marcas = ", ".join("?" * len(ids_trabajo))
+        filas = conn.execute(f"SELECT * FROM trabajos WHERE id IN ({marcas})", ids_trabajo).fetchall()
+        return {fila['id']: _a_dict(fila) for fila in filas}
+    finally:
+        conn.close()
+
+
+def esperar_trabajo(id_trabajo, timeout):
+    """Espera (sin usar CPU) a que el trabajo termine; devuelve su último estado"""
+    limite = time.monotonic() + timeout
+    intervalo = 0.1
+    while True:
+        trabajo = obtener_trabajo(id_trabajo)
+        if not trabajo or trabajo['estado'] not in ESTADOS_ACTIVOS or time.monotonic() >= limite:
+            return trabajo
+        time.sleep(intervalo)
+        intervalo = min(intervalo * 1.5, 1.0)
+
+
+def estadisticas_cola():
+    conn = _db()
+    try:
+        filas = conn.execute("SELECT estado, COUNT(*) AS total FROM trabajos GROUP BY estado").fetchall()
+        return {fila['estado']: fila['total'] for fila in filas}
+    finally:
+        conn.close()
+
+
+# --- Despachador (un hilo por worker web) ---
+
+def _asegurar_despachador():
+    global _despachador, _despachador_pid, _pool
+    with _lock:
+        if _despachador is not None and _despachador.is_alive() and _despachador_pid == os.getpid():
+            return
+        # Tras un fork el pool es del padre: solo se suelta la referencia
+        anterior = _pool if _pool_pid == os.getpid() else None
+        _pool = None
+        _despachador = threading.Thread(target=_despachar, name="cola-reportes", daemon=True)
+        _despachador_pid = os.getpid()
+        _despachador.start()
+    if anterior is not None:
+        # El hilo anterior murió: sus procesos de render no deben quedar vivos
+        _cerrar_pool(anterior)
+
+
+def _obtener_pool():
+    """Pool de render del despachador; se crea al enviar el primer trabajo o tras romperse"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn: los procesos de render no heredan hilos ni conexiones del worker
+            _pool = ProcessPoolExecutor(max_workers=PDF_PROCESOS, mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _cerrar_pool(pool):
+    try:
+        pool.shutdown(wait=False, cancel_futures=True)
+    except Exception as e:
+        print(f"Error cerrando pool de reportes: {e}")
+
+
+def _reemplazar_pool(pool):
+    """Descarta un pool roto; el siguiente envío crea uno nuevo"""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    _cerrar_pool(pool)
+
+
+def _reclamar_siguiente():
+    """Toma el trabajo pendiente más antiguo y lo marca en_proceso (atómico entre procesos)"""
+    ahora = time.time()
+    conn = _db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Recuperar trabajos de procesos que murieron a la mitad
+        conn.execute(
+            "UPDATE trabajos SET estado = CASE WHEN intentos >= ? THEN 'error' ELSE 'pendiente' END, "
+            "error = CASE WHEN intentos >= ? THEN 'Demasiados intentos' ELSE error END, actualizado = ? "
+            "WHERE estado = 'en_proceso' AND actualizado < ?",
+            (MAX_INTENTOS, MAX_INTENTOS, ahora, ahora - TRABAJO_ABANDONADO_SEG)
+        )
+        fila = conn.execute(
+            "SELECT id, payload FROM trabajos WHERE estado = 'pendiente' ORDER BY creado LIMIT 1"
+        ).fetchone()
+        if fila:
+            conn.execute(
+                "UPDATE trabajos SET estado = 'en_proceso', intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                (ahora, fila['id'])
+            )
+        conn.execute("DELETE FROM trabajos WHERE estado IN ('terminado', 'error') AND actualizado < ?",
+                     (ahora - RETENCION_SEG,))
+        conn.execute("COMMIT")
+        return (fila['id'], fila['payload']) if fila else None
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _devolver_a_cola(id_trabajo, error):
+    """Regresa a pendiente un trabajo que no llegó a correr (o a error si agotó sus intentos)"""
+    conn = _db()
+    try:
+        conn.execute(
+            "UPDATE trabajos SET estado = CASE WHEN intentos >= ? THEN 'error' ELSE 'pendiente' END, "
+            "error = ?, actualizado = ? WHERE id = ? AND estado = 'en_proceso'",
+            (MAX_INTENTOS, error, time.time(), id_trabajo)
+        )
+    finally:
+        conn.close()
+    _hay_trabajo.set()
+
+
+def _al_terminar(futuro, pool, id_trabajo, cupos):
+    try:
+        if futuro.cancelled() or isinstance(futuro.exception(), BrokenProcessPool):
+            # Un proceso de render murió (p. ej. sin memoria) y el pool ya no acepta trabajos
+            _reemplazar_pool(pool)
+            _devolver_a_cola(id_trabajo, "El proceso de render terminó inesperadamente")
+    except Exception as e:
+        print(f"Error en cola de reportes: {e}")
+    finally:
+        cupos.release()
+
+
+def _enviar_siguiente(cupos):
+    """Reclama el siguiente trabajo y lo manda al pool; False si no se envió nada"""
+    siguiente = _reclamar_siguiente()
+    if not siguiente:
+        return False
+
+    id_trabajo, payload = siguiente
+    pool = _obtener_pool()
+    try:
+        futuro = pool.submit(ejecutar_trabajo, RUTA_DB, id_trabajo, payload)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _reemplazar_pool(pool)
+        _devolver_a_cola(id_trabajo, str(e))
+        return False
+    futuro.add_done_callback(lambda f: _al_terminar(f, pool, id_trabajo, cupos))
+    return True
+
+
+def _despachar():
+    cupos = threading.BoundedSemaphore(PDF_PROCESOS)
+    while True:
+        cupos.acquire()
+        try:
+            enviado = _enviar_siguiente(cupos)
+        except Exception as e:
+            # Ningún error debe matar el hilo: la cola se quedaría sin despachador
+            print(f"Error en cola de reportes: {e}")
+            enviado = False
+
+        if not enviado:
+            cupos.release()
+            _hay_trabajo.wait(1.0)
+            _hay_trabajo.clear()
+
+
+# --- Código que corre en los procesos de render ---
+
+def _actualizar(ruta_db, id_trabajo, **campos):
+    campos['actualizado'] = time.time()
+    columnas = ", ".join(f"{nombre} = ?" for nombre in campos)
+    conn = sqlite3.connect(ruta_db, timeout=10, isolation_level=None)
+    try:
+        conn.execute(f"UPDATE trabajos SET {columnas} WHERE id = ?", (*campos.values(), id_trabajo))
+    finally:
+        conn.close()
+
+
+def ejecutar_trabajo(ruta_db, id_trabajo, payload):
+    """Renderiza el PDF, lo guarda en el caché de disco y marca el trabajo como terminado"""
+    from pdf_generator import generar_pdf_profesional
+
+    try:
+        datos_trabajo = json.loads(payload)
+        datos = datos_trabajo['datos']
+        id_auditoria = datos_trabajo['id_auditoria']
+
+        ultimo = [0.0]
+
+        def progreso(porcentaje):
+            # No escribir en SQLite más de ~4 veces por segundo
+            if time.monotonic() - ultimo[0] >= 0.25:
+                ultimo[0] = time.monotonic()
+                _actualizar(ruta_db, id_trabajo, progreso=int(porcentaje))
+
+        ruta, _ = cache_reportes.obtener_pdf(
+            datos, id_auditoria,
+            generar=lambda d, i: generar_pdf_profesional(d, i, progreso=progreso)
+        )
+        _actualizar(ruta_db, id_trabajo, estado='terminado', progreso=100, resultado=ruta)
+    except Exception as e:
+        _actualizar(ruta_db, id_trabajo, estado='error', error=str(e))
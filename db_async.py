@@ -0,0 +1,343 @@
+"""
+Acceso asíncrono a PostgreSQL para el modo ASGI (ver asgi.py).
+Un AsyncConnectionPool de psycopg 3 por worker, abierto en el arranque del
+servidor, atiende las lecturas del panel de agente (chats, tickets y
+dashboard) sin ocupar un hilo por petición, y una sola conexión con LISTEN
+reparte los eventos de chat a las colas asyncio de los streams abiertos.
+Las consultas son las mismas de db_config.py; aquí solo cambia cómo se
+espera a Postgres.
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from chat_eventos import CANAL, colas_destino
+from despacho_chats import SQL_LATIDO
+from db_config import (
+    SQL_CHAT, SQL_CHATS_AGENTE, SQL_CHATS_ESPERANDO, SQL_TICKET, SQL_TICKETS_AGENTE,
+    SQL_VERSION_TICKET, SQL_RESPUESTAS_TICKET,
+    TICKETS_POR_PAGINA, consulta_tickets, pagina_tickets, con_fecha_asignacion, detalle_ticket,
+    consulta_mensajes, respuesta_mensajes,
+)
+from instrumentacion_sql import registrar_conexion, registrar_consulta
+from versiones_cambio import SQL_VERSIONES, cambios
+from metricas_dashboard import calcular_metricas_agente_async, METRICAS_VACIAS
+
+# Mismos keepalives TCP que el pool síncrono (db_pool.py)
+KEEPALIVES = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+}
+
+
+class CursorAsyncInstrumentado(psycopg.AsyncCursor):
+    """Mide cada consulta en la petición en curso, como _CursorInstrumentado en instrumentacion_sql.py"""
+
+    async def execute(self, query, params=None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            resultado = await super().execute(query, params, **kwargs)
+        except Exception:
+            registrar_consulta(query, time.perf_counter() - inicio, error=True)
+            raise
+        registrar_consulta(query, time.perf_counter() - inicio)
+        return resultado
+
+
+# --- Pool del worker (lo abre y cierra el lifespan de asgi.py) ---
+
+_pool = None
+
+
+async def abrir_pool():
+    global _pool
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("ERROR: Falta DATABASE_URL")
+        return None
+    _pool = AsyncConnectionPool(
+        database_url,
+        min_size=int(os.environ.get('DB_ASYNC_POOL_MIN', 1)),
+        max_size=int(os.environ.get('DB_ASYNC_POOL_MAX', 10)),
+        max_idle=float(os.environ.get('DB_POOL_MAX_INACTIVA', 300)),
+        timeout=float(os.environ.get('DB_POOL_ESPERA', 10)),
+        kwargs={
+            # Solo lecturas: sin BEGIN/ROLLBACK por consulta
+            'autocommit': True,
+            'cursor_factory': CursorAsyncInstrumentado,
+            # Sin sentencias preparadas del lado del servidor (compatibles con PgBouncer en modo transacción)
+            'prepare_threshold': None,
+            **KEEPALIVES,
+        },
+        name='bdcasino-async',
+        open=False,
+    )
+    await _pool.open()
+    return _pool
+
+
+async def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def estadisticas_pool():
+    if _pool is None:
+        return None
+    datos = _pool.get_stats()
+    return {
+        "libres": datos.get('pool_available', 0),
+        "en_uso": datos.get('pool_size', 0) - datos.get('pool_available', 0),
+        "esperando": datos.get('requests_waiting', 0),
+        "minimo": _pool.min_size,
+        "maximo": _pool.max_size,
+    }
+
+
+@asynccontextmanager
+async def conexion_async():
+    """Presta una conexión del pool asíncrono y la devuelve al salir (None si no hay BD), como conexion_db()"""
+    conn = None
+    if _pool is not None:
+        inicio = time.perf_counter()
+        try:
+            conn = await _pool.getconn()
+        except Exception as e:
+            print(f"Error conectando a Neon (async): {e}")
+        registrar_conexion(time.perf_counter() - inicio)
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            await _pool.putconn(conn)
+
+
+# --- Consultas del panel de agente (mismo contrato que en db_config.py) ---
+
+async def obtener_tickets(estado=None, asignado=None, buscar=None, limite=TICKETS_POR_PAGINA,
+                          cursor_pagina=None, con_total=False):
+    vacio = {'tickets': [], 'siguiente_cursor': None}
+    if con_total: vacio['total'] = 0
+    async with conexion_async() as conn:
+        if not conn: return vacio
+        try:
+            sql, params_pagina, sql_total, params, limite = consulta_tickets(
+                estado, asignado, buscar, limite, cursor_pagina
+            )
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(sql, params_pagina)
+                resultado = pagina_tickets(await cursor.fetchall(), limite)
+                if con_total:
+                    await cursor.execute(sql_total, params)
+                    resultado['total'] = (await cursor.fetchone())['total']
+            return resultado
+        except Exception as e:
+            print(f"Error obteniendo tickets: {e}")
+            return vacio
+
+
+async def obtener_detalle_ticket(id_ticket, version=None, desde_id=None):
+    async with conexion_async() as conn:
+        if not conn: return None
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                if version is not None:
+                    await cursor.execute(SQL_VERSION_TICKET, (id_ticket,))
+                    fila = await cursor.fetchone()
+                    if not fila:
+                        return None
+                    if fila['version'] == version:
+                        return {'sin_cambios': True, 'version': version}
+
+                await cursor.execute(SQL_TICKET, (id_ticket,))
+                ticket = await cursor.fetchone()
+                if not ticket:
+                    return None
+                await cursor.execute(SQL_RESPUESTAS_TICKET, (id_ticket, desde_id or 0))
+                return detalle_ticket(ticket, await cursor.fetchall(), desde_id)
+        except Exception as e:
+            print(f"Error obteniendo detalle del ticket: {e}")
+            return None
+
+
+async def obtener_tickets_agente(id_agente):
+    async with conexion_async() as conn:
+        if not conn: return []
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(SQL_TICKETS_AGENTE, (id_agente,))
+                return con_fecha_asignacion(await cursor.fetchall())
+        except Exception as e:
+            print(f"Error obteniendo tickets del agente: {e}")
+            return []
+
+
+async def obtener_chats_esperando():
+    async with conexion_async() as conn:
+        if not conn: return []
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(SQL_CHATS_ESPERANDO)
+                return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error obteniendo chats en espera: {e}")
+            return []
+
+
+async def obtener_chats_agente(id_agente):
+    async with conexion_async() as conn:
+        if not conn: return []
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(SQL_CHATS_AGENTE, (id_agente,))
+                return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error obteniendo chats del agente: {e}")
+            return []
+
+
+async def obtener_mensajes_chat(id_chat, desde_id=None, desde_ts=None, chat_etag=None):
+    async with conexion_async() as conn:
+        if not conn: return {'chat': None, 'mensajes': []}
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(SQL_CHAT, (id_chat,))
+                chat = await cursor.fetchone()
+                if not chat:
+                    return {'chat': None, 'mensajes': []}
+                await cursor.execute(*consulta_mensajes(id_chat, desde_id, desde_ts))
+                mensajes = await cursor.fetchall()
+            return respuesta_mensajes(chat, mensajes, desde_id, chat_etag)
+        except Exception as e:
+            print(f"Error obteniendo mensajes del chat: {e}")
+            return {'chat': None, 'mensajes': []}
+
+
+async def obtener_mensajes_nuevos(id_chat, desde_id=0):
+    async with conexion_async() as conn:
+        if not conn: return []
+        try:
+            async with conn.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(*consulta_mensajes(id_chat, desde_id=desde_id or 0))
+                return await cursor.fetchall()
+        except Exception as e:
+            print(f"Error obteniendo mensajes nuevos: {e}")
+            return []
+
+
+async def obtener_dashboard_agente(id_agente):
+    async with conexion_async() as conn:
+        if not conn:
+            return dict(METRICAS_VACIAS)
+        try:
+            return await calcular_metricas_agente_async(conn, id_agente)
+        except Exception as e:
+            print(f"Error en dashboard agente: {e}")
+            return dict(METRICAS_VACIAS)
+
+
+async def obtener_cambios(conocidas):
+    if not conocidas:
+        return {}
+    async with conexion_async() as conn:
+        if not conn: return None
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SQL_VERSIONES, (list(conocidas),))
+                return cambios(conocidas, await cursor.fetchall())
+        except Exception as e:
+            print(f"Error leyendo versiones de cambio: {e}")
+            return None
+
+
+async def registrar_latido_agente(id_agente):
+    async with conexion_async() as conn:
+        if not conn: return False
+        try:
+            await conn.execute(SQL_LATIDO, (id_agente,))
+            return True
+        except Exception as e:
+            print(f"Error registrando latido: {e}")
+            return False
+
+
+# --- Eventos de chat (LISTEN en el loop, colas asyncio por stream) ---
+
+_suscriptores = {}   # id_chat -> set(asyncio.Queue)
+_tarea_escucha = None
+
+
+def suscribir(id_chat):
+    cola = asyncio.Queue(maxsize=100)
+    _suscriptores.setdefault(id_chat, set()).add(cola)
+    return cola
+
+
+def desuscribir(id_chat, cola):
+    colas = _suscriptores.get(id_chat)
+    if colas:
+        colas.discard(cola)
+        if not colas:
+            del _suscriptores[id_chat]
+
+
+def _despachar(evento):
+    for cola in colas_destino(_suscriptores, evento):
+        try:
+            cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # El oyente va atrasado; igual volverá a leer desde su cursor
+            pass
+
+
+async def _escuchar():
+    """Conexión dedicada con LISTEN (fuera del pool: LISTEN es estado de sesión)"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("ERROR: Falta DATABASE_URL (chat_eventos async)")
+        return
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(
+                database_url, autocommit=True, **KEEPALIVES
+            ) as conn:
+                await conn.execute(f"LISTEN {CANAL}")
+                # Si veníamos de una reconexión, que los oyentes se pongan al día
+                _despachar({"tipo": "resync"})
+                async for notificacion in conn.notifies():
+                    try:
+                        _despachar(json.loads(notificacion.payload))
+                    except ValueError:
+                        print(f"Payload de chat inválido: {notificacion.payload}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error escuchando eventos de chat (async): {e}")
+            await asyncio.sleep(2)
+
+
+def iniciar_escucha():
+    global _tarea_escucha
+    if _tarea_escucha is None or _tarea_escucha.done():
+        _tarea_escucha = asyncio.get_running_loop().create_task(_escuchar(), name="chat-listen-async")
+
+
+async def detener_escucha():
+    global _tarea_escucha
+    if _tarea_escucha is not None:
+        _tarea_escucha.cancel()
+        try:
+            await _tarea_escucha
+        except asyncio.CancelledError:
+            pass
+        _tarea_escucha = None
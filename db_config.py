@@ -1,12 +1,30 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
-from passlib.context import CryptContext
+import json
+import base64
+import hashlib
+import time
+from contextlib import contextmanager
 
-# Configuración de seguridad (Argon2)
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+from db_pool import obtener_pool
+from instrumentacion_sql import registrar_conexion
+from metricas_dashboard import calcular_metricas_agente, invalidar_metricas_globales, METRICAS_VACIAS
+from chat_eventos import notificar_chat
+from despacho_chats import reclamar_chat, reclamar_siguiente, marcar_disponible, registrar_latido, asegurar_despachador
+from ruteo_tickets import asegurar_ruteador
+from versiones_cambio import leer_cambios
+from billetera import aplicar_operacion, aplicar_lote
+from analitica_auditorias import obtener_analitica, invalidar_analitica
+from respuestas_auditoria import insertar_respuestas, consultar_fallas
+from reglas_auditoria import obtener_motor, fila_puntaje, guardar_puntajes
+from metricas_admin import leer_totales, leer_serie, asegurar_reconciliador
+from reportes_financieros import consultar as consultar_rollup, curvas, asegurar_agregador
+# Argon2 se calcula en un pool de procesos (ver servicio_hash.py)
+from servicio_hash import hash_password, verificar_password, ServicioSaturado
 
 def get_db_connection():
+    """Conexión directa (sin pool) para scripts de diagnóstico; el servidor usa conexion_db()"""
     try:
         database_url = os.environ.get('DATABASE_URL')
         if not database_url:
@@ -18,423 +36,642 @@ def get_db_connection():
         print(f"Error conectando a Neon: {e}")
         return None
 
+@contextmanager
+def conexion_db():
+    """Presta una conexión del pool y la devuelve al salir del bloque (None si no hay BD)"""
+    pool = obtener_pool()
+    conn = None
+    if pool:
+        inicio = time.perf_counter()
+        try:
+            conn = pool.obtener()
+        except Exception as e:
+            print(f"Error conectando a Neon: {e}")
+        registrar_conexion(time.perf_counter() - inicio)
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            pool.devolver(conn)
+
+# --- PAGINACIÓN (KEYSET) ---
+
+def codificar_cursor(*valores):
+    """Cursor opaco para paginación keyset a partir de los valores de la última fila"""
+    texto = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in valores])
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor_texto):
+    """Valores del cursor (lista) o None si es inválido"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor_texto.encode('ascii')).decode('utf-8'))
+    except Exception:
+        return None
+
+def escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def estimar_filas(cursor, sql, params):
+    """Conteo aproximado según el planificador (EXPLAIN), sin recorrer la tabla"""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    fila = cursor.fetchone()
+    plan = fila['QUERY PLAN'] if isinstance(fila, dict) else fila[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
 # --- USUARIOS Y LOGIN ---
 
 def registrar_usuario_nuevo(datos):
-    conn = get_db_connection()
-    if not conn: return {"exito": False, "mensaje": "Error de conexión"}
-    try:
-        cursor = conn.cursor()
-        pass_hash = pwd_context.hash(datos['password'])
-        
-        sql_usuario = """
-            INSERT INTO Usuario (id_rol, nombre, apellido, curp, email, password_hash, fecha_registro, activo)
-            VALUES (
-                (SELECT id_rol FROM Rol WHERE nombre = 'Jugador'), 
-                %s, %s, %s, %s, %s, NOW(), true
-            )
-            RETURNING id_usuario;
-        """
-        cursor.execute(sql_usuario, (datos['nombre'], datos['apellido'], datos['curp'], datos['email'], pass_hash))
-        id_nuevo = cursor.fetchone()[0]
-        
-        # Crear saldo inicial de 500.00 para nuevos usuarios
-        cursor.execute("INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion) VALUES (%s, 500.00, NOW());", (id_nuevo,))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return {"exito": True, "mensaje": "Registro exitoso"}
-    except Exception as e:
-        if conn: conn.rollback()
-        return {"exito": False, "mensaje": str(e)}
+    # Hashear antes de tomar una conexión del pool
+    pass_hash = hash_password(datos['password'])
+    with conexion_db() as conn:
+        if not conn: return {"exito": False, "mensaje": "Error de conexión"}
+        try:
+            cursor = conn.cursor()
+
+            sql_usuario = """
+                INSERT INTO Usuario (id_rol, nombre, apellido, curp, email, password_hash, fecha_registro, activo)
+                VALUES (
+                    (SELECT id_rol FROM Rol WHERE nombre = 'Jugador'), 
+                    %s, %s, %s, %s, %s, NOW(), true
+                )
+                RETURNING id_usuario;
+            """
+            cursor.execute(sql_usuario, (datos['nombre'], datos['apellido'], datos['curp'], datos['email'], pass_hash))
+            id_nuevo = cursor.fetchone()[0]
+
+            # Crear saldo inicial de 500.00 para nuevos usuarios
+            cursor.execute("INSERT INTO Saldo (id_usuario, saldo_actual, ultima_actualizacion) VALUES (%s, 500.00, NOW());", (id_nuevo,))
+
+            conn.commit()
+            cursor.close()
+            return {"exito": True, "mensaje": "Registro exitoso"}
+        except Exception as e:
+            conn.rollback()
+            return {"exito": False, "mensaje": str(e)}
 
 def validar_login(email, password):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT u.id_usuario, u.email, u.nombre, u.password_hash, 
-                   s.saldo_actual, r.nombre as nombre_rol
-            FROM Usuario u
-            JOIN Saldo s ON u.id_usuario = s.id_usuario
-            JOIN Rol r ON u.id_rol = r.id_rol
-            WHERE u.email = %s AND u.activo = true
-        """
-        cursor.execute(sql, (email,))
-        usuario = cursor.fetchone()
-        conn.close()
-
-        if usuario and pwd_context.verify(password, usuario['password_hash']):
-            del usuario['password_hash']
-            return usuario
+    """Usuario (sin hash) si las credenciales son válidas; lanza ServicioSaturado si la cola de hashing está llena"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT u.id_usuario, u.email, u.nombre, u.password_hash, 
+                       s.saldo_actual, r.nombre as nombre_rol
+                FROM Usuario u
+                JOIN Saldo s ON u.id_usuario = s.id_usuario
+                JOIN Rol r ON u.id_rol = r.id_rol
+                WHERE u.email = %s AND u.activo = true
+            """
+            cursor.execute(sql, (email,))
+            usuario = cursor.fetchone()
+        except Exception as e:
+            print(f"Error login: {e}")
+            return None
+
+    # La verificación corre sin tener una conexión prestada
+    if not usuario:
         return None
+    try:
+        valida, nuevo_hash = verificar_password(password, usuario['password_hash'])
+    except ServicioSaturado:
+        raise
     except Exception as e:
         print(f"Error login: {e}")
         return None
+    if not valida:
+        return None
+
+    if nuevo_hash:
+        # Parámetros de Argon2 cambiaron: guardar el hash regenerado
+        actualizar_hash_password(usuario['id_usuario'], usuario['password_hash'], nuevo_hash)
+    del usuario['password_hash']
+    return usuario
+
+def actualizar_hash_password(id_usuario, hash_anterior, hash_nuevo):
+    """Reemplaza el hash solo si nadie lo cambió mientras tanto"""
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE Usuario SET password_hash = %s WHERE id_usuario = %s AND password_hash = %s",
+                (hash_nuevo, id_usuario, hash_anterior)
+            )
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error actualizando hash: {e}")
+            conn.rollback()
+            return False
 
 # --- PERFIL Y TRANSACCIONES ---
 
 def obtener_perfil(email):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, s.saldo_actual, r.nombre as nombre_rol
-            FROM Usuario u
-            JOIN Saldo s ON u.id_usuario = s.id_usuario
-            LEFT JOIN Rol r ON u.id_rol = r.id_rol
-            WHERE u.email = %s
-        """
-        cursor.execute(sql, (email,))
-        datos = cursor.fetchone()
-        conn.close()
-        return datos
-    except Exception:
-        return None
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT u.id_usuario, u.nombre, u.apellido, u.email, s.saldo_actual, r.nombre as nombre_rol
+                FROM Usuario u
+                JOIN Saldo s ON u.id_usuario = s.id_usuario
+                LEFT JOIN Rol r ON u.id_rol = r.id_rol
+                WHERE u.email = %s
+            """
+            cursor.execute(sql, (email,))
+            datos = cursor.fetchone()
+            return datos
+        except Exception:
+            return None
 
 def actualizar_datos_usuario(email, nombre, apellido, nueva_password=None):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        if nueva_password and len(nueva_password) > 0:
-            pass_hash = pwd_context.hash(nueva_password)
-            sql = "UPDATE Usuario SET nombre = %s, apellido = %s, password_hash = %s WHERE email = %s"
-            cursor.execute(sql, (nombre, apellido, pass_hash, email))
-        else:
-            sql = "UPDATE Usuario SET nombre = %s, apellido = %s WHERE email = %s"
-            cursor.execute(sql, (nombre, apellido, email))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        return False
+    pass_hash = None
+    if nueva_password and len(nueva_password) > 0:
+        pass_hash = hash_password(nueva_password)
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            if pass_hash:
+                sql = "UPDATE Usuario SET nombre = %s, apellido = %s, password_hash = %s WHERE email = %s"
+                cursor.execute(sql, (nombre, apellido, pass_hash, email))
+            else:
+                sql = "UPDATE Usuario SET nombre = %s, apellido = %s WHERE email = %s"
+                cursor.execute(sql, (nombre, apellido, email))
+            conn.commit()
+            return True
+        except Exception:
+            return False
 
-def realizar_transaccion_saldo(email, monto, tipo):
-    conn = get_db_connection()
-    if not conn: return {"exito": False, "mensaje": "Sin conexión"}
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT saldo_actual FROM Saldo s JOIN Usuario u ON s.id_usuario = u.id_usuario WHERE u.email = %s", (email,))
-        res = cursor.fetchone()
-        if not res: return {"exito": False, "mensaje": "Usuario no encontrado"}
-        
-        saldo_actual = float(res[0])
-        monto_final = monto if tipo != "retiro" else -monto
-        
-        if tipo == "retiro" and saldo_actual < monto:
-            return {"exito": False, "mensaje": "Fondos insuficientes"}
-
-        sql = """
-            UPDATE Saldo SET saldo_actual = saldo_actual + %s, ultima_actualizacion = NOW()
-            WHERE id_usuario = (SELECT id_usuario FROM Usuario WHERE email = %s)
-            RETURNING saldo_actual;
-        """
-        cursor.execute(sql, (monto_final, email))
-        nuevo_saldo = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
-        return {"exito": True, "mensaje": "Éxito", "nuevo_saldo": float(nuevo_saldo)}
-    except Exception as e:
-        if conn: conn.rollback()
-        return {"exito": False, "mensaje": str(e)}
+def realizar_transaccion_saldo(email, monto, tipo, clave_idempotencia=None):
+    """Depósito/retiro atómico con registro en Transaccion (ver billetera.py)"""
+    with conexion_db() as conn:
+        if not conn: return {"exito": False, "mensaje": "Sin conexión"}
+        try:
+            return aplicar_operacion(conn, email, monto, tipo, clave_idempotencia)
+        except Exception as e:
+            conn.rollback()
+            return {"exito": False, "mensaje": str(e)}
+
+def realizar_transacciones_lote(operaciones):
+    """Depósitos/retiros masivos (bonos, conciliaciones) en una sola transacción"""
+    with conexion_db() as conn:
+        if not conn: return {"exito": False, "mensaje": "Sin conexión"}
+        try:
+            resultado = aplicar_lote(conn, operaciones)
+            return {"exito": True, **resultado}
+        except Exception as e:
+            print(f"Error en lote de billetera: {e}")
+            conn.rollback()
+            return {"exito": False, "mensaje": str(e)}
 
 # --- AUDITORÍA ---
 
 def guardar_auditoria(email, resumen, datos_json):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO Auditoria (id_usuario, resumen, datos_auditoria, fecha_auditoria)
-            VALUES (
-                (SELECT id_usuario FROM Usuario WHERE email = %s),
-                %s, %s, NOW()
-            )
-            RETURNING id_auditoria;
-        """
-        cursor.execute(sql, (email, resumen, datos_json))
-        id_auditoria = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
-        return id_auditoria
-    except Exception as e:
-        print(f"Error auditoria: {e}")
-        if conn: conn.rollback()
-        return None
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            sql = """
+                INSERT INTO Auditoria (id_usuario, resumen, datos_auditoria, fecha_auditoria)
+                VALUES (
+                    (SELECT id_usuario FROM Usuario WHERE email = %s),
+                    %s, %s, NOW()
+                )
+                RETURNING id_auditoria, id_usuario, fecha_auditoria;
+            """
+            cursor.execute(sql, (email, resumen, datos_json))
+            id_auditoria, id_usuario, fecha_auditoria = cursor.fetchone()
+            # Escritura doble: JSON completo + renglones indexados (misma transacción)
+            datos = json.loads(datos_json)
+            insertar_respuestas(cursor, id_auditoria, id_usuario, fecha_auditoria, datos)
+            if datos.get('no_conformidades'):
+                guardar_puntajes(cursor, [fila_puntaje(id_auditoria, obtener_motor().version, datos['no_conformidades'])])
+            conn.commit()
+            invalidar_analitica()
+            return id_auditoria
+        except Exception as e:
+            print(f"Error auditoria: {e}")
+            conn.rollback()
+            return None
 
 def obtener_datos_auditoria(id_auditoria):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT a.*, u.nombre, u.apellido, u.email
-            FROM Auditoria a
-            JOIN Usuario u ON a.id_usuario = u.id_usuario
-            WHERE a.id_auditoria = %s
-        """
-        cursor.execute(sql, (id_auditoria,))
-        data = cursor.fetchone()
-        conn.close()
-        return data
-    except Exception:
-        return None
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT a.*, u.nombre, u.apellido, u.email
+                FROM Auditoria a
+                JOIN Usuario u ON a.id_usuario = u.id_usuario
+                WHERE a.id_auditoria = %s
+            """
+            cursor.execute(sql, (id_auditoria,))
+            data = cursor.fetchone()
+            return data
+        except Exception:
+            return None
 
 def obtener_historial_auditorias(email):
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT a.id_auditoria, a.fecha_auditoria, a.resumen
-            FROM Auditoria a
-            JOIN Usuario u ON a.id_usuario = u.id_usuario
-            WHERE u.email = %s
-            ORDER BY a.fecha_auditoria DESC
-        """
-        cursor.execute(sql, (email,))
-        auditorias = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in auditorias]
-    except Exception as e:
-        print(f"Error historial: {e}")
-        return []
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT a.id_auditoria, a.fecha_auditoria, a.resumen
+                FROM Auditoria a
+                JOIN Usuario u ON a.id_usuario = u.id_usuario
+                WHERE u.email = %s
+                ORDER BY a.fecha_auditoria DESC
+            """
+            cursor.execute(sql, (email,))
+            auditorias = cursor.fetchall()
+            return [dict(row) for row in auditorias]
+        except Exception as e:
+            print(f"Error historial: {e}")
+            return []
+
+MAX_AUDITORIAS_EXPORTACION = 500
+
+def obtener_auditorias_exportar(email, desde=None, hasta=None, ids=None):
+    """Auditorías completas del auditor para exportación masiva (más antiguas primero).
+
+    Se leen todas de una vez y se devuelve la conexión al pool antes de empezar
+    a renderizar; solo es el JSON de cada auditoría, los PDF van a disco.
+    """
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            filtros = ["u.email = %s"]
+            params = [email]
+            if desde:
+                filtros.append("a.fecha_auditoria >= %s")
+                params.append(desde)
+            if hasta:
+                filtros.append("a.fecha_auditoria < %s::date + 1")
+                params.append(hasta)
+            if ids:
+                filtros.append("a.id_auditoria = ANY(%s)")
+                params.append(list(ids))
+            params.append(MAX_AUDITORIAS_EXPORTACION)
+            sql = f"""
+                SELECT a.*, u.nombre, u.apellido, u.email
+                FROM Auditoria a
+                JOIN Usuario u ON a.id_usuario = u.id_usuario
+                WHERE {' AND '.join(filtros)}
+                ORDER BY a.fecha_auditoria, a.id_auditoria
+                LIMIT %s
+            """
+            cursor.execute(sql, params)
+            return [dict(fila) for fila in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error exportando auditorías: {e}")
+            return []
+
+def obtener_analitica_auditorias(email=None, desde=None, hasta=None, periodo='mes'):
+    """Analítica de cumplimiento (de un auditor o de todas si email es None)"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            return obtener_analitica(conn, email, desde, hasta, periodo)
+        except Exception as e:
+            print(f"Error analítica auditorías: {e}")
+            return None
+
+def obtener_auditorias_con_falla(pregunta=None, posicion=None, email=None, desde=None, hasta=None, limite=200):
+    """Auditorías que fallaron una pregunta (No Cumple / Parcial) usando Auditoria_Respuesta"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            return consultar_fallas(cursor, pregunta, posicion, email, desde, hasta, limite=limite)
+        except Exception as e:
+            print(f"Error consultando fallas: {e}")
+            return None
 
 # --- ADMIN FUNCTIONS ---
 
-def obtener_todos_usuarios():
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol, s.saldo_actual
-            FROM Usuario u
-            JOIN Rol r ON u.id_rol = r.id_rol
-            LEFT JOIN Saldo s ON u.id_usuario = s.id_usuario
-            ORDER BY u.id_usuario DESC
-        """
-        cursor.execute(sql)
-        users = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in users]
-    except Exception as e:
-        print(f"Error fetching users: {e}")
-        return []
+USUARIOS_POR_PAGINA = 50
+USUARIOS_POR_PAGINA_MAX = 200
+
+# Columnas permitidas para ordenar (expresión SQL de la llave de orden)
+ORDEN_USUARIOS = {
+    'id': None,
+    'nombre': "lower(u.nombre)",
+    'apellido': "lower(u.apellido)",
+    'email': "lower(u.email)",
+}
+
+def obtener_todos_usuarios(buscar=None, orden='id', descendente=True, limite=USUARIOS_POR_PAGINA,
+                           cursor_pagina=None, con_estimado=False):
+    """Página de usuarios con búsqueda por prefijo (nombre, apellido, email, CURP) y orden keyset"""
+    vacio = {'users': [], 'siguiente_cursor': None}
+    with conexion_db() as conn:
+        if not conn: return vacio
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            limite = max(1, min(int(limite or USUARIOS_POR_PAGINA), USUARIOS_POR_PAGINA_MAX))
+            if orden not in ORDEN_USUARIOS:
+                orden = 'id'
+            llave = ORDEN_USUARIOS[orden]
+            comparador = "<" if descendente else ">"
+            direccion = "DESC" if descendente else "ASC"
+
+            filtros = ""
+            params = []
+            if buscar:
+                # Prefijos: aprovechan los índices lower(...) text_pattern_ops
+                prefijo = escapar_like(buscar.lower()) + "%"
+                filtros += """ AND (lower(u.nombre) LIKE %s OR lower(u.apellido) LIKE %s
+                                OR lower(u.email) LIKE %s OR lower(u.curp) LIKE %s)"""
+                params.extend([prefijo] * 4)
+
+            base = """
+                FROM Usuario u
+                JOIN Rol r ON u.id_rol = r.id_rol
+                LEFT JOIN Saldo s ON u.id_usuario = s.id_usuario
+                WHERE 1=1
+            """ + filtros
+
+            columnas = "u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol, s.saldo_actual"
+            if llave:
+                columnas += f", {llave} AS llave_orden"
+            sql = f"SELECT {columnas} {base}"
+            params_pagina = list(params)
+
+            if cursor_pagina:
+                valores = decodificar_cursor(cursor_pagina)
+                if valores and llave and len(valores) == 2:
+                    sql += f" AND ({llave}, u.id_usuario) {comparador} (%s, %s)"
+                    params_pagina.extend(valores)
+                elif valores and not llave and len(valores) == 1:
+                    sql += f" AND u.id_usuario {comparador} %s"
+                    params_pagina.extend(valores)
+
+            if llave:
+                sql += f" ORDER BY {llave} {direccion}, u.id_usuario {direccion}"
+            else:
+                sql += f" ORDER BY u.id_usuario {direccion}"
+            sql += " LIMIT %s"
+            params_pagina.append(limite + 1)
+
+            cursor.execute(sql, params_pagina)
+            users = [dict(row) for row in cursor.fetchall()]
+
+            siguiente = None
+            if len(users) > limite:
+                users = users[:limite]
+                ultimo = users[-1]
+                if llave:
+                    siguiente = codificar_cursor(ultimo['llave_orden'], ultimo['id_usuario'])
+                else:
+                    siguiente = codificar_cursor(ultimo['id_usuario'])
+            for user in users:
+                user.pop('llave_orden', None)
+
+            resultado = {'users': users, 'siguiente_cursor': siguiente}
+            if con_estimado:
+                resultado['total_estimado'] = estimar_filas(cursor, "SELECT 1 " + base, params)
+            return resultado
+        except Exception as e:
+            print(f"Error fetching users: {e}")
+            return vacio
 
 def obtener_usuario_por_id(id_usuario):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol, s.saldo_actual
-            FROM Usuario u
-            JOIN Rol r ON u.id_rol = r.id_rol
-            LEFT JOIN Saldo s ON u.id_usuario = s.id_usuario
-            WHERE u.id_usuario = %s
-        """
-        cursor.execute(sql, (id_usuario,))
-        user = cursor.fetchone()
-        conn.close()
-        return dict(user) if user else None
-    except Exception as e:
-        print(f"Error fetching user detail: {e}")
-        return None
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol, s.saldo_actual
+                FROM Usuario u
+                JOIN Rol r ON u.id_rol = r.id_rol
+                LEFT JOIN Saldo s ON u.id_usuario = s.id_usuario
+                WHERE u.id_usuario = %s
+            """
+            cursor.execute(sql, (id_usuario,))
+            user = cursor.fetchone()
+            return dict(user) if user else None
+        except Exception as e:
+            print(f"Error fetching user detail: {e}")
+            return None
 
 def obtener_juegos():
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        # Asumimos que la tabla Juego ya existe según el esquema proporcionado
-        sql = "SELECT * FROM Juego ORDER BY id_juego DESC"
-        cursor.execute(sql)
-        games = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in games]
-    except Exception as e:
-        print(f"Error fetching games: {e}")
-        return []
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            # Asumimos que la tabla Juego ya existe según el esquema proporcionado
+            sql = "SELECT * FROM Juego ORDER BY id_juego DESC"
+            cursor.execute(sql)
+            games = cursor.fetchall()
+            return [dict(row) for row in games]
+        except Exception as e:
+            print(f"Error fetching games: {e}")
+            return []
 
 def crear_juego(datos):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO Juego (nombre, descripcion, rtp, min_apuesta, max_apuesta, activo)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(sql, (
-            datos['nombre'], 
-            datos['descripcion'], 
-            float(datos['rtp']), 
-            float(datos['min_apuesta']), 
-            float(datos['max_apuesta']), 
-            datos['activo'] == 'true' or datos['activo'] == True
-        ))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error creating game: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = """
+                INSERT INTO Juego (nombre, descripcion, rtp, min_apuesta, max_apuesta, activo)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """
+            cursor.execute(sql, (
+                datos['nombre'], 
+                datos['descripcion'], 
+                float(datos['rtp']), 
+                float(datos['min_apuesta']), 
+                float(datos['max_apuesta']), 
+                datos['activo'] == 'true' or datos['activo'] == True
+            ))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error creating game: {e}")
+            conn.rollback()
+            return False
 
 def obtener_promociones():
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = "SELECT * FROM Bono ORDER BY id_bono DESC"
-        cursor.execute(sql)
-        promos = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in promos]
-    except Exception as e:
-        print(f"Error fetching promos: {e}")
-        return []
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = "SELECT * FROM Bono ORDER BY id_bono DESC"
+            cursor.execute(sql)
+            promos = cursor.fetchall()
+            return [dict(row) for row in promos]
+        except Exception as e:
+            print(f"Error fetching promos: {e}")
+            return []
 
 def crear_promocion(datos):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO Bono (nombre_bono, tipo, descripcion, fecha_expiracion, activo)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        # fecha_expiracion puede ser None o string YYYY-MM-DD
-        fecha = datos.get('fecha_expiracion')
-        if not fecha: fecha = None
-        
-        cursor.execute(sql, (
-            datos['nombre_bono'],
-            datos['tipo'],
-            datos['descripcion'],
-            fecha,
-            True # Activo por defecto
-        ))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error creating promo: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = """
+                INSERT INTO Bono (nombre_bono, tipo, descripcion, fecha_expiracion, activo)
+                VALUES (%s, %s, %s, %s, %s)
+            """
+            # fecha_expiracion puede ser None o string YYYY-MM-DD
+            fecha = datos.get('fecha_expiracion')
+            if not fecha: fecha = None
+
+            cursor.execute(sql, (
+                datos['nombre_bono'],
+                datos['tipo'],
+                datos['descripcion'],
+                fecha,
+                True # Activo por defecto
+            ))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error creating promo: {e}")
+            conn.rollback()
+            return False
+
+METRICAS_ADMIN_VACIAS = {"total_users": 0, "active_users": 0, "total_deposits": 0, "total_withdrawals": 0}
 
 def obtener_metricas():
-    conn = get_db_connection()
-    if not conn: return {"total_users": 0, "active_users": 0, "total_deposits": 0, "total_withdrawals": 0}
-    try:
-        cursor = conn.cursor()
-        
-        # Usuarios
-        cursor.execute("SELECT COUNT(*) FROM Usuario")
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM Usuario WHERE activo = true")
-        active_users = cursor.fetchone()[0]
-        
-        # Finanzas (Transaccion)
-        # Asumiendo tipos: 'Depósito', 'Retiro'
-        cursor.execute("SELECT COALESCE(SUM(monto), 0) FROM Transaccion WHERE tipo_transaccion = 'Depósito' AND estado = 'Completada'")
-        total_deposits = float(cursor.fetchone()[0])
-        
-        cursor.execute("SELECT COALESCE(SUM(monto), 0) FROM Transaccion WHERE tipo_transaccion = 'Retiro' AND estado = 'Completada'")
-        total_withdrawals = float(cursor.fetchone()[0])
-        
-        conn.close()
-        return {
-            "total_users": total_users, 
-            "active_users": active_users,
-            "total_deposits": total_deposits,
-            "total_withdrawals": total_withdrawals
-        }
-    except Exception as e:
-        print(f"Error metrics: {e}")
-        return {"total_users": 0, "active_users": 0, "total_deposits": 0, "total_withdrawals": 0}
+    """Totales del panel de admin desde Metrica_Contador (O(1), ver metricas_admin.py)"""
+    asegurar_reconciliador()
+    with conexion_db() as conn:
+        if not conn: return dict(METRICAS_ADMIN_VACIAS)
+        try:
+            cursor = conn.cursor()
+            totales = leer_totales(cursor)
+            return {
+                "total_users": int(totales['usuarios_total']),
+                "active_users": int(totales['usuarios_activos']),
+                "total_deposits": float(totales['depositos_monto']),
+                "total_withdrawals": float(totales['retiros_monto']),
+                "deposits_count": int(totales['depositos_conteo']),
+                "withdrawals_count": int(totales['retiros_conteo'])
+            }
+        except Exception as e:
+            print(f"Error metrics: {e}")
+            conn.rollback()
+            return dict(METRICAS_ADMIN_VACIAS)
+
+def obtener_serie_metricas(clave, desde, hasta, granularidad='hora'):
+    """Serie por hora/día de depositos, retiros o usuarios_nuevos para las gráficas"""
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor()
+            return [
+                {"fecha": cubeta.isoformat(), "valor": float(valor), "conteo": int(conteo)}
+                for cubeta, valor, conteo in leer_serie(cursor, clave, desde, hasta, granularidad)
+            ]
+        except Exception as e:
+            print(f"Error serie métricas: {e}")
+            return []
+
+def obtener_reporte_financiero(granularidad, desde, hasta, tipos=None):
+    """Curvas por hora/día/mes (depósitos, retiros, neto, GGR) desde los rollups"""
+    asegurar_agregador()
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            return curvas(consultar_rollup(cursor, granularidad, desde, hasta, tipos).fetchall())
+        except Exception as e:
+            print(f"Error reporte financiero: {e}")
+            return None
+
+def iterar_reporte_financiero(granularidad, desde, hasta, tipos=None):
+    """Renglones del rollup con cursor de servidor, para exportar en streaming"""
+    asegurar_agregador()
+    with conexion_db() as conn:
+        if not conn: return
+        cursor = conn.cursor(name="exportar_reporte_financiero")
+        cursor.itersize = 2000
+        try:
+            yield from consultar_rollup(cursor, granularidad, desde, hasta, tipos)
+        finally:
+            cursor.close()
+            conn.rollback()
 
 def actualizar_usuario_admin(id_usuario, nombre, apellido, nueva_password=None):
     """Actualizar datos de un usuario desde el panel de admin"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        if nueva_password and len(nueva_password) > 0:
-            pass_hash = pwd_context.hash(nueva_password)
-            sql = "UPDATE Usuario SET nombre = %s, apellido = %s, password_hash = %s WHERE id_usuario = %s"
-            cursor.execute(sql, (nombre, apellido, pass_hash, id_usuario))
-        else:
-            sql = "UPDATE Usuario SET nombre = %s, apellido = %s WHERE id_usuario = %s"
-            cursor.execute(sql, (nombre, apellido, id_usuario))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error actualizando usuario: {e}")
-        if conn: conn.rollback()
-        return False
+    pass_hash = None
+    if nueva_password and len(nueva_password) > 0:
+        pass_hash = hash_password(nueva_password)
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            if pass_hash:
+                sql = "UPDATE Usuario SET nombre = %s, apellido = %s, password_hash = %s WHERE id_usuario = %s"
+                cursor.execute(sql, (nombre, apellido, pass_hash, id_usuario))
+            else:
+                sql = "UPDATE Usuario SET nombre = %s, apellido = %s WHERE id_usuario = %s"
+                cursor.execute(sql, (nombre, apellido, id_usuario))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error actualizando usuario: {e}")
+            conn.rollback()
+            return False
 
 def cambiar_estado_usuario(id_usuario, activo):
     """Activar o desactivar un usuario"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = "UPDATE Usuario SET activo = %s WHERE id_usuario = %s"
-        cursor.execute(sql, (activo, id_usuario))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error cambiando estado: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = "UPDATE Usuario SET activo = %s WHERE id_usuario = %s"
+            cursor.execute(sql, (activo, id_usuario))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error cambiando estado: {e}")
+            conn.rollback()
+            return False
 
 def eliminar_usuario(id_usuario):
     """Eliminar un usuario (solo si no tiene dependencias críticas)"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        # Primero eliminar saldo (CASCADE debería hacerlo automáticamente)
-        sql = "DELETE FROM Usuario WHERE id_usuario = %s"
-        cursor.execute(sql, (id_usuario,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error eliminando usuario: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            # Primero eliminar saldo (CASCADE debería hacerlo automáticamente)
+            sql = "DELETE FROM Usuario WHERE id_usuario = %s"
+            cursor.execute(sql, (id_usuario,))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error eliminando usuario: {e}")
+            conn.rollback()
+            return False
 
 def obtener_administradores_y_auditores():
     """Obtener lista de administradores y auditores"""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol
-            FROM Usuario u
-            JOIN Rol r ON u.id_rol = r.id_rol
-            WHERE r.nombre IN ('Administrador', 'Auditor', 'Agente de Soporte')
-            ORDER BY r.nombre, u.id_usuario DESC
-        """
-        cursor.execute(sql)
-        users = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in users]
-    except Exception as e:
-        print(f"Error fetching admins/auditors: {e}")
-        return []
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql = """
+                SELECT u.id_usuario, u.nombre, u.apellido, u.email, u.activo, r.nombre as rol
+                FROM Usuario u
+                JOIN Rol r ON u.id_rol = r.id_rol
+                WHERE r.nombre IN ('Administrador', 'Auditor', 'Agente de Soporte')
+                ORDER BY r.nombre, u.id_usuario DESC
+            """
+            cursor.execute(sql)
+            users = cursor.fetchall()
+            return [dict(row) for row in users]
+        except Exception as e:
+            print(f"Error fetching admins/auditors: {e}")
+            return []
 
 # ==========================================
 # SECCIÓN 5: FUNCIONES PANEL DE AGENTE DE SOPORTE
@@ -442,356 +679,558 @@ def obtener_administradores_y_auditores():
 
 # --- TICKETS (Tabla: Soporte) ---
 
-def obtener_tickets(estado=None, asignado=None):
-    """Obtener todos los tickets con filtros opcionales"""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Base query usando la tabla Soporte
-        sql = """
-            SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email,
-                   a.nombre || ' ' || a.apellido as nombre_agente,
-                   s.id_jugador, s.id_agente
-            FROM Soporte s
-            JOIN Usuario u ON s.id_jugador = u.id_usuario
-            LEFT JOIN Usuario a ON s.id_agente = a.id_usuario
-            WHERE 1=1
-        """
-        params = []
-        
-        # Filtros
-        if estado:
-            sql += " AND s.estado = %s"
-            params.append(estado)
-        
-        if asignado == 'si':
-            sql += " AND s.id_agente IS NOT NULL"
-        elif asignado == 'no':
-            sql += " AND s.id_agente IS NULL"
-        
-        sql += " ORDER BY s.fecha_creacion DESC"
-        
-        cursor.execute(sql, params)
-        tickets = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in tickets]
-    except Exception as e:
-        print(f"Error obteniendo tickets: {e}")
-        return []
+TICKETS_POR_PAGINA = 50
+TICKETS_POR_PAGINA_MAX = 200
+
+SQL_TICKETS = """
+    SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
+           COALESCE(u.nombre, 'Usuario') || ' ' || COALESCE(u.apellido, 'Desconocido') as nombre_usuario,
+           u.email,
+           a.nombre || ' ' || a.apellido as nombre_agente,
+           s.id_jugador, s.id_agente
+    FROM Soporte s
+    LEFT JOIN Usuario u ON s.id_jugador = u.id_usuario
+    LEFT JOIN Usuario a ON s.id_agente = a.id_usuario
+    WHERE 1=1
+"""
+
+def consulta_tickets(estado=None, asignado=None, buscar=None, limite=TICKETS_POR_PAGINA, cursor_pagina=None):
+    """SQL de una página de tickets y de su conteo: (sql, params, sql_total, params_total, limite)"""
+    limite = max(1, min(int(limite or TICKETS_POR_PAGINA), TICKETS_POR_PAGINA_MAX))
+
+    # Filtros (compartidos por la página y el conteo)
+    filtros = ""
+    params = []
+    if estado:
+        filtros += " AND s.estado = %s"
+        params.append(estado)
+
+    if asignado == 'si':
+        filtros += " AND s.id_agente IS NOT NULL"
+    elif asignado == 'no':
+        filtros += " AND s.id_agente IS NULL"
+
+    if buscar:
+        filtros += " AND s.asunto ILIKE %s"
+        params.append(f"%{escapar_like(buscar)}%")
+
+    sql = SQL_TICKETS + filtros
+    params_pagina = list(params)
+
+    if cursor_pagina:
+        valores = decodificar_cursor(cursor_pagina)
+        if valores and len(valores) == 2:
+            sql += " AND (s.fecha_creacion, s.id_ticket) < (%s, %s)"
+            params_pagina.extend(valores)
+
+    # Pedimos una fila extra para saber si hay página siguiente
+    sql += " ORDER BY s.fecha_creacion DESC, s.id_ticket DESC LIMIT %s"
+    params_pagina.append(limite + 1)
+
+    sql_total = "SELECT COUNT(*) AS total FROM Soporte s WHERE 1=1" + filtros
+    return sql, params_pagina, sql_total, params, limite
+
+def pagina_tickets(filas, limite):
+    """Recorta la fila extra y arma el cursor de la página siguiente"""
+    tickets = [dict(row) for row in filas]
+    siguiente = None
+    if len(tickets) > limite:
+        tickets = tickets[:limite]
+        ultimo = tickets[-1]
+        siguiente = codificar_cursor(ultimo['fecha_creacion'], ultimo['id_ticket'])
+    return {'tickets': tickets, 'siguiente_cursor': siguiente}
+
+def obtener_tickets(estado=None, asignado=None, buscar=None, limite=TICKETS_POR_PAGINA,
+                    cursor_pagina=None, con_total=False):
+    """Obtener una página de tickets (keyset sobre fecha_creacion, id_ticket) con filtros opcionales"""
+    asegurar_ruteador()
+    vacio = {'tickets': [], 'siguiente_cursor': None}
+    if con_total: vacio['total'] = 0
+    with conexion_db() as conn:
+        if not conn: return vacio
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            sql, params_pagina, sql_total, params, limite = consulta_tickets(
+                estado, asignado, buscar, limite, cursor_pagina
+            )
+
+            cursor.execute(sql, params_pagina)
+            resultado = pagina_tickets(cursor.fetchall(), limite)
+            if con_total:
+                cursor.execute(sql_total, params)
+                resultado['total'] = cursor.fetchone()['total']
+            return resultado
+        except Exception as e:
+            print(f"Error obteniendo tickets: {e}")
+            return vacio
+
+SQL_TICKET = """
+    SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
+           u.nombre || ' ' || u.apellido as nombre_usuario, u.email,
+           a.nombre || ' ' || a.apellido as nombre_agente,
+           s.id_jugador, s.id_agente, s.version
+    FROM Soporte s
+    JOIN Usuario u ON s.id_jugador = u.id_usuario
+    LEFT JOIN Usuario a ON s.id_agente = a.id_usuario
+    WHERE s.id_ticket = %s
+"""
+
+# Lo único que lee un sondeo del detalle cuando no hubo cambios (PK)
+SQL_VERSION_TICKET = "SELECT version FROM Soporte WHERE id_ticket = %s"
+
+SQL_RESPUESTAS_TICKET = """
+    SELECT r.id_respuesta, r.mensaje, r.es_agente, r.fecha_respuesta,
+           u.nombre || ' ' || u.apellido as nombre_usuario, r.id_usuario
+    FROM Respuesta_Ticket r
+    JOIN Usuario u ON r.id_usuario = u.id_usuario
+    WHERE r.id_ticket = %s AND r.id_respuesta > %s
+    ORDER BY r.id_respuesta ASC
+"""
+
+# Resultados de responder_ticket
+RESPONDIDO = 'respondido'
+TICKET_CERRADO = 'cerrado'
+TICKET_NO_EXISTE = 'no_existe'
+
+# Solo tickets no cerrados reciben respuestas
+SQL_RESPONDER_TICKET = """
+    INSERT INTO Respuesta_Ticket (id_ticket, id_usuario, mensaje, es_agente, fecha_respuesta)
+    SELECT id_ticket, %s, %s, %s, NOW()
+    FROM Soporte
+    WHERE id_ticket = %s AND estado != 'Cerrado'
+    RETURNING id_respuesta
+"""
 
 def obtener_ticket_por_id(id_ticket):
     """Obtener detalles de un ticket específico"""
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email,
-                   a.nombre || ' ' || a.apellido as nombre_agente,
-                   s.id_jugador, s.id_agente
-            FROM Soporte s
-            JOIN Usuario u ON s.id_jugador = u.id_usuario
-            LEFT JOIN Usuario a ON s.id_agente = a.id_usuario
-            WHERE s.id_ticket = %s
-        """
-        cursor.execute(sql, (id_ticket,))
-        ticket = cursor.fetchone()
-        conn.close()
-        return dict(ticket) if ticket else None
-    except Exception as e:
-        print(f"Error obteniendo ticket: {e}")
-        return None
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(SQL_TICKET, (id_ticket,))
+            ticket = cursor.fetchone()
+            return dict(ticket) if ticket else None
+        except Exception as e:
+            print(f"Error obteniendo ticket: {e}")
+            return None
+
+def etag_ticket(id_ticket, version):
+    return f'"t{id_ticket}.{version}"'
 
-def obtener_respuestas_ticket(id_ticket):
-    """Obtener respuestas de un ticket - NO IMPLEMENTADO (no hay tabla de respuestas)"""
-    # La DB actual no tiene tabla de respuestas, retornar lista vacía
-    return []
+def version_en_etag(if_none_match, id_ticket):
+    """Versión del ticket que el cliente ya tiene según su If-None-Match (None si no manda una)"""
+    prefijo = f'"t{id_ticket}.'
+    for etiqueta in (if_none_match or '').split(','):
+        etiqueta = etiqueta.strip().removeprefix('W/')
+        if etiqueta.startswith(prefijo) and etiqueta.endswith('"'):
+            try:
+                return int(etiqueta[len(prefijo):-1])
+            except ValueError:
+                pass
+    return None
+
+def detalle_ticket(ticket, respuestas, desde_id=None):
+    """Arma la respuesta de obtener_detalle_ticket a partir del ticket y las respuestas nuevas"""
+    if respuestas:
+        ultimo_id = respuestas[-1]['id_respuesta']
+    else:
+        ultimo_id = desde_id or 0
+    return {
+        'ticket': dict(ticket),
+        'respuestas': respuestas,
+        'version': ticket['version'],
+        'ultimo_id': ultimo_id
+    }
+
+def obtener_respuestas_ticket(id_ticket, desde_id=None):
+    """Respuestas de un ticket en orden, todas o solo las posteriores a desde_id"""
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(SQL_RESPUESTAS_TICKET, (id_ticket, desde_id or 0))
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error obteniendo respuestas del ticket: {e}")
+            return []
+
+def obtener_detalle_ticket(id_ticket, version=None, desde_id=None):
+    """Ticket y respuestas posteriores a desde_id, o {'sin_cambios': True} si sigue en `version`.
+
+    None si el ticket no existe. Sin cambios solo se lee Soporte.version por PK.
+    """
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            if version is not None:
+                cursor.execute(SQL_VERSION_TICKET, (id_ticket,))
+                fila = cursor.fetchone()
+                if not fila:
+                    return None
+                if fila['version'] == version:
+                    return {'sin_cambios': True, 'version': version}
+
+            cursor.execute(SQL_TICKET, (id_ticket,))
+            ticket = cursor.fetchone()
+            if not ticket:
+                return None
+            cursor.execute(SQL_RESPUESTAS_TICKET, (id_ticket, desde_id or 0))
+            return detalle_ticket(ticket, [dict(row) for row in cursor.fetchall()], desde_id)
+        except Exception as e:
+            print(f"Error obteniendo detalle del ticket: {e}")
+            return None
 
 def asignar_ticket(id_ticket, id_agente):
     """Asignar un ticket a un agente"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = """
-            UPDATE Soporte 
-            SET id_agente = %s, estado = 'En Proceso'
-            WHERE id_ticket = %s
-        """
-        cursor.execute(sql, (id_agente, id_ticket))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error asignando ticket: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = """
+                UPDATE Soporte 
+                SET id_agente = %s, estado = 'En Proceso'
+                WHERE id_ticket = %s
+            """
+            cursor.execute(sql, (id_agente, id_ticket))
+            conn.commit()
+            invalidar_metricas_globales()
+            return True
+        except Exception as e:
+            print(f"Error asignando ticket: {e}")
+            conn.rollback()
+            return False
 
 def responder_ticket(id_ticket, id_usuario, mensaje, es_agente=True):
-    """Agregar una respuesta a un ticket - NO IMPLEMENTADO (no hay tabla de respuestas)"""
-    # La DB actual no tiene tabla de respuestas
-    # Podrías actualizar el mensaje del ticket o simplemente retornar False
-    return False
+    """Agregar una respuesta a un ticket no cerrado (el trigger sube Soporte.version).
+
+    Devuelve RESPONDIDO, TICKET_CERRADO o TICKET_NO_EXISTE; None si falla.
+    """
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(SQL_RESPONDER_TICKET, (id_usuario, mensaje, es_agente, id_ticket))
+            if cursor.fetchone() is not None:
+                conn.commit()
+                return RESPONDIDO
+            # No se insertó nada: distinguir un ticket cerrado de uno que no existe
+            cursor.execute("SELECT 1 FROM Soporte WHERE id_ticket = %s", (id_ticket,))
+            existe = cursor.fetchone() is not None
+            conn.rollback()
+            return TICKET_CERRADO if existe else TICKET_NO_EXISTE
+        except Exception as e:
+            print(f"Error respondiendo ticket: {e}")
+            conn.rollback()
+            return None
 
 def cerrar_ticket(id_ticket):
     """Cerrar un ticket"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = "UPDATE Soporte SET estado = 'Cerrado', fecha_cierre = NOW() WHERE id_ticket = %s"
-        cursor.execute(sql, (id_ticket,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error cerrando ticket: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = "UPDATE Soporte SET estado = 'Cerrado', fecha_cierre = NOW() WHERE id_ticket = %s"
+            cursor.execute(sql, (id_ticket,))
+            conn.commit()
+            invalidar_metricas_globales()
+            return True
+        except Exception as e:
+            print(f"Error cerrando ticket: {e}")
+            conn.rollback()
+            return False
+
+SQL_TICKETS_AGENTE = """
+    SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
+           u.nombre || ' ' || u.apellido as nombre_usuario, u.email,
+           s.id_jugador, s.id_agente
+    FROM Soporte s
+    JOIN Usuario u ON s.id_jugador = u.id_usuario
+    WHERE s.id_agente = %s AND s.estado != 'Cerrado'
+    ORDER BY s.fecha_creacion DESC
+"""
+
+def con_fecha_asignacion(tickets):
+    """Agregar fecha_asignacion ficticia para compatibilidad con frontend"""
+    result = []
+    for ticket in tickets:
+        t = dict(ticket)
+        t['fecha_asignacion'] = t['fecha_creacion']  # Usar fecha_creacion como aproximación
+        result.append(t)
+    return result
 
 def obtener_tickets_agente(id_agente):
     """Obtener tickets asignados a un agente específico"""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT s.id_ticket, s.asunto, s.mensaje, s.estado, s.fecha_creacion, s.fecha_cierre,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email,
-                   s.id_jugador, s.id_agente
-            FROM Soporte s
-            JOIN Usuario u ON s.id_jugador = u.id_usuario
-            WHERE s.id_agente = %s AND s.estado != 'Cerrado'
-            ORDER BY s.fecha_creacion DESC
-        """
-        cursor.execute(sql, (id_agente,))
-        tickets = cursor.fetchall()
-        conn.close()
-        
-        # Agregar fecha_asignacion ficticia para compatibilidad con frontend
-        result = []
-        for ticket in tickets:
-            t = dict(ticket)
-            t['fecha_asignacion'] = t['fecha_creacion']  # Usar fecha_creacion como aproximación
-            result.append(t)
-        return result
-    except Exception as e:
-        print(f"Error obteniendo tickets del agente: {e}")
-        return []
+    asegurar_ruteador()
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(SQL_TICKETS_AGENTE, (id_agente,))
+            return con_fecha_asignacion(cursor.fetchall())
+        except Exception as e:
+            print(f"Error obteniendo tickets del agente: {e}")
+            return []
 
 # --- CHATS (Tabla: Chat y Mensaje_Chat) ---
 
+SQL_CHATS_ESPERANDO = """
+    SELECT c.id_chat, c.fecha_inicio, c.estado,
+           u.nombre || ' ' || u.apellido as nombre_usuario, u.email
+    FROM Chat c
+    JOIN Usuario u ON c.id_jugador = u.id_usuario
+    WHERE c.estado = 'Esperando'
+    ORDER BY c.fecha_inicio ASC
+"""
+
+SQL_CHATS_AGENTE = """
+    SELECT c.id_chat, c.fecha_inicio, c.fecha_asignacion, c.estado,
+           u.nombre || ' ' || u.apellido as nombre_usuario, u.email
+    FROM Chat c
+    JOIN Usuario u ON c.id_jugador = u.id_usuario
+    WHERE c.id_agente = %s AND c.estado = 'Activo'
+    ORDER BY c.fecha_asignacion DESC
+"""
+
 def obtener_chats_esperando():
     """Obtener chats en espera de ser asignados a un agente"""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT c.id_chat, c.fecha_inicio, c.estado,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email
-            FROM Chat c
-            JOIN Usuario u ON c.id_jugador = u.id_usuario
-            WHERE c.estado = 'Esperando'
-            ORDER BY c.fecha_inicio ASC
-        """
-        cursor.execute(sql)
-        chats = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in chats]
-    except Exception as e:
-        print(f"Error obteniendo chats en espera: {e}")
-        return []
+    asegurar_despachador()
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(SQL_CHATS_ESPERANDO)
+            chats = cursor.fetchall()
+            return [dict(row) for row in chats]
+        except Exception as e:
+            print(f"Error obteniendo chats en espera: {e}")
+            return []
 
 def obtener_chats_agente(id_agente):
     """Obtener chats activos asignados a un agente específico"""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        sql = """
-            SELECT c.id_chat, c.fecha_inicio, c.fecha_asignacion, c.estado,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email
-            FROM Chat c
-            JOIN Usuario u ON c.id_jugador = u.id_usuario
-            WHERE c.id_agente = %s AND c.estado = 'Activo'
-            ORDER BY c.fecha_asignacion DESC
-        """
-        cursor.execute(sql, (id_agente,))
-        chats = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in chats]
-    except Exception as e:
-        print(f"Error obteniendo chats del agente: {e}")
-        return []
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(SQL_CHATS_AGENTE, (id_agente,))
+            chats = cursor.fetchall()
+            return [dict(row) for row in chats]
+        except Exception as e:
+            print(f"Error obteniendo chats del agente: {e}")
+            return []
 
-def obtener_mensajes_chat(id_chat):
-    """Obtener información del chat y todos sus mensajes"""
-    conn = get_db_connection()
-    if not conn: return {'chat': None, 'mensajes': []}
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Obtener información del chat
-        sql_chat = """
-            SELECT c.id_chat, c.fecha_inicio, c.fecha_asignacion, c.fecha_cierre, c.estado,
-                   u.nombre || ' ' || u.apellido as nombre_usuario, u.email as email_usuario,
-                   a.nombre || ' ' || a.apellido as nombre_agente
-            FROM Chat c
-            JOIN Usuario u ON c.id_jugador = u.id_usuario
-            LEFT JOIN Usuario a ON c.id_agente = a.id_usuario
-            WHERE c.id_chat = %s
-        """
-        cursor.execute(sql_chat, (id_chat,))
-        chat = cursor.fetchone()
-        
-        if not chat:
-            conn.close()
+SQL_MENSAJES_CHAT = """
+    SELECT m.id_mensaje, m.mensaje, m.fecha_mensaje, m.es_agente, m.leido,
+           u.nombre || ' ' || u.apellido as nombre_usuario
+    FROM Mensaje_Chat m
+    JOIN Usuario u ON m.id_usuario = u.id_usuario
+    WHERE m.id_chat = %s
+"""
+
+SQL_CHAT = """
+    SELECT c.id_chat, c.fecha_inicio, c.fecha_asignacion, c.fecha_cierre, c.estado,
+           u.nombre || ' ' || u.apellido as nombre_usuario, u.email as email_usuario,
+           a.nombre || ' ' || a.apellido as nombre_agente
+    FROM Chat c
+    JOIN Usuario u ON c.id_jugador = u.id_usuario
+    LEFT JOIN Usuario a ON c.id_agente = a.id_usuario
+    WHERE c.id_chat = %s
+"""
+
+def etag_chat(chat):
+    """Huella del encabezado del chat: cambia solo si cambia estado, agente o fechas"""
+    contenido = json.dumps(dict(chat), default=str, sort_keys=True)
+    return hashlib.md5(contenido.encode('utf-8')).hexdigest()[:16]
+
+def consulta_mensajes(id_chat, desde_id=None, desde_ts=None):
+    """(sql, params) de los mensajes del chat, todos o solo los posteriores al cursor (usa el índice id_chat, id_mensaje)"""
+    sql = SQL_MENSAJES_CHAT
+    params = [id_chat]
+    if desde_id is not None:
+        sql += " AND m.id_mensaje > %s ORDER BY m.id_mensaje ASC"
+        params.append(desde_id)
+    elif desde_ts is not None:
+        sql += " AND m.fecha_mensaje > %s ORDER BY m.fecha_mensaje ASC, m.id_mensaje ASC"
+        params.append(desde_ts)
+    else:
+        sql += " ORDER BY m.fecha_mensaje ASC"
+    return sql, params
+
+def _consultar_mensajes(cursor, id_chat, desde_id=None, desde_ts=None):
+    cursor.execute(*consulta_mensajes(id_chat, desde_id, desde_ts))
+    return [dict(row) for row in cursor.fetchall()]
+
+def respuesta_mensajes(chat, mensajes, desde_id=None, chat_etag=None):
+    """Arma la respuesta de obtener_mensajes_chat a partir del encabezado y los mensajes"""
+    etag = etag_chat(chat)
+    if mensajes:
+        ultimo_id = max(m['id_mensaje'] for m in mensajes)
+    else:
+        ultimo_id = desde_id or 0
+
+    resultado = {
+        'mensajes': mensajes,
+        'chat_etag': etag,
+        'ultimo_id': ultimo_id
+    }
+    if chat_etag and chat_etag == etag:
+        resultado['chat_sin_cambios'] = True
+    else:
+        resultado['chat'] = dict(chat)
+    return resultado
+
+def obtener_mensajes_chat(id_chat, desde_id=None, desde_ts=None, chat_etag=None):
+    """Obtener información del chat y sus mensajes.
+
+    Con desde_id/desde_ts solo devuelve los mensajes más nuevos que el cursor, y si
+    chat_etag coincide con el encabezado actual omite 'chat' y marca 'chat_sin_cambios'.
+    """
+    with conexion_db() as conn:
+        if not conn: return {'chat': None, 'mensajes': []}
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            # Obtener información del chat
+            cursor.execute(SQL_CHAT, (id_chat,))
+            chat = cursor.fetchone()
+
+            if not chat:
+                return {'chat': None, 'mensajes': []}
+
+            mensajes = _consultar_mensajes(cursor, id_chat, desde_id, desde_ts)
+            return respuesta_mensajes(chat, mensajes, desde_id, chat_etag)
+        except Exception as e:
+            print(f"Error obteniendo mensajes del chat: {e}")
             return {'chat': None, 'mensajes': []}
-        
-        # Obtener mensajes del chat
-        sql_mensajes = """
-            SELECT m.id_mensaje, m.mensaje, m.fecha_mensaje, m.es_agente, m.leido,
-                   u.nombre || ' ' || u.apellido as nombre_usuario
-            FROM Mensaje_Chat m
-            JOIN Usuario u ON m.id_usuario = u.id_usuario
-            WHERE m.id_chat = %s
-            ORDER BY m.fecha_mensaje ASC
-        """
-        cursor.execute(sql_mensajes, (id_chat,))
-        mensajes = cursor.fetchall()
-        
-        conn.close()
-        return {
-            'chat': dict(chat),
-            'mensajes': [dict(row) for row in mensajes]
-        }
-    except Exception as e:
-        print(f"Error obteniendo mensajes del chat: {e}")
-        return {'chat': None, 'mensajes': []}
+
+def obtener_mensajes_nuevos(id_chat, desde_id=0):
+    """Obtener solo los mensajes de un chat posteriores a desde_id"""
+    with conexion_db() as conn:
+        if not conn: return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            return _consultar_mensajes(cursor, id_chat, desde_id=desde_id or 0)
+        except Exception as e:
+            print(f"Error obteniendo mensajes nuevos: {e}")
+            return []
 
 def tomar_chat(id_chat, id_agente):
-    """Asignar un chat a un agente y cambiar su estado a Activo"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = """
-            UPDATE Chat 
-            SET id_agente = %s, estado = 'Activo', fecha_asignacion = NOW()
-            WHERE id_chat = %s AND estado = 'Esperando'
-        """
-        cursor.execute(sql, (id_agente, id_chat))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error tomando chat: {e}")
-        if conn: conn.rollback()
-        return False
+    """Asignar un chat en espera a un agente: 'tomado', 'perdido' (ya lo tiene otro), 'no_existe' o None si falló"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            resultado = reclamar_chat(cursor, id_chat, id_agente)
+            conn.commit()
+            invalidar_metricas_globales()
+            return resultado
+        except Exception as e:
+            print(f"Error tomando chat: {e}")
+            conn.rollback()
+            return None
+
+def tomar_siguiente_chat(id_agente):
+    """Asignar al agente el chat que más tiempo lleva esperando (id_chat o None si no hay)"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            cursor = conn.cursor()
+            id_chat = reclamar_siguiente(cursor, id_agente)
+            conn.commit()
+            if id_chat is not None:
+                invalidar_metricas_globales()
+            return id_chat
+        except Exception as e:
+            print(f"Error tomando siguiente chat: {e}")
+            conn.rollback()
+            return None
+
+def marcar_disponibilidad_agente(id_agente, disponible):
+    """Activa/desactiva la asignación automática de chats para un agente"""
+    asegurar_despachador()
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            marcar_disponible(cursor, id_agente, disponible)
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error marcando disponibilidad: {e}")
+            conn.rollback()
+            return False
+
+def registrar_latido_agente(id_agente):
+    """El agente sigue conectado (lo llama el stream de la cola en cada ping)"""
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            registrar_latido(cursor, id_agente)
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error registrando latido: {e}")
+            conn.rollback()
+            return False
 
 def enviar_mensaje_chat(id_chat, id_usuario, mensaje, es_agente=True):
     """Enviar un mensaje en un chat"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = """
-            INSERT INTO Mensaje_Chat (id_chat, id_usuario, mensaje, es_agente, fecha_mensaje, leido)
-            VALUES (%s, %s, %s, %s, NOW(), false)
-        """
-        cursor.execute(sql, (id_chat, id_usuario, mensaje, es_agente))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error enviando mensaje: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = """
+                INSERT INTO Mensaje_Chat (id_chat, id_usuario, mensaje, es_agente, fecha_mensaje, leido)
+                VALUES (%s, %s, %s, %s, NOW(), false)
+                RETURNING id_mensaje
+            """
+            cursor.execute(sql, (id_chat, id_usuario, mensaje, es_agente))
+            id_mensaje = cursor.fetchone()[0]
+            notificar_chat(cursor, id_chat, 'mensaje', id_mensaje=id_mensaje)
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error enviando mensaje: {e}")
+            conn.rollback()
+            return False
 
 def cerrar_chat(id_chat):
     """Cerrar un chat"""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        cursor = conn.cursor()
-        sql = "UPDATE Chat SET estado = 'Cerrado', fecha_cierre = NOW() WHERE id_chat = %s"
-        cursor.execute(sql, (id_chat,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Error cerrando chat: {e}")
-        if conn: conn.rollback()
-        return False
+    with conexion_db() as conn:
+        if not conn: return False
+        try:
+            cursor = conn.cursor()
+            sql = "UPDATE Chat SET estado = 'Cerrado', fecha_cierre = NOW() WHERE id_chat = %s"
+            cursor.execute(sql, (id_chat,))
+            notificar_chat(cursor, id_chat, 'estado', estado='Cerrado')
+            conn.commit()
+            invalidar_metricas_globales()
+            return True
+        except Exception as e:
+            print(f"Error cerrando chat: {e}")
+            conn.rollback()
+            return False
 
 # --- DASHBOARD ---
 
 def obtener_dashboard_agente(id_agente):
-    """Obtener métricas para el dashboard del agente"""
-    conn = get_db_connection()
-    if not conn: 
-        return {
-            'tickets_pendientes': 0,
-            'mis_tickets': 0,
-            'chats_esperando': 0,
-            'mis_chats': 0,
-            'cerrados_hoy': 0
-        }
-    try:
-        cursor = conn.cursor()
-        
-        # Tickets pendientes (sin asignar)
-        cursor.execute("SELECT COUNT(*) FROM Soporte WHERE id_agente IS NULL AND estado = 'Abierto'")
-        tickets_pendientes = cursor.fetchone()[0]
-        
-        # Mis tickets
-        cursor.execute("SELECT COUNT(*) FROM Soporte WHERE id_agente = %s AND estado != 'Cerrado'", (id_agente,))
-        mis_tickets = cursor.fetchone()[0]
-        
-        # Chats en espera
-        cursor.execute("SELECT COUNT(*) FROM Chat WHERE estado = 'Esperando'")
-        chats_esperando = cursor.fetchone()[0]
-        
-        # Mis chats activos
-        cursor.execute("SELECT COUNT(*) FROM Chat WHERE id_agente = %s AND estado = 'Activo'", (id_agente,))
-        mis_chats = cursor.fetchone()[0]
-        
-        # Cerrados hoy (tickets y chats)
-        cursor.execute("""
-            SELECT COUNT(*) FROM Soporte 
-            WHERE id_agente = %s AND estado = 'Cerrado' 
-            AND DATE(fecha_cierre) = CURRENT_DATE
-        """, (id_agente,))
-        tickets_cerrados_hoy = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            SELECT COUNT(*) FROM Chat 
-            WHERE id_agente = %s AND estado = 'Cerrado' 
-            AND DATE(fecha_cierre) = CURRENT_DATE
-        """, (id_agente,))
-        chats_cerrados_hoy = cursor.fetchone()[0]
-        
-        cerrados_hoy = tickets_cerrados_hoy + chats_cerrados_hoy
-        
-        conn.close()
-        return {
-            'tickets_pendientes': tickets_pendientes,
-            'mis_tickets': mis_tickets,
-            'chats_esperando': chats_esperando,
-            'mis_chats': mis_chats,
-            'cerrados_hoy': cerrados_hoy
-        }
-    except Exception as e:
-        print(f"Error en dashboard agente: {e}")
-        return {
-            'tickets_pendientes': 0,
-            'mis_tickets': 0,
-            'chats_esperando': 0,
-            'mis_chats': 0,
-            'cerrados_hoy': 0
-        }
+    """Obtener métricas para el dashboard del agente (una consulta, globales en caché)"""
+    with conexion_db() as conn:
+        if not conn:
+            return dict(METRICAS_VACIAS)
+        try:
+            return calcular_metricas_agente(conn, id_agente)
+        except Exception as e:
+            print(f"Error en dashboard agente: {e}")
+            return dict(METRICAS_VACIAS)
+
+def obtener_cambios(conocidas):
+    """Claves del feed de cambios cuya versión difiere de la conocida ({clave: versión}); None si falla"""
+    with conexion_db() as conn:
+        if not conn: return None
+        try:
+            return leer_cambios(conn.cursor(), conocidas)
+        except Exception as e:
+            print(f"Error leyendo versiones de cambio: {e}")
+            return None
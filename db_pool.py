@@ -0,0 +1,219 @@
+"""
+Pool de conexiones a Neon (PostgreSQL) compartido por todo el servidor.
+Evita el handshake TLS + autenticación en cada petición: las conexiones se
+reutilizan, se verifican al prestarse y se cierran si pasan mucho tiempo inactivas.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from instrumentacion_sql import ConexionInstrumentada
+
+
+class PoolAgotado(Exception):
+    """No hubo conexión libre dentro del tiempo de espera"""
+
+
+class PoolConexiones:
+    """Pool thread-safe con tamaño mínimo/máximo, health check y limpieza de inactivas"""
+
+    def __init__(self, dsn, minimo=1, maximo=10, max_inactiva=300,
+                 verificar_tras=30, espera=10):
+        self.dsn = dsn
+        self.minimo = minimo
+        self.maximo = maximo
+        self.max_inactiva = max_inactiva      # segundos antes de cerrar una conexión ociosa
+        self.verificar_tras = verificar_tras  # segundos ociosa antes de hacer SELECT 1
+        self.espera = espera                  # segundos máximos esperando una conexión libre
+        self._libres = []                     # [(conn, ultimo_uso)]
+        self._en_uso = set()
+        self._cond = threading.Condition()
+        self._cerrado = False
+
+    # --- Creación y verificación ---
+
+    def _nueva_conexion(self):
+        # Todos los cursores de las conexiones del pool se miden (ver instrumentacion_sql.py)
+        return psycopg2.connect(
+            self.dsn,
+            connection_factory=ConexionInstrumentada,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+        )
+
+    def _esta_sana(self, conn, ultimo_uso):
+        """Health check al prestar: conexión abierta y, si estuvo ociosa, responde a SELECT 1"""
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self.verificar_tras:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _cerrar(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # --- Préstamo y devolución ---
+
+    def obtener(self):
+        """Prestar una conexión sana del pool (bloquea hasta `espera` segundos si está lleno)"""
+        limite = time.monotonic() + self.espera
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._cerrado:
+                        raise PoolAgotado("El pool está cerrado")
+
+                    # Reutilizar la conexión usada más recientemente (LIFO)
+                    if self._libres:
+                        conn, ultimo_uso = self._libres.pop()
+                        self._en_uso.add(conn)
+                        break
+
+                    if len(self._en_uso) < self.maximo:
+                        # Reservar el lugar antes de conectar fuera del lock
+                        marcador = object()
+                        self._en_uso.add(marcador)
+                        break
+
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise PoolAgotado(f"Sin conexiones libres (máximo {self.maximo})")
+                    self._cond.wait(restante)
+
+            if conn is None:
+                break
+
+            # El SELECT 1 va fuera del lock: los demás préstamos no esperan este viaje de red
+            if self._esta_sana(conn, ultimo_uso):
+                return conn
+            self._cerrar(conn)
+            with self._cond:
+                self._en_uso.discard(conn)
+                self._cond.notify()
+
+        try:
+            conn = self._nueva_conexion()
+        except Exception:
+            with self._cond:
+                self._en_uso.discard(marcador)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._en_uso.discard(marcador)
+            self._en_uso.add(conn)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        """Regresar una conexión al pool, deshaciendo cualquier transacción abierta"""
+        if not descartar and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                descartar = True
+
+        with self._cond:
+            self._en_uso.discard(conn)
+            if descartar or conn.closed or self._cerrado:
+                self._cerrar(conn)
+            else:
+                self._libres.append((conn, time.monotonic()))
+            self._limpiar_inactivas()
+            self._cond.notify()
+
+    def _limpiar_inactivas(self):
+        """Cerrar conexiones ociosas por encima del mínimo (llamar con el lock tomado)"""
+        ahora = time.monotonic()
+        total = len(self._libres) + len(self._en_uso)
+        conservar = []
+        # _libres está ordenada de la más vieja a la más reciente
+        for conn, ultimo_uso in self._libres:
+            if total > self.minimo and ahora - ultimo_uso > self.max_inactiva:
+                self._cerrar(conn)
+                total -= 1
+            else:
+                conservar.append((conn, ultimo_uso))
+        self._libres = conservar
+
+    @contextmanager
+    def conexion(self):
+        """Context manager: presta una conexión y la devuelve al salir"""
+        conn = self.obtener()
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            self.devolver(conn, descartar=True)
+            raise
+        except BaseException:
+            self.devolver(conn)
+            raise
+        else:
+            self.devolver(conn)
+
+    # --- Mantenimiento ---
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "libres": len(self._libres),
+                "en_uso": len(self._en_uso),
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+            }
+
+    def cerrar_todas(self):
+        with self._cond:
+            self._cerrado = True
+            for conn, _ in self._libres:
+                self._cerrar(conn)
+            self._libres = []
+            self._cond.notify_all()
+
+
+# --- Pool global por proceso (gunicorn hace fork de cada worker) ---
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool():
+    """Devuelve el pool del proceso actual, creándolo la primera vez"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            database_url = os.environ.get('DATABASE_URL')
+            if not database_url:
+                print("ERROR: Falta DATABASE_URL")
+                return None
+            # Las conexiones heredadas del proceso padre no se tocan: pertenecen a él
+            _pool = PoolConexiones(
+                database_url,
+                minimo=int(os.environ.get('DB_POOL_MIN', 1)),
+                maximo=int(os.environ.get('DB_POOL_MAX', 10)),
+                max_inactiva=int(os.environ.get('DB_POOL_MAX_INACTIVA', 300)),
+                espera=float(os.environ.get('DB_POOL_ESPERA', 10)),
+            )
+            _pool_pid = os.getpid()
+    return _pool
@@ -0,0 +1,259 @@
+"""
+Despacho de la cola de chats (migración 011).
+Tomar un chat es un UPDATE sobre la fila reclamada con FOR UPDATE SKIP
+LOCKED: si otro agente lo está tomando en ese instante no se espera su lock,
+y el resultado distingue "tomado" de "perdido" en lugar de devolver éxito
+aunque otro haya ganado.
+
+Con CHAT_AUTOASIGNAR=1 un hilo por worker (uno a la vez, con advisory lock)
+reparte los chats en espera, del más viejo al más nuevo, al agente
+disponible con menos chats activos (el mismo conteo de obtener_chats_agente),
+hasta CHAT_MAX_POR_AGENTE cada uno. El hilo despierta con los avisos de la
+cola (NOTIFY del trigger) y no consultando en bucle.
+"""
+import heapq
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from chat_eventos import COLA_CHATS, evento_sse, notificar_chat, notificar_cola, suscribir, desuscribir
+
+AUTOASIGNAR = os.environ.get('CHAT_AUTOASIGNAR', '').lower() in ('1', 'true', 'si')
+# Chats activos simultáneos por agente antes de dejar de recibir automáticos
+MAX_CHATS_POR_AGENTE = int(os.environ.get('CHAT_MAX_POR_AGENTE', 3))
+# Segundos sin latido tras los que un agente deja de contar como disponible
+LATIDO_MAX = int(os.environ.get('CHAT_LATIDO_MAX', 60))
+# Segundos entre rondas si no llegan avisos de la cola
+INTERVALO_DESPACHO = float(os.environ.get('CHAT_DESPACHO_SEG', 30))
+# Chats reclamados por ronda
+LOTE_DESPACHO = 50
+LLAVE_ADVISORY = 'despacho_chats'
+
+TOMADO = 'tomado'
+PERDIDO = 'perdido'
+NO_EXISTE = 'no_existe'
+
+
+# --- Reclamo manual ---
+
+SQL_RECLAMAR = """
+    UPDATE Chat
+    SET id_agente = %(id_agente)s, estado = 'Activo', fecha_asignacion = NOW()
+    WHERE id_chat = (
+        SELECT id_chat FROM Chat
+        WHERE id_chat = %(id_chat)s AND estado = 'Esperando'
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id_chat
+"""
+
+# El más antiguo de la cola (índice parcial idx_chat_esperando)
+SQL_RECLAMAR_SIGUIENTE = """
+    UPDATE Chat
+    SET id_agente = %(id_agente)s, estado = 'Activo', fecha_asignacion = NOW()
+    WHERE id_chat = (
+        SELECT id_chat FROM Chat
+        WHERE estado = 'Esperando'
+        ORDER BY fecha_inicio, id_chat
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id_chat
+"""
+
+
+def reclamar_chat(cursor, id_chat, id_agente):
+    """TOMADO, PERDIDO (otro agente lo tiene o lo está tomando) o NO_EXISTE. No hace commit."""
+    cursor.execute(SQL_RECLAMAR, {'id_chat': id_chat, 'id_agente': id_agente})
+    if cursor.fetchone():
+        notificar_chat(cursor, id_chat, 'estado', estado='Activo')
+        return TOMADO
+    cursor.execute("SELECT 1 FROM Chat WHERE id_chat = %s", (id_chat,))
+    return PERDIDO if cursor.fetchone() else NO_EXISTE
+
+
+def reclamar_siguiente(cursor, id_agente):
+    """id_chat del chat más antiguo en espera, ya asignado al agente, o None si la cola está vacía"""
+    cursor.execute(SQL_RECLAMAR_SIGUIENTE, {'id_agente': id_agente})
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    notificar_chat(cursor, fila[0], 'estado', estado='Activo')
+    return fila[0]
+
+
+# --- Disponibilidad de agentes ---
+
+SQL_DISPONIBILIDAD = """
+    INSERT INTO Agente_Disponibilidad (id_agente, disponible, ultimo_latido)
+    VALUES (%s, %s, NOW())
+    ON CONFLICT (id_agente) DO UPDATE
+    SET disponible = EXCLUDED.disponible, ultimo_latido = NOW()
+"""
+
+SQL_LATIDO = "UPDATE Agente_Disponibilidad SET ultimo_latido = NOW() WHERE id_agente = %s"
+
+
+def marcar_disponible(cursor, id_agente, disponible):
+    cursor.execute(SQL_DISPONIBILIDAD, (id_agente, bool(disponible)))
+    # Un agente nuevo disponible puede recibir lo que ya estaba esperando
+    notificar_cola(cursor, 'disponible', id_agente=id_agente, disponible=bool(disponible))
+
+
+def registrar_latido(cursor, id_agente):
+    cursor.execute(SQL_LATIDO, (id_agente,))
+
+
+def sse_cola(eventos, id_agente=None):
+    """Eventos SSE para el panel a partir de una ráfaga de avisos de la cola.
+
+    'cola' (una sola vez por ráfaga): la lista de espera cambió, hay que recargarla.
+    'asignado': el despachador le dio un chat a este agente.
+    """
+    salida = []
+    if any(ev.get('tipo') in ('cola', 'resync') for ev in eventos):
+        salida.append(evento_sse('cola', {"recargar": True}))
+    for ev in eventos:
+        if ev.get('tipo') == 'asignado' and id_agente is not None and ev.get('id_agente') == id_agente:
+            salida.append(evento_sse('asignado', {"id_chat": ev.get('chat')}))
+    return salida
+
+
+# --- Asignación automática ---
+
+SQL_ESPERANDO = """
+    SELECT id_chat FROM Chat
+    WHERE estado = 'Esperando'
+    ORDER BY fecha_inicio, id_chat
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Carga = chats activos del agente, como en obtener_chats_agente
+SQL_CARGA_AGENTES = """
+    SELECT d.id_agente, COUNT(c.id_chat) AS carga, MAX(c.fecha_asignacion) AS ultima_asignacion
+    FROM Agente_Disponibilidad d
+    LEFT JOIN Chat c ON c.id_agente = d.id_agente AND c.estado = 'Activo'
+    WHERE d.disponible AND d.ultimo_latido > NOW() - make_interval(secs => %s)
+    GROUP BY d.id_agente
+"""
+
+SQL_ASIGNAR = """
+    UPDATE Chat c
+    SET id_agente = v.id_agente, estado = 'Activo', fecha_asignacion = NOW()
+    FROM (VALUES %s) AS v (id_chat, id_agente)
+    WHERE c.id_chat = v.id_chat
+"""
+
+
+def repartir(chats, agentes, maximo=MAX_CHATS_POR_AGENTE):
+    """[(id_chat, id_agente)]: cada chat al agente con menos carga; empate, el que lleva más sin recibir uno"""
+    monticulo = [
+        (carga, ultima or datetime.min, id_agente)
+        for id_agente, carga, ultima in agentes
+        if carga < maximo
+    ]
+    heapq.heapify(monticulo)
+    asignaciones = []
+    for id_chat in chats:
+        if not monticulo:
+            break
+        carga, _, id_agente = heapq.heappop(monticulo)
+        asignaciones.append((id_chat, id_agente))
+        if carga + 1 < maximo:
+            heapq.heappush(monticulo, (carga + 1, datetime.max, id_agente))
+    return asignaciones
+
+
+def despachar(conn, maximo=MAX_CHATS_POR_AGENTE, latido_max=LATIDO_MAX):
+    """Una ronda de asignación automática. Devuelve las asignaciones o None si otro worker está despachando."""
+    cursor = conn.cursor()
+    try:
+        # Uno a la vez: dos rondas simultáneas verían la misma carga y sobreasignarían
+        cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (LLAVE_ADVISORY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+
+        cursor.execute(SQL_ESPERANDO, (LOTE_DESPACHO,))
+        chats = [fila[0] for fila in cursor.fetchall()]
+        asignaciones = []
+        if chats:
+            cursor.execute(SQL_CARGA_AGENTES, (latido_max,))
+            asignaciones = repartir(chats, cursor.fetchall(), maximo)
+        if asignaciones:
+            execute_values(cursor, SQL_ASIGNAR, asignaciones)
+            for id_chat, id_agente in asignaciones:
+                notificar_chat(cursor, id_chat, 'estado', estado='Activo')
+                notificar_cola(cursor, 'asignado', chat=id_chat, id_agente=id_agente)
+        conn.commit()
+        return asignaciones
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# --- Hilo despachador (uno por worker, uno a la vez) ---
+
+_hilo = None
+_hilo_pid = None
+_lock = threading.Lock()
+
+
+def _esperar_aviso(cola):
+    """Bloquea hasta el próximo aviso de la cola (o INTERVALO_DESPACHO) y descarta los acumulados"""
+    try:
+        cola.get(timeout=INTERVALO_DESPACHO)
+    except queue.Empty:
+        return
+    while True:
+        try:
+            cola.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _ciclo_despachador():
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("ERROR: Falta DATABASE_URL (despacho_chats)")
+        return
+    cola = suscribir(COLA_CHATS)
+    conn = None
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(database_url)
+                asignaciones = despachar(conn)
+                if asignaciones:
+                    print(f"🎯 Chats asignados automáticamente: {asignaciones}")
+            except Exception as e:
+                print(f"Error despachando chats: {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(2)
+            _esperar_aviso(cola)
+    finally:
+        desuscribir(COLA_CHATS, cola)
+
+
+def asegurar_despachador():
+    """Arranca el hilo de asignación automática si CHAT_AUTOASIGNAR está activo"""
+    global _hilo, _hilo_pid
+    if not AUTOASIGNAR:
+        return
+    with _lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_ciclo_despachador, name="chats-despacho", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
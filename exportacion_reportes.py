@@ -0,0 +1,168 @@
+"""
+Exportación masiva de reportes de auditoría (ZIP o un solo PDF combinado).
+Los PDF que faltan se renderizan en la cola de trabajos (cola_trabajos.py), la
+misma que usa el visor, así que un PDF ya pedido ahí no se vuelve a generar;
+quedan en el caché de disco y el ZIP se arma leyendo esos archivos por
+bloques, de modo que en memoria nunca hay más que un bloque del ZIP a la vez.
+"""
+import os
+import tempfile
+import time
+import zipfile
+
+import cache_reportes
+import cola_trabajos
+
+# Renders que una exportación mantiene en la cola a la vez: no acapara la cola
+# frente al visor y, si el cliente se va, deja a lo más estos trabajos atrás
+EXPORT_EN_COLA = int(os.environ.get('EXPORT_EN_COLA', 4))
+# El PDF combinado se arma completo en memoria (ver exportar_pdf_combinado)
+EXPORT_PDF_MAX = int(os.environ.get('EXPORT_PDF_MAX', 200))
+TAMANO_BLOQUE = 64 * 1024
+
+
+def nombre_archivo(auditoria):
+    fecha = str(auditoria.get('fecha_auditoria') or '')[:10] or 'sin_fecha'
+    return f"auditoria_{auditoria['id_auditoria']}_{fecha}.pdf"
+
+
+def _resultado_trabajo(auditoria, trabajo):
+    if trabajo is None:
+        return auditoria, None, "El trabajo de render desapareció de la cola"
+    if trabajo['estado'] == 'error':
+        return auditoria, None, trabajo.get('error') or "Error al generar el PDF"
+    if not os.path.exists(trabajo.get('resultado') or ''):
+        return auditoria, None, "El PDF ya no está en el caché"
+    return auditoria, trabajo['resultado'], None
+
+
+def pdfs_de_auditorias(auditorias, en_orden=False):
+    """Genera (auditoria, ruta, error) conforme cada PDF está listo.
+
+    Los que ya están en caché salen de inmediato; el resto se encola en
+    cola_trabajos, a lo más EXPORT_EN_COLA a la vez, y se sondea su estado en
+    una sola consulta. Con en_orden=True se respeta el orden de `auditorias`
+    (PDF combinado).
+    """
+    listos = {}       # indice -> (auditoria, ruta, error)
+    en_cola = {}      # indice -> id del trabajo
+    siguiente = 0     # próxima auditoría por revisar
+    entregados = 0
+    intervalo = 0.1
+
+    while entregados < len(auditorias):
+        while siguiente < len(auditorias) and len(en_cola) < EXPORT_EN_COLA:
+            auditoria = auditorias[siguiente]
+            ruta, _ = cache_reportes.buscar_en_cache(auditoria, auditoria['id_auditoria'])
+            if ruta:
+                listos[siguiente] = (auditoria, ruta, None)
+            else:
+                try:
+                    trabajo = cola_trabajos.encolar_pdf_auditoria(auditoria, auditoria['id_auditoria'])
+                except Exception as e:
+                    listos[siguiente] = (auditoria, None, str(e))
+                else:
+                    if trabajo['estado'] in cola_trabajos.ESTADOS_ACTIVOS:
+                        en_cola[siguiente] = trabajo['id']
+                    else:
+                        listos[siguiente] = _resultado_trabajo(auditoria, trabajo)
+            siguiente += 1
+
+        if en_orden:
+            por_entregar = []
+            while entregados + len(por_entregar) in listos:
+                por_entregar.append(listos.pop(entregados + len(por_entregar)))
+        else:
+            por_entregar = [listos.pop(indice) for indice in sorted(listos)]
+        for resultado in por_entregar:
+            entregados += 1
+            yield resultado
+        if por_entregar or not en_cola:
+            intervalo = 0.1
+            continue
+
+        # Nada listo todavía: esperar sin CPU y consultar todos los trabajos de una vez
+        time.sleep(intervalo)
+        intervalo = min(intervalo * 1.5, 1.0)
+        trabajos = cola_trabajos.obtener_trabajos(en_cola.values())
+        for indice, id_trabajo in list(en_cola.items()):
+            trabajo = trabajos.get(id_trabajo)
+            if trabajo is None or trabajo['estado'] not in cola_trabajos.ESTADOS_ACTIVOS:
+                listos[indice] = _resultado_trabajo(auditorias[indice], trabajo)
+                del en_cola[indice]
+
+
+class _SalidaStream:
+    """Archivo de solo escritura sin seek: zipfile escribe aquí y nosotros vaciamos"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def exportar_zip(auditorias):
+    """Generador de bytes de un ZIP con un PDF por auditoría (en orden de terminación)"""
+    salida = _SalidaStream()
+    errores = []
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archivo_zip:
+        for auditoria, ruta, error in pdfs_de_auditorias(auditorias):
+            if error or not ruta:
+                errores.append(f"#{auditoria['id_auditoria']}: {error or 'sin PDF'}")
+                continue
+            with open(ruta, 'rb') as origen, archivo_zip.open(nombre_archivo(auditoria), 'w') as destino:
+                while True:
+                    bloque = origen.read(TAMANO_BLOQUE)
+                    if not bloque:
+                        break
+                    destino.write(bloque)
+                    datos = salida.vaciar()
+                    if datos:
+                        yield datos
+            datos = salida.vaciar()
+            if datos:
+                yield datos
+        if errores:
+            archivo_zip.writestr("ERRORES.txt", "\n".join(errores) + "\n")
+    yield salida.vaciar()
+
+
+def exportar_pdf_combinado(auditorias):
+    """Generador de bytes de un solo PDF con todas las auditorías en orden cronológico.
+
+    A diferencia del ZIP, esto no se transmite mientras se renderiza: pypdf
+    mantiene en memoria todas las páginas de todos los PDF agregados, y la
+    tabla de referencias va al final, así que no se envía nada hasta que el
+    combinado está escrito completo en un temporal. Por eso se limita a
+    EXPORT_PDF_MAX auditorías (lo revisa la ruta); para periodos grandes, ZIP.
+    """
+    from pypdf import PdfWriter
+
+    escritor = PdfWriter()
+    for auditoria, ruta, error in pdfs_de_auditorias(auditorias, en_orden=True):
+        if error or not ruta:
+            print(f"Error exportando auditoría {auditoria['id_auditoria']}: {error}")
+            continue
+        escritor.append(ruta, outline_item=f"Auditoría #{auditoria['id_auditoria']}")
+
+    os.makedirs(cache_reportes.DIRECTORIO, exist_ok=True)
+    with tempfile.TemporaryFile(dir=cache_reportes.DIRECTORIO) as temporal:
+        escritor.write(temporal)
+        escritor.close()
+        temporal.seek(0)
+        while True:
+            bloque = temporal.read(TAMANO_BLOQUE)
+            if not bloque:
+                break
+            yield bloque
+
@@ -0,0 +1,318 @@
+"""
+Instrumentación de SQL por petición.
+Las conexiones del pool se crean con ConexionInstrumentada, así que todo
+cursor que sale de conexion_db() (funciones de db_config y consultas en línea
+de app.py por igual) mide cada execute/executemany sin tocar el código que lo
+usa. Por petición se acumulan número de consultas, tiempo en BD y tiempo
+esperando conexión (cabecera Server-Timing); las consultas que pasan de
+SQL_LENTA_MS se registran con su huella normalizada, y /metrics expone los
+contadores del worker en formato de texto de Prometheus.
+
+Los contadores viven en memoria de cada worker de gunicorn: Prometheus debe
+raspar cada proceso (o sumar por instancia) para ver el total.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+
+from psycopg2 import extensions
+
+# Consultas más lentas que esto (ms) se registran en la bitácora
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', 200))
+# Consultas lentas recientes que se guardan para /api/admin/consultas-lentas
+MAX_LENTAS_RECIENTES = 200
+# Huellas distintas con contadores propios; el resto se acumula en "otras"
+MAX_HUELLAS = int(os.environ.get('SQL_MAX_HUELLAS', 500))
+# Cubetas (segundos) del histograma de duración de consultas
+CUBETAS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+# --- Huellas de SQL ---
+
+_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_CADENAS = re.compile(r"'(?:[^']|'')*'")
+_PARAMETROS = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_NUMEROS = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TUPLAS_REPETIDAS = re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+")
+_ESPACIOS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def _huella_texto(sql):
+    texto = _COMENTARIOS.sub(" ", sql)
+    texto = _CADENAS.sub("?", texto)
+    texto = _PARAMETROS.sub("?", texto)
+    texto = _NUMEROS.sub("?", texto)
+    texto = _LISTAS.sub("(?+)", texto)
+    texto = _TUPLAS_REPETIDAS.sub("(?+), ...", texto)
+    normalizado = _ESPACIOS.sub(" ", texto).strip().lower()
+    return hashlib.sha1(normalizado.encode('utf-8')).hexdigest()[:12], normalizado
+
+
+def huella(sql):
+    """(id, sql normalizado): literales y parámetros como ?, listas colapsadas, sin comentarios"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    return _huella_texto(sql)
+
+
+# --- Medición por petición ---
+
+class MedicionPeticion:
+    __slots__ = ('ruta', 'inicio', 'consultas', 'tiempo_bd', 'conexiones', 'tiempo_conexion', 'errores')
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tiempo_bd = 0.0
+        self.conexiones = 0
+        self.tiempo_conexion = 0.0
+        self.errores = 0
+
+    def server_timing(self):
+        """Valor de la cabecera Server-Timing (milisegundos)"""
+        total = (time.perf_counter() - self.inicio) * 1000
+        return (
+            f'db;dur={self.tiempo_bd * 1000:.1f};desc="{self.consultas} consultas", '
+            f'conexion;dur={self.tiempo_conexion * 1000:.1f}, '
+            f'total;dur={total:.1f}'
+        )
+
+
+_peticion = ContextVar('medicion_sql', default=None)
+
+
+def iniciar_peticion(ruta):
+    medicion = MedicionPeticion(ruta)
+    _peticion.set(medicion)
+    return medicion
+
+
+def peticion_actual():
+    return _peticion.get()
+
+
+def terminar_peticion(metodo, estado):
+    """Cierra la medición de la petición en curso y la suma a los contadores del worker"""
+    medicion = _peticion.get()
+    if medicion is None:
+        return None
+    _peticion.set(None)
+    duracion = time.perf_counter() - medicion.inicio
+    clave = (medicion.ruta, metodo, str(estado))
+    with _lock:
+        _peticiones[clave] = _peticiones.get(clave, 0) + 1
+        acumulado = _por_ruta.setdefault(medicion.ruta, [0, 0.0, 0.0, 0.0])
+        acumulado[0] += medicion.consultas
+        acumulado[1] += medicion.tiempo_bd
+        acumulado[2] += medicion.tiempo_conexion
+        acumulado[3] += duracion
+    return medicion
+
+
+# --- Contadores del worker ---
+
+_lock = threading.Lock()
+_peticiones = {}          # (ruta, metodo, estado) -> peticiones
+_por_ruta = {}            # ruta -> [consultas, segundos BD, segundos conexión, segundos petición]
+_por_huella = {}          # id -> [sql normalizado, consultas, segundos, lentas, errores]
+_cubetas = [0] * (len(CUBETAS_SEGUNDOS) + 1)
+_totales = {"consultas": 0, "segundos": 0.0, "errores": 0}
+_lentas = deque(maxlen=MAX_LENTAS_RECIENTES)
+
+
+def registrar_conexion(duracion):
+    """Tiempo esperando una conexión del pool (llamado por conexion_db)"""
+    medicion = _peticion.get()
+    if medicion is not None:
+        medicion.conexiones += 1
+        medicion.tiempo_conexion += duracion
+
+
+def registrar_consulta(sql, duracion, error=False):
+    medicion = _peticion.get()
+    if medicion is not None:
+        medicion.consultas += 1
+        medicion.tiempo_bd += duracion
+        if error:
+            medicion.errores += 1
+
+    id_huella, normalizado = huella(sql)
+    lenta = duracion * 1000 >= SQL_LENTA_MS
+    indice = len(CUBETAS_SEGUNDOS)
+    for i, limite in enumerate(CUBETAS_SEGUNDOS):
+        if duracion <= limite:
+            indice = i
+            break
+
+    with _lock:
+        _totales["consultas"] += 1
+        _totales["segundos"] += duracion
+        _cubetas[indice] += 1
+        if error:
+            _totales["errores"] += 1
+        datos = _por_huella.get(id_huella)
+        if datos is None:
+            if len(_por_huella) >= MAX_HUELLAS:
+                id_huella, normalizado = 'otras', '(huellas por encima de SQL_MAX_HUELLAS)'
+                datos = _por_huella.get(id_huella)
+            if datos is None:
+                datos = _por_huella[id_huella] = [normalizado, 0, 0.0, 0, 0]
+        datos[1] += 1
+        datos[2] += duracion
+        if lenta:
+            datos[3] += 1
+        if error:
+            datos[4] += 1
+        if lenta:
+            _lentas.append({
+                "huella": id_huella,
+                "sql": normalizado,
+                "ms": round(duracion * 1000, 1),
+                "ruta": medicion.ruta if medicion else None,
+                "fecha": time.time(),
+            })
+
+    if lenta:
+        ruta = medicion.ruta if medicion else '-'
+        print(f"🐢 SQL lenta {duracion * 1000:.0f} ms [{id_huella}] {ruta}: {normalizado[:300]}")
+
+
+def consultas_lentas():
+    with _lock:
+        return list(reversed(_lentas))
+
+
+# --- Cursores y conexiones instrumentados ---
+
+class _CursorInstrumentado:
+    """Mixin que mide execute/executemany/callproc de la clase de cursor base"""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().execute(query, vars)
+        except Exception:
+            registrar_consulta(query, time.perf_counter() - inicio, error=True)
+            raise
+        registrar_consulta(query, time.perf_counter() - inicio)
+        return resultado
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().executemany(query, vars_list)
+        except Exception:
+            registrar_consulta(query, time.perf_counter() - inicio, error=True)
+            raise
+        registrar_consulta(query, time.perf_counter() - inicio)
+        return resultado
+
+    def callproc(self, procname, parameters=None):
+        inicio = time.perf_counter()
+        try:
+            resultado = super().callproc(procname, parameters)
+        except Exception:
+            registrar_consulta(f"CALL {procname}", time.perf_counter() - inicio, error=True)
+            raise
+        registrar_consulta(f"CALL {procname}", time.perf_counter() - inicio)
+        return resultado
+
+
+@lru_cache(maxsize=None)
+def cursor_instrumentado(clase):
+    """Subclase instrumentada de una clase de cursor (RealDictCursor, el cursor base, ...)"""
+    if issubclass(clase, _CursorInstrumentado):
+        return clase
+    return type(f"{clase.__name__}Instrumentado", (_CursorInstrumentado, clase), {})
+
+
+class ConexionInstrumentada(extensions.connection):
+    """Conexión cuyos cursores (de cualquier cursor_factory) se miden"""
+
+    def cursor(self, *args, **kwargs):
+        clase = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = cursor_instrumentado(clase)
+        return super().cursor(*args, **kwargs)
+
+
+# --- Exposición en formato Prometheus ---
+
+def _etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def exportar_prometheus(extras=None):
+    """Texto de exposición de Prometheus con los contadores de este worker.
+
+    `extras` es un dict {nombre: (tipo, ayuda, [(etiquetas, valor)])} con
+    métricas de otros módulos (p. ej. el estado del pool).
+    """
+    with _lock:
+        peticiones = dict(_peticiones)
+        por_ruta = {ruta: list(v) for ruta, v in _por_ruta.items()}
+        por_huella = {h: list(v) for h, v in _por_huella.items()}
+        cubetas = list(_cubetas)
+        totales = dict(_totales)
+
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for etiquetas, valor in muestras:
+            if etiquetas:
+                texto = ",".join(f'{k}="{_etiqueta(v)}"' for k, v in etiquetas.items())
+                lineas.append(f"{nombre}{{{texto}}} {valor}")
+            else:
+                lineas.append(f"{nombre} {valor}")
+
+    metrica("casino_http_peticiones_total", "counter", "Peticiones atendidas por ruta, método y estado",
+            [({"ruta": r, "metodo": m, "estado": e}, n) for (r, m, e), n in sorted(peticiones.items())])
+    metrica("casino_http_segundos_total", "counter", "Tiempo total atendiendo peticiones por ruta",
+            [({"ruta": r}, f"{v[3]:.6f}") for r, v in sorted(por_ruta.items())])
+    metrica("casino_sql_consultas_por_ruta_total", "counter", "Consultas SQL emitidas por ruta",
+            [({"ruta": r}, v[0]) for r, v in sorted(por_ruta.items())])
+    metrica("casino_sql_segundos_por_ruta_total", "counter", "Tiempo en la base de datos por ruta",
+            [({"ruta": r}, f"{v[1]:.6f}") for r, v in sorted(por_ruta.items())])
+    metrica("casino_sql_conexion_segundos_total", "counter", "Tiempo esperando conexión del pool por ruta",
+            [({"ruta": r}, f"{v[2]:.6f}") for r, v in sorted(por_ruta.items())])
+
+    acumulado = 0
+    muestras = []
+    for limite, n in zip(CUBETAS_SEGUNDOS, cubetas):
+        acumulado += n
+        muestras.append(({"le": limite}, acumulado))
+    acumulado += cubetas[-1]
+    muestras.append(({"le": "+Inf"}, acumulado))
+    lineas.append("# HELP casino_sql_duracion_segundos Duración de cada consulta SQL")
+    lineas.append("# TYPE casino_sql_duracion_segundos histogram")
+    for etiquetas, valor in muestras:
+        lineas.append(f'casino_sql_duracion_segundos_bucket{{le="{etiquetas["le"]}"}} {valor}')
+    lineas.append(f"casino_sql_duracion_segundos_sum {totales['segundos']:.6f}")
+    lineas.append(f"casino_sql_duracion_segundos_count {totales['consultas']}")
+
+    metrica("casino_sql_errores_total", "counter", "Consultas SQL que lanzaron excepción",
+            [(None, totales["errores"])])
+    metrica("casino_sql_huella_consultas_total", "counter", "Consultas por huella de SQL normalizado",
+            [({"huella": h}, v[1]) for h, v in sorted(por_huella.items())])
+    metrica("casino_sql_huella_segundos_total", "counter", "Tiempo en la base de datos por huella",
+            [({"huella": h}, f"{v[2]:.6f}") for h, v in sorted(por_huella.items())])
+    metrica("casino_sql_huella_lentas_total", "counter", f"Consultas por encima de {SQL_LENTA_MS:g} ms por huella",
+            [({"huella": h}, v[3]) for h, v in sorted(por_huella.items()) if v[3]])
+    metrica("casino_sql_huella_info", "gauge", "SQL normalizado de cada huella",
+            [({"huella": h, "sql": v[0][:200]}, 1) for h, v in sorted(por_huella.items())])
+
+    for nombre, (tipo, ayuda, muestras) in (extras or {}).items():
+        metrica(nombre, tipo, ayuda, muestras)
+
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,245 @@
+"""
+Métricas del panel de administrador materializadas (migración 009).
+Los totales de usuarios, depósitos y retiros viven en Metrica_Contador y la
+serie por hora en Metrica_Hora; los mantienen triggers sobre Usuario y
+Transaccion, así que leerlos no depende del tamaño del libro. Un hilo por
+worker reconcilia periódicamente contra las tablas fuente (solo un worker a
+la vez, coordinado con un advisory lock) y deja la diferencia en una bitácora.
+"""
+import json
+import os
+import threading
+import time
+
+import psycopg2
+
+# Segundos entre reconciliaciones completas
+INTERVALO_RECONCILIACION = float(os.environ.get('METRICAS_RECONCILIAR_SEG', 6 * 3600))
+# Horas hacia atrás de la serie que se recalculan en cada reconciliación
+HORAS_SERIE_RECONCILIAR = int(os.environ.get('METRICAS_RECONCILIAR_HORAS', 48))
+LLAVE_ADVISORY = 'metricas_admin'
+
+CONTADORES = (
+    'usuarios_total',
+    'usuarios_activos',
+    'depositos_monto',
+    'depositos_conteo',
+    'retiros_monto',
+    'retiros_conteo',
+)
+
+SERIES = ('depositos', 'retiros', 'usuarios_nuevos')
+
+GRANULARIDADES = {
+    'hora': 'hour',
+    'dia': 'day',
+}
+
+SQL_TOTALES = """
+    SELECT clave, SUM(valor) AS valor
+    FROM Metrica_Contador
+    WHERE clave = ANY(%s)
+    GROUP BY clave
+"""
+
+SQL_SERIE = """
+    SELECT date_trunc(%(unidad)s, hora) AS cubeta, SUM(valor) AS valor, SUM(conteo) AS conteo
+    FROM Metrica_Hora
+    WHERE clave = %(clave)s AND hora >= %(desde)s AND hora < %(hasta)s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+# Totales reales, calculados desde las tablas fuente
+SQL_TOTALES_REALES = """
+    SELECT 'usuarios_total' AS clave, COUNT(*)::numeric AS valor FROM Usuario
+    UNION ALL
+    SELECT 'usuarios_activos', COUNT(*) FILTER (WHERE activo) FROM Usuario
+    UNION ALL
+    SELECT CASE tipo_transaccion WHEN 'Depósito' THEN 'depositos' ELSE 'retiros' END || s.sufijo,
+           CASE s.sufijo WHEN '_monto' THEN COALESCE(SUM(monto), 0) ELSE COUNT(*) END
+    FROM Transaccion
+    CROSS JOIN (VALUES ('_monto'), ('_conteo')) AS s (sufijo)
+    WHERE estado = 'Completada' AND tipo_transaccion IN ('Depósito', 'Retiro')
+    GROUP BY tipo_transaccion, s.sufijo
+"""
+
+SQL_SERIE_REAL = """
+    SELECT CASE tipo_transaccion WHEN 'Depósito' THEN 'depositos' ELSE 'retiros' END,
+           date_trunc('hour', fecha_transaccion), SUM(monto), COUNT(*)
+    FROM Transaccion
+    WHERE estado = 'Completada' AND tipo_transaccion IN ('Depósito', 'Retiro')
+      AND fecha_transaccion >= %(desde)s
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT 'usuarios_nuevos', date_trunc('hour', fecha_registro), COUNT(*), COUNT(*)
+    FROM Usuario
+    WHERE fecha_registro >= %(desde)s
+    GROUP BY 2
+"""
+
+SQL_SERIE_MATERIALIZADA = """
+    SELECT clave, hora, SUM(valor), SUM(conteo)
+    FROM Metrica_Hora
+    WHERE clave = ANY(%(series)s) AND hora >= %(desde)s
+    GROUP BY clave, hora
+"""
+
+# Las correcciones se suman como un delta más, igual que los triggers
+SQL_AJUSTAR_CONTADOR = """
+    INSERT INTO Metrica_Contador (clave, fragmento, valor) VALUES (%s, 0, %s)
+    ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Metrica_Contador.valor + EXCLUDED.valor
+"""
+
+SQL_AJUSTAR_HORA = """
+    INSERT INTO Metrica_Hora (clave, hora, fragmento, valor, conteo) VALUES (%s, %s, 0, %s, %s)
+    ON CONFLICT (clave, hora, fragmento) DO UPDATE
+    SET valor = Metrica_Hora.valor + EXCLUDED.valor, conteo = Metrica_Hora.conteo + EXCLUDED.conteo
+"""
+
+
+def leer_totales(cursor):
+    """Totales actuales: suma de los fragmentos de cada contador (lecturas por PK)"""
+    cursor.execute(SQL_TOTALES, (list(CONTADORES),))
+    totales = {clave: 0 for clave in CONTADORES}
+    for clave, valor in cursor.fetchall():
+        totales[clave] = valor
+    return totales
+
+
+def leer_serie(cursor, clave, desde, hasta, granularidad='hora'):
+    """[(cubeta, valor, conteo)] de una serie por hora o por día"""
+    cursor.execute(SQL_SERIE, {
+        "unidad": GRANULARIDADES[granularidad],
+        "clave": clave,
+        "desde": desde,
+        "hasta": hasta,
+    })
+    return cursor.fetchall()
+
+
+def reconciliar(conn, horas=HORAS_SERIE_RECONCILIAR):
+    """Corrige los contadores (y la serie de las últimas `horas`; None = toda) contra los valores reales.
+
+    Los recorridos de Transaccion y Usuario y la lectura de lo materializado
+    se hacen en UNA foto REPEATABLE READ y sin locks: como los triggers
+    escriben en la misma transacción que la fuente, en esa foto ambos lados
+    deberían coincidir y su diferencia es el desvío. Después solo se suma ese
+    delta, como un incremento más, así que los depósitos y registros
+    concurrentes nunca esperan al recorrido.
+    Devuelve las diferencias encontradas {clave: real - materializado}.
+    """
+    cursor = conn.cursor()
+    try:
+        # --- Fase 1: lectura consistente, sin bloquear a nadie ---
+        conn.rollback()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+
+        actuales = leer_totales(cursor)
+        cursor.execute(SQL_TOTALES_REALES)
+        reales = {clave: 0 for clave in CONTADORES}
+        for clave, valor in cursor.fetchall():
+            reales[clave] = valor
+
+        if horas is None:
+            desde = '-infinity'
+        else:
+            cursor.execute("SELECT date_trunc('hour', NOW() - make_interval(hours => %s))", (horas,))
+            desde = cursor.fetchone()[0]
+        cursor.execute(SQL_SERIE_REAL, {"desde": desde})
+        serie = {(clave, hora): (valor, conteo) for clave, hora, valor, conteo in cursor.fetchall()}
+        cursor.execute(SQL_SERIE_MATERIALIZADA, {"series": list(SERIES), "desde": desde})
+        for clave, hora, valor, conteo in cursor.fetchall():
+            real_valor, real_conteo = serie.get((clave, hora), (0, 0))
+            serie[(clave, hora)] = (real_valor - valor, real_conteo - conteo)
+        conn.rollback()
+
+        # Lo que no estaba materializado se queda con el valor real completo como delta
+        ajustes_serie = [
+            (clave, hora, valor, conteo)
+            for (clave, hora), (valor, conteo) in serie.items()
+            if valor or conteo
+        ]
+        diferencias = {
+            clave: float(reales[clave] - actuales[clave])
+            for clave in CONTADORES if reales[clave] != actuales[clave]
+        }
+
+        # --- Fase 2: sumar el desvío (solo locks de renglón, unos milisegundos) ---
+        if diferencias:
+            cursor.executemany(SQL_AJUSTAR_CONTADOR, [
+                (clave, reales[clave] - actuales[clave]) for clave in diferencias
+            ])
+        if ajustes_serie:
+            cursor.executemany(SQL_AJUSTAR_HORA, ajustes_serie)
+        cursor.execute(
+            "INSERT INTO Metrica_Reconciliacion (diferencias) VALUES (%s)",
+            (json.dumps(diferencias),)
+        )
+        conn.commit()
+        return diferencias
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# --- Reconciliación periódica (un hilo por worker, un worker a la vez) ---
+
+_hilo = None
+_hilo_pid = None
+_lock = threading.Lock()
+
+
+def reconciliar_ahora(horas=HORAS_SERIE_RECONCILIAR, forzar=True):
+    """Reconcilia con una conexión propia si nadie más lo está haciendo.
+
+    Con forzar=False solo lo hace si la última reconciliación es más vieja que
+    INTERVALO_RECONCILIACION. Devuelve las diferencias o None si no tocó.
+    """
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        return None
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        # De sesión: reconciliar() usa varias transacciones; se libera al cerrar la conexión
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (LLAVE_ADVISORY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+        if not forzar:
+            cursor.execute(
+                "SELECT COALESCE(MAX(fecha) < NOW() - make_interval(secs => %s), true) FROM Metrica_Reconciliacion",
+                (INTERVALO_RECONCILIACION,)
+            )
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return None
+        conn.commit()
+        return reconciliar(conn, horas)
+    finally:
+        conn.close()
+
+
+def _ciclo_reconciliacion():
+    while True:
+        try:
+            diferencias = reconciliar_ahora(forzar=False)
+            if diferencias:
+                print(f"Métricas de admin reconciliadas, diferencias: {diferencias}")
+        except Exception as e:
+            print(f"Error reconciliando métricas: {e}")
+        # Revisar varias veces por intervalo: otro worker pudo haberlo hecho ya
+        time.sleep(max(60.0, INTERVALO_RECONCILIACION / 6))
+
+
+def asegurar_reconciliador():
+    global _hilo, _hilo_pid
+    with _lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_ciclo_reconciliacion, name="metricas-reconciliar", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
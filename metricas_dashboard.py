@@ -0,0 +1,131 @@
+"""
+Métricas del dashboard del agente de soporte.
+Todos los contadores salen de UNA consulta agregada (COUNT ... FILTER) y los
+contadores globales (tickets pendientes, chats en espera) se comparten entre
+agentes con un caché TTL por worker que se invalida al asignar/cerrar tickets
+y tomar/cerrar chats.
+"""
+import os
+import threading
+import time
+
+# Segundos que los contadores globales se sirven desde memoria
+TTL_GLOBALES = float(os.environ.get('DASHBOARD_TTL', 10))
+
+METRICAS_VACIAS = {
+    'tickets_pendientes': 0,
+    'mis_tickets': 0,
+    'chats_esperando': 0,
+    'mis_chats': 0,
+    'cerrados_hoy': 0
+}
+
+# Contadores globales + contadores del agente en un solo viaje a la BD
+SQL_COMPLETO = """
+    SELECT t.tickets_pendientes, t.mis_tickets, t.tickets_cerrados_hoy,
+           c.chats_esperando, c.mis_chats, c.chats_cerrados_hoy
+    FROM (
+        SELECT COUNT(*) FILTER (WHERE id_agente IS NULL AND estado = 'Abierto') AS tickets_pendientes,
+               COUNT(*) FILTER (WHERE id_agente = %(id_agente)s AND estado != 'Cerrado') AS mis_tickets,
+               COUNT(*) FILTER (WHERE id_agente = %(id_agente)s AND estado = 'Cerrado'
+                                  AND fecha_cierre >= CURRENT_DATE) AS tickets_cerrados_hoy
+        FROM Soporte
+        WHERE id_agente = %(id_agente)s OR (id_agente IS NULL AND estado = 'Abierto')
+    ) t, (
+        SELECT COUNT(*) FILTER (WHERE estado = 'Esperando') AS chats_esperando,
+               COUNT(*) FILTER (WHERE id_agente = %(id_agente)s AND estado = 'Activo') AS mis_chats,
+               COUNT(*) FILTER (WHERE id_agente = %(id_agente)s AND estado = 'Cerrado'
+                                  AND fecha_cierre >= CURRENT_DATE) AS chats_cerrados_hoy
+        FROM Chat
+        WHERE id_agente = %(id_agente)s OR estado = 'Esperando'
+    ) c
+"""
+
+# Solo los contadores del agente (cuando los globales están en caché)
+SQL_AGENTE = """
+    SELECT t.mis_tickets, t.tickets_cerrados_hoy, c.mis_chats, c.chats_cerrados_hoy
+    FROM (
+        SELECT COUNT(*) FILTER (WHERE estado != 'Cerrado') AS mis_tickets,
+               COUNT(*) FILTER (WHERE estado = 'Cerrado' AND fecha_cierre >= CURRENT_DATE) AS tickets_cerrados_hoy
+        FROM Soporte
+        WHERE id_agente = %(id_agente)s
+    ) t, (
+        SELECT COUNT(*) FILTER (WHERE estado = 'Activo') AS mis_chats,
+               COUNT(*) FILTER (WHERE estado = 'Cerrado' AND fecha_cierre >= CURRENT_DATE) AS chats_cerrados_hoy
+        FROM Chat
+        WHERE id_agente = %(id_agente)s
+    ) c
+"""
+
+_globales = None
+_globales_expira = 0.0
+_lock = threading.Lock()
+
+
+def _leer_globales():
+    with _lock:
+        if _globales is not None and time.monotonic() < _globales_expira:
+            return dict(_globales)
+    return None
+
+
+def _guardar_globales(tickets_pendientes, chats_esperando):
+    global _globales, _globales_expira
+    with _lock:
+        _globales = {
+            'tickets_pendientes': tickets_pendientes,
+            'chats_esperando': chats_esperando
+        }
+        _globales_expira = time.monotonic() + TTL_GLOBALES
+
+
+def invalidar_metricas_globales():
+    """Descarta los contadores globales en caché (llamar tras modificar Soporte o Chat)"""
+    global _globales, _globales_expira
+    with _lock:
+        _globales = None
+        _globales_expira = 0.0
+
+
+def _consulta_metricas():
+    """(sql, globales en caché o None): la consulta completa solo si los globales expiraron"""
+    globales = _leer_globales()
+    return (SQL_COMPLETO if globales is None else SQL_AGENTE), globales
+
+
+def _armar_metricas(fila, globales):
+    if globales is None:
+        (tickets_pendientes, mis_tickets, tickets_cerrados_hoy,
+         chats_esperando, mis_chats, chats_cerrados_hoy) = fila
+        _guardar_globales(tickets_pendientes, chats_esperando)
+    else:
+        mis_tickets, tickets_cerrados_hoy, mis_chats, chats_cerrados_hoy = fila
+        tickets_pendientes = globales['tickets_pendientes']
+        chats_esperando = globales['chats_esperando']
+
+    return {
+        'tickets_pendientes': tickets_pendientes,
+        'mis_tickets': mis_tickets,
+        'chats_esperando': chats_esperando,
+        'mis_chats': mis_chats,
+        'cerrados_hoy': tickets_cerrados_hoy + chats_cerrados_hoy
+    }
+
+
+def calcular_metricas_agente(conn, id_agente):
+    """Métricas del dashboard de un agente con una sola consulta"""
+    sql, globales = _consulta_metricas()
+    cursor = conn.cursor()
+    cursor.execute(sql, {'id_agente': id_agente})
+    fila = cursor.fetchone()
+    cursor.close()
+    return _armar_metricas(fila, globales)
+
+
+async def calcular_metricas_agente_async(conn, id_agente):
+    """Igual que calcular_metricas_agente, con una conexión asíncrona (db_async.py)"""
+    sql, globales = _consulta_metricas()
+    async with conn.cursor() as cursor:
+        await cursor.execute(sql, {'id_agente': id_agente})
+        fila = await cursor.fetchone()
+    return _armar_metricas(fila, globales)
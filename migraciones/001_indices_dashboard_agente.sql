@@ -0,0 +1,19 @@
+-- ===================================================================
+-- ÍNDICES PARA LAS MÉTRICAS DEL DASHBOARD DE AGENTE
+-- ===================================================================
+-- La consulta agregada de metricas_dashboard.py filtra por agente y por
+-- estado; estos índices evitan recorrer Soporte y Chat completos.
+
+CREATE INDEX IF NOT EXISTS idx_soporte_agente_estado
+    ON Soporte (id_agente, estado, fecha_cierre);
+
+CREATE INDEX IF NOT EXISTS idx_soporte_pendientes
+    ON Soporte (estado)
+    WHERE id_agente IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_agente_estado
+    ON Chat (id_agente, estado, fecha_cierre);
+
+CREATE INDEX IF NOT EXISTS idx_chat_esperando
+    ON Chat (fecha_inicio)
+    WHERE estado = 'Esperando';
@@ -0,0 +1,12 @@
+-- ===================================================================
+-- ÍNDICE PARA LECTURA INCREMENTAL DE MENSAJES DE CHAT
+-- ===================================================================
+-- /api/agente/chat-mensajes/<id_chat>?since_id=N y el stream SSE leen
+-- "mensajes de este chat con id mayor a N"; con este índice el costo no
+-- crece con el largo de la conversación.
+
+CREATE INDEX IF NOT EXISTS idx_mensaje_chat_chat_id
+    ON Mensaje_Chat (id_chat, id_mensaje);
+
+CREATE INDEX IF NOT EXISTS idx_mensaje_chat_chat_fecha
+    ON Mensaje_Chat (id_chat, fecha_mensaje);
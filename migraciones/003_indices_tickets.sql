@@ -0,0 +1,20 @@
+-- ===================================================================
+-- ÍNDICES PARA EL LISTADO PAGINADO DE TICKETS
+-- ===================================================================
+-- /api/agente/tickets pagina por (fecha_creacion, id_ticket) y filtra por
+-- estado y asignación; la búsqueda en asunto usa trigramas (ILIKE '%texto%').
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_soporte_fecha_id
+    ON Soporte (fecha_creacion DESC, id_ticket DESC);
+
+CREATE INDEX IF NOT EXISTS idx_soporte_estado_fecha_id
+    ON Soporte (estado, fecha_creacion DESC, id_ticket DESC);
+
+CREATE INDEX IF NOT EXISTS idx_soporte_sin_asignar_fecha_id
+    ON Soporte (fecha_creacion DESC, id_ticket DESC)
+    WHERE id_agente IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_soporte_asunto_trgm
+    ON Soporte USING gin (asunto gin_trgm_ops);
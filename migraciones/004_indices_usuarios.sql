@@ -0,0 +1,31 @@
+-- ===================================================================
+-- ÍNDICES PARA EL LISTADO PAGINADO DE USUARIOS (ADMIN)
+-- ===================================================================
+-- /api/admin/usuarios busca por prefijo en nombre, apellido, email y CURP
+-- (lower(col) LIKE 'texto%') y ordena por (llave, id_usuario) con keyset.
+-- text_pattern_ops permite usar el índice con LIKE 'prefijo%' en cualquier collation.
+
+CREATE INDEX IF NOT EXISTS idx_usuario_nombre_prefijo
+    ON Usuario (lower(nombre) text_pattern_ops, id_usuario);
+
+CREATE INDEX IF NOT EXISTS idx_usuario_apellido_prefijo
+    ON Usuario (lower(apellido) text_pattern_ops, id_usuario);
+
+CREATE INDEX IF NOT EXISTS idx_usuario_email_prefijo
+    ON Usuario (lower(email) text_pattern_ops, id_usuario);
+
+CREATE INDEX IF NOT EXISTS idx_usuario_curp_prefijo
+    ON Usuario (lower(curp) text_pattern_ops);
+
+-- Orden por nombre/apellido/email con collation normal
+CREATE INDEX IF NOT EXISTS idx_usuario_orden_nombre
+    ON Usuario (lower(nombre), id_usuario);
+
+CREATE INDEX IF NOT EXISTS idx_usuario_orden_apellido
+    ON Usuario (lower(apellido), id_usuario);
+
+CREATE INDEX IF NOT EXISTS idx_usuario_orden_email
+    ON Usuario (lower(email), id_usuario);
+
+-- Mantener al día las estadísticas que usa el conteo estimado
+ANALYZE Usuario;
@@ -0,0 +1,19 @@
+-- ===================================================================
+-- BILLETERA: IDEMPOTENCIA Y SALDO RESULTANTE EN EL LIBRO
+-- ===================================================================
+-- billetera.py registra cada depósito/retiro en Transaccion junto con el
+-- saldo que dejó y la clave de idempotencia enviada por la app. La clave
+-- es única por usuario: un reintento con la misma clave devuelve el
+-- resultado original en vez de volver a mover el saldo.
+
+ALTER TABLE Transaccion ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(64);
+ALTER TABLE Transaccion ADD COLUMN IF NOT EXISTS saldo_resultante NUMERIC(12, 2);
+ALTER TABLE Transaccion ADD COLUMN IF NOT EXISTS fecha_transaccion TIMESTAMP DEFAULT NOW();
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_transaccion_usuario_clave
+    ON Transaccion (id_usuario, clave_idempotencia)
+    WHERE clave_idempotencia IS NOT NULL;
+
+-- Respaldo a nivel BD: el saldo nunca queda negativo
+ALTER TABLE Saldo DROP CONSTRAINT IF EXISTS chk_saldo_no_negativo;
+ALTER TABLE Saldo ADD CONSTRAINT chk_saldo_no_negativo CHECK (saldo_actual >= 0) NOT VALID;
@@ -0,0 +1,12 @@
+-- ===================================================================
+-- ÍNDICES PARA ANALÍTICA Y EXPORTACIÓN DE AUDITORÍAS
+-- ===================================================================
+-- /api/auditor/analitica y /api/auditor/exportar filtran por auditor y rango
+-- de fechas y recorren en orden (fecha_auditoria, id_auditoria).
+
+CREATE INDEX IF NOT EXISTS idx_auditoria_usuario_fecha
+    ON Auditoria (id_usuario, fecha_auditoria, id_auditoria);
+
+-- Analítica de administrador (todas las auditorías de un periodo)
+CREATE INDEX IF NOT EXISTS idx_auditoria_fecha
+    ON Auditoria (fecha_auditoria, id_auditoria);
@@ -0,0 +1,29 @@
+-- ===================================================================
+-- RESPUESTAS DE AUDITORÍA NORMALIZADAS
+-- ===================================================================
+-- Una fila por respuesta del checklist. guardar_auditoria escribe aquí y en
+-- Auditoria.datos_auditoria en la misma transacción; las auditorías previas
+-- se cargan con `python backfill_respuestas.py`.
+-- id_usuario y fecha_auditoria se copian de Auditoria (no cambian después de
+-- guardarse) para filtrar por auditor y periodo sin JOIN.
+
+CREATE TABLE IF NOT EXISTS Auditoria_Respuesta (
+    id_auditoria INTEGER NOT NULL REFERENCES Auditoria (id_auditoria) ON DELETE CASCADE,
+    posicion SMALLINT NOT NULL,
+    pregunta TEXT NOT NULL,
+    respuesta TEXT NOT NULL,
+    id_usuario INTEGER,
+    fecha_auditoria TIMESTAMP,
+    PRIMARY KEY (id_auditoria, posicion)
+);
+
+-- "¿Qué auditorías fallaron la pregunta X este mes?"
+CREATE INDEX IF NOT EXISTS idx_respuesta_pregunta
+    ON Auditoria_Respuesta (pregunta, respuesta, fecha_auditoria);
+
+CREATE INDEX IF NOT EXISTS idx_respuesta_posicion
+    ON Auditoria_Respuesta (posicion, respuesta, fecha_auditoria);
+
+-- Lo mismo restringido a un auditor
+CREATE INDEX IF NOT EXISTS idx_respuesta_usuario
+    ON Auditoria_Respuesta (id_usuario, fecha_auditoria);
@@ -0,0 +1,27 @@
+-- ===================================================================
+-- PUNTAJE VIGENTE DE CADA AUDITORÍA SEGÚN LAS REGLAS ACTUALES
+-- ===================================================================
+-- guardar_auditoria escribe el puntaje calculado al guardar; al cambiar
+-- reglas_auditoria.json, `python reevaluar_auditorias.py` recalifica las
+-- auditorías cuya version_reglas ya no coincide (lee Auditoria_Respuesta,
+-- migración 007). El JSON original en Auditoria.datos_auditoria no se toca.
+
+CREATE TABLE IF NOT EXISTS Auditoria_Puntaje (
+    id_auditoria INTEGER PRIMARY KEY REFERENCES Auditoria (id_auditoria) ON DELETE CASCADE,
+    version_reglas VARCHAR(12) NOT NULL,
+    total_menores INTEGER NOT NULL DEFAULT 0,
+    total_mayores INTEGER NOT NULL DEFAULT 0,
+    sancion BOOLEAN NOT NULL DEFAULT false,
+    total_buenas_practicas INTEGER NOT NULL DEFAULT 0,
+    porcentaje_cumplimiento NUMERIC(5, 2) NOT NULL DEFAULT 0,
+    resultado JSONB,
+    fecha_calculo TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Pendientes de recalificar tras un cambio de reglas
+CREATE INDEX IF NOT EXISTS idx_puntaje_version
+    ON Auditoria_Puntaje (version_reglas);
+
+-- Auditorías con sanción o no conformidad mayor
+CREATE INDEX IF NOT EXISTS idx_puntaje_mayores
+    ON Auditoria_Puntaje (total_mayores, sancion) WHERE total_mayores > 0;
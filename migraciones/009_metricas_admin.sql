@@ -0,0 +1,158 @@
+-- ===================================================================
+-- MÉTRICAS DEL ADMINISTRADOR MATERIALIZADAS
+-- ===================================================================
+-- /api/admin/metrics sumaba Usuario y TODO Transaccion en cada carga.
+-- Ahora los totales viven en Metrica_Contador y la serie por hora en
+-- Metrica_Hora; los triggers de abajo los mantienen al día en la misma
+-- transacción que escribe Usuario/Transaccion (registro, billetera, lotes).
+--
+-- Cada contador se reparte en 16 fragmentos (pg_backend_pid() % 16) para que
+-- los depósitos concurrentes no hagan fila sobre un mismo renglón; leer un
+-- total es sumar 16 renglones por PK, sin importar el tamaño del libro.
+-- metricas_admin.reconciliar() recalcula todo periódicamente por si algo
+-- escribió con los triggers deshabilitados (o antes de esta migración).
+
+CREATE TABLE IF NOT EXISTS Metrica_Contador (
+    clave VARCHAR(40) NOT NULL,
+    fragmento SMALLINT NOT NULL,
+    valor NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, fragmento)
+);
+
+CREATE TABLE IF NOT EXISTS Metrica_Hora (
+    clave VARCHAR(40) NOT NULL,
+    hora TIMESTAMP NOT NULL,
+    fragmento SMALLINT NOT NULL,
+    valor NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    conteo BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, hora, fragmento)
+);
+
+-- Bitácora de reconciliaciones (y cuánto se habían desviado los contadores)
+CREATE TABLE IF NOT EXISTS Metrica_Reconciliacion (
+    id_reconciliacion SERIAL PRIMARY KEY,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW(),
+    diferencias JSONB
+);
+
+-- --- Usuario: usuarios_total, usuarios_activos, serie usuarios_nuevos ---
+
+CREATE OR REPLACE FUNCTION metricas_usuario() RETURNS trigger AS $$
+DECLARE
+    frag SMALLINT := pg_backend_pid() % 16;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO Metrica_Contador (clave, fragmento, valor)
+        SELECT c.clave, frag, c.delta
+        FROM (
+            SELECT 'usuarios_total' AS clave, COUNT(*)::numeric AS delta FROM nuevas WHERE TG_OP = 'INSERT'
+            UNION ALL
+            SELECT 'usuarios_activos', COUNT(*) FILTER (WHERE activo) FROM nuevas
+        ) c
+        WHERE c.delta <> 0
+        ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Metrica_Contador.valor + EXCLUDED.valor;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO Metrica_Contador (clave, fragmento, valor)
+        SELECT c.clave, frag, -c.delta
+        FROM (
+            SELECT 'usuarios_total' AS clave, COUNT(*)::numeric AS delta FROM viejas WHERE TG_OP = 'DELETE'
+            UNION ALL
+            SELECT 'usuarios_activos', COUNT(*) FILTER (WHERE activo) FROM viejas
+        ) c
+        WHERE c.delta <> 0
+        ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Metrica_Contador.valor + EXCLUDED.valor;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO Metrica_Hora (clave, hora, fragmento, valor, conteo)
+        SELECT 'usuarios_nuevos', date_trunc('hour', COALESCE(fecha_registro, NOW())), frag, COUNT(*), COUNT(*)
+        FROM nuevas
+        GROUP BY 2
+        ON CONFLICT (clave, hora, fragmento) DO UPDATE
+            SET valor = Metrica_Hora.valor + EXCLUDED.valor, conteo = Metrica_Hora.conteo + EXCLUDED.conteo;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_metricas_usuario_ins ON Usuario;
+CREATE TRIGGER trg_metricas_usuario_ins AFTER INSERT ON Usuario
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_usuario();
+
+DROP TRIGGER IF EXISTS trg_metricas_usuario_upd ON Usuario;
+CREATE TRIGGER trg_metricas_usuario_upd AFTER UPDATE ON Usuario
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_usuario();
+
+DROP TRIGGER IF EXISTS trg_metricas_usuario_del ON Usuario;
+CREATE TRIGGER trg_metricas_usuario_del AFTER DELETE ON Usuario
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_usuario();
+
+-- --- Transaccion: depositos/retiros completados (monto y conteo), por hora ---
+
+CREATE OR REPLACE FUNCTION metricas_transaccion() RETURNS trigger AS $$
+DECLARE
+    nuevos CONSTANT TEXT := 'SELECT tipo_transaccion, fecha_transaccion, monto, 1 AS signo FROM nuevas WHERE estado = ''Completada''';
+    borrados CONSTANT TEXT := 'SELECT tipo_transaccion, fecha_transaccion, monto, -1 AS signo FROM viejas WHERE estado = ''Completada''';
+    cambios TEXT;
+BEGIN
+    -- Cada evento solo tiene sus tablas de transición; el origen se arma según la operación
+    cambios := CASE TG_OP
+        WHEN 'INSERT' THEN nuevos
+        WHEN 'DELETE' THEN borrados
+        ELSE nuevos || ' UNION ALL ' || borrados
+    END;
+
+    EXECUTE format($sql$
+        WITH cambios AS (%s),
+        por_hora AS (
+            SELECT CASE tipo_transaccion WHEN 'Depósito' THEN 'depositos' ELSE 'retiros' END AS clave,
+                   date_trunc('hour', COALESCE(fecha_transaccion, NOW())) AS hora,
+                   SUM(monto * signo) AS valor,
+                   SUM(signo) AS conteo
+            FROM cambios
+            WHERE tipo_transaccion IN ('Depósito', 'Retiro')
+            GROUP BY 1, 2
+        ),
+        serie AS (
+            INSERT INTO Metrica_Hora (clave, hora, fragmento, valor, conteo)
+            SELECT clave, hora, $1, valor, conteo FROM por_hora
+            ON CONFLICT (clave, hora, fragmento) DO UPDATE
+                SET valor = Metrica_Hora.valor + EXCLUDED.valor, conteo = Metrica_Hora.conteo + EXCLUDED.conteo
+        )
+        INSERT INTO Metrica_Contador (clave, fragmento, valor)
+        SELECT t.clave, $1, SUM(t.valor)
+        FROM (
+            SELECT clave || '_monto' AS clave, valor FROM por_hora
+            UNION ALL
+            SELECT clave || '_conteo', conteo FROM por_hora
+        ) t
+        GROUP BY t.clave
+        HAVING SUM(t.valor) <> 0
+        ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Metrica_Contador.valor + EXCLUDED.valor
+    $sql$, cambios) USING (pg_backend_pid() % 16)::smallint;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_metricas_transaccion_ins ON Transaccion;
+CREATE TRIGGER trg_metricas_transaccion_ins AFTER INSERT ON Transaccion
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_transaccion();
+
+DROP TRIGGER IF EXISTS trg_metricas_transaccion_upd ON Transaccion;
+CREATE TRIGGER trg_metricas_transaccion_upd AFTER UPDATE ON Transaccion
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_transaccion();
+
+DROP TRIGGER IF EXISTS trg_metricas_transaccion_del ON Transaccion;
+CREATE TRIGGER trg_metricas_transaccion_del AFTER DELETE ON Transaccion
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION metricas_transaccion();
+
+-- Después de aplicar, cargar los totales y la serie históricos con:
+--   python -c "from metricas_admin import reconciliar_ahora; print(reconciliar_ahora(horas=None))"
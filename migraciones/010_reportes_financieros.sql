@@ -0,0 +1,42 @@
+-- ===================================================================
+-- REPORTES FINANCIEROS: ROLLUPS POR HORA, DÍA Y MES
+-- ===================================================================
+-- reportes_financieros.py (hilo agregador) recalcula por ventanas las horas
+-- recientes de Transaccion y de ahí los días y meses afectados. La API de
+-- reportes solo lee estas tablas; nunca suma el libro en vivo.
+
+CREATE TABLE IF NOT EXISTS Reporte_Hora (
+    hora TIMESTAMP NOT NULL,
+    tipo_transaccion VARCHAR(30) NOT NULL,
+    monto NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    conteo BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hora, tipo_transaccion)
+);
+
+CREATE TABLE IF NOT EXISTS Reporte_Dia (
+    dia DATE NOT NULL,
+    tipo_transaccion VARCHAR(30) NOT NULL,
+    monto NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    conteo BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, tipo_transaccion)
+);
+
+CREATE TABLE IF NOT EXISTS Reporte_Mes (
+    mes DATE NOT NULL,
+    tipo_transaccion VARCHAR(30) NOT NULL,
+    monto NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    conteo BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (mes, tipo_transaccion)
+);
+
+-- Hasta qué hora está agregado el libro (una sola fila)
+CREATE TABLE IF NOT EXISTS Reporte_Agregador (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    agregado_hasta TIMESTAMP,
+    actualizado TIMESTAMP NOT NULL DEFAULT NOW()
+);
+INSERT INTO Reporte_Agregador (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- El agregador lee el libro por rangos de fecha
+CREATE INDEX IF NOT EXISTS idx_transaccion_fecha
+    ON Transaccion (fecha_transaccion);
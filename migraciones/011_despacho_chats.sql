@@ -0,0 +1,59 @@
+-- ===================================================================
+-- DESPACHO DE CHATS: DISPONIBILIDAD DE AGENTES Y AVISOS DE LA COLA
+-- ===================================================================
+-- despacho_chats.py reclama chats con FOR UPDATE SKIP LOCKED y, con
+-- CHAT_AUTOASIGNAR=1, reparte los que esperan entre los agentes disponibles
+-- con menos chats activos.
+--
+-- Agente_Disponibilidad: el agente se marca disponible desde el panel y el
+-- stream de la cola renueva ultimo_latido; sin latido reciente deja de
+-- recibir chats aunque siga marcado.
+--
+-- Los chats los crean también clientes fuera de este servidor, así que el
+-- aviso de "la cola cambió" sale de un trigger: cualquier alta o cambio de
+-- estado que entre o salga de 'Esperando' manda un NOTIFY 'cola' por el
+-- canal chat_eventos (el mismo del chat en tiempo real), y cuando un chat
+-- activo se cierra manda 'liberado' para que el despachador reparta de nuevo.
+
+CREATE TABLE IF NOT EXISTS Agente_Disponibilidad (
+    id_agente INTEGER PRIMARY KEY REFERENCES Usuario (id_usuario) ON DELETE CASCADE,
+    disponible BOOLEAN NOT NULL DEFAULT false,
+    ultimo_latido TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_agente_disponibilidad_latido
+    ON Agente_Disponibilidad (ultimo_latido)
+    WHERE disponible;
+
+CREATE OR REPLACE FUNCTION notificar_cola_chats() RETURNS trigger AS $$
+DECLARE
+    tipo TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.estado = 'Esperando' THEN
+            tipo := 'cola';
+        END IF;
+    ELSIF NEW.estado IS DISTINCT FROM OLD.estado THEN
+        IF NEW.estado = 'Esperando' OR OLD.estado = 'Esperando' THEN
+            tipo := 'cola';
+        ELSIF OLD.estado = 'Activo' THEN
+            tipo := 'liberado';
+        END IF;
+    END IF;
+
+    IF tipo IS NOT NULL THEN
+        PERFORM pg_notify('chat_eventos', json_build_object(
+            'id_chat', 'cola',
+            'tipo', tipo,
+            'chat', NEW.id_chat,
+            'estado', NEW.estado,
+            'id_agente', NEW.id_agente
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificar_cola_chats ON Chat;
+CREATE TRIGGER trg_notificar_cola_chats AFTER INSERT OR UPDATE OF estado ON Chat
+    FOR EACH ROW EXECUTE FUNCTION notificar_cola_chats();
@@ -0,0 +1,36 @@
+-- ===================================================================
+-- RUTEO DE TICKETS: AVISOS DE ALTAS, ASIGNACIONES Y CIERRES
+-- ===================================================================
+-- ruteo_tickets.py asigna los tickets nuevos y mantiene en memoria cuántos
+-- tickets abiertos tiene cada agente. Los tickets también se crean fuera de
+-- este servidor, así que cada alta, reasignación, cambio de estado o baja en
+-- Soporte manda un NOTIFY con el antes y el después; cada worker ajusta su
+-- tabla de carga con ese delta en lugar de volver a contar.
+--
+-- Se usa el canal chat_eventos (clave 'tickets') para aprovechar la única
+-- conexión con LISTEN que ya tiene cada worker (chat_eventos.py).
+
+CREATE OR REPLACE FUNCTION notificar_tickets() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.id_agente IS NOT DISTINCT FROM OLD.id_agente
+       AND (NEW.estado = 'Cerrado') = (OLD.estado = 'Cerrado') THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM pg_notify('chat_eventos', json_build_object(
+        'id_chat', 'tickets',
+        'tipo', 'ticket',
+        'id_ticket', CASE WHEN TG_OP = 'DELETE' THEN OLD.id_ticket ELSE NEW.id_ticket END,
+        'agente_anterior', CASE WHEN TG_OP = 'INSERT' THEN NULL ELSE OLD.id_agente END,
+        'abierto_anterior', CASE WHEN TG_OP = 'INSERT' THEN false ELSE OLD.estado <> 'Cerrado' END,
+        'agente', CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE NEW.id_agente END,
+        'abierto', CASE WHEN TG_OP = 'DELETE' THEN false ELSE NEW.estado <> 'Cerrado' END
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificar_tickets ON Soporte;
+CREATE TRIGGER trg_notificar_tickets AFTER INSERT OR UPDATE OF id_agente, estado OR DELETE ON Soporte
+    FOR EACH ROW EXECUTE FUNCTION notificar_tickets();
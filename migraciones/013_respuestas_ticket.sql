@@ -0,0 +1,53 @@
+-- ===================================================================
+-- RESPUESTAS DE TICKETS Y VERSIÓN DEL TICKET
+-- ===================================================================
+-- Hilo de respuestas de cada ticket (responder_ticket en db_config.py).
+-- Soporte.version sube con cualquier cambio del ticket o respuesta nueva:
+-- la vista de detalle manda la versión que ya tiene y, si no cambió, recibe
+-- 304 tras leer un solo renglón por PK; si cambió, solo las respuestas
+-- posteriores a su cursor (id_respuesta).
+-- Los triggers cubren también lo que escriben otros sistemas en Soporte.
+
+ALTER TABLE Soporte ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+CREATE TABLE IF NOT EXISTS Respuesta_Ticket (
+    id_respuesta SERIAL PRIMARY KEY,
+    id_ticket INTEGER NOT NULL REFERENCES Soporte (id_ticket) ON DELETE CASCADE,
+    id_usuario INTEGER NOT NULL REFERENCES Usuario (id_usuario),
+    mensaje TEXT NOT NULL,
+    es_agente BOOLEAN NOT NULL DEFAULT true,
+    fecha_respuesta TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Hilo de un ticket, completo o desde el cursor
+CREATE INDEX IF NOT EXISTS idx_respuesta_ticket_id
+    ON Respuesta_Ticket (id_ticket, id_respuesta);
+
+-- --- Soporte: cualquier cambio sube la versión ---
+
+CREATE OR REPLACE FUNCTION version_soporte() RETURNS trigger AS $$
+BEGIN
+    IF NEW.version IS NOT DISTINCT FROM OLD.version THEN
+        NEW.version := OLD.version + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_version_soporte ON Soporte;
+CREATE TRIGGER trg_version_soporte BEFORE UPDATE ON Soporte
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION version_soporte();
+
+-- --- Respuesta_Ticket: una respuesta nueva también es un cambio del ticket ---
+
+CREATE OR REPLACE FUNCTION version_por_respuesta() RETURNS trigger AS $$
+BEGIN
+    UPDATE Soporte SET version = version + 1 WHERE id_ticket = NEW.id_ticket;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_version_por_respuesta ON Respuesta_Ticket;
+CREATE TRIGGER trg_version_por_respuesta AFTER INSERT ON Respuesta_Ticket
+    FOR EACH ROW EXECUTE FUNCTION version_por_respuesta();
@@ -0,0 +1,100 @@
+-- ===================================================================
+-- VERSIONES DE CAMBIO PARA LAS PANTALLAS DEL PANEL DE AGENTE
+-- ===================================================================
+-- Cada pantalla del agente vigila unas pocas claves y solo vuelve a pedir
+-- sus datos cuando alguna cambió (/api/agente/changes, versiones_cambio.py):
+--
+--   tickets               cualquier alta, cambio o baja en Soporte
+--   tickets_agente:<id>   tickets del agente (asignación, estado, cierre)
+--   chats_esperando       cola de espera de chats
+--   chats_agente:<id>     chats del agente
+--   chat:<id>             encabezado y mensajes de un chat
+--
+-- El detalle de un ticket ya tiene Soporte.version (migración 013).
+-- Los triggers suben la versión en la misma transacción que escribe, así que
+-- también cuentan las escrituras del despachador, el ruteo o de fuera.
+-- Como en Metrica_Contador (migración 009), cada clave se reparte en 16
+-- fragmentos por backend para que las escrituras concurrentes no hagan fila
+-- sobre un mismo renglón; la versión de una clave es la suma de sus fragmentos.
+
+CREATE TABLE IF NOT EXISTS Version_Cambio (
+    clave VARCHAR(60) NOT NULL,
+    fragmento SMALLINT NOT NULL,
+    valor BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (clave, fragmento)
+);
+
+CREATE OR REPLACE FUNCTION marcar_cambio(p_clave TEXT) RETURNS void AS $$
+    INSERT INTO Version_Cambio (clave, fragmento, valor)
+    VALUES (p_clave, pg_backend_pid() % 16, 1)
+    ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Version_Cambio.valor + 1;
+$$ LANGUAGE sql;
+
+-- --- Soporte ---
+
+CREATE OR REPLACE FUNCTION cambios_soporte() RETURNS trigger AS $$
+BEGIN
+    -- Una respuesta nueva solo sube Soporte.version: las listas no cambian
+    IF TG_OP = 'UPDATE'
+       AND (OLD.id_agente, OLD.estado, OLD.asunto, OLD.mensaje, OLD.fecha_cierre)
+           IS NOT DISTINCT FROM (NEW.id_agente, NEW.estado, NEW.asunto, NEW.mensaje, NEW.fecha_cierre) THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM marcar_cambio('tickets');
+    IF TG_OP <> 'INSERT' AND OLD.id_agente IS NOT NULL THEN
+        PERFORM marcar_cambio('tickets_agente:' || OLD.id_agente);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.id_agente IS NOT NULL
+       AND (TG_OP = 'INSERT' OR NEW.id_agente IS DISTINCT FROM OLD.id_agente) THEN
+        PERFORM marcar_cambio('tickets_agente:' || NEW.id_agente);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cambios_soporte ON Soporte;
+CREATE TRIGGER trg_cambios_soporte AFTER INSERT OR UPDATE OR DELETE ON Soporte
+    FOR EACH ROW EXECUTE FUNCTION cambios_soporte();
+
+-- --- Chat ---
+
+CREATE OR REPLACE FUNCTION cambios_chat() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM marcar_cambio('chat:' || OLD.id_chat);
+    ELSE
+        PERFORM marcar_cambio('chat:' || NEW.id_chat);
+    END IF;
+
+    IF (TG_OP <> 'INSERT' AND OLD.estado = 'Esperando')
+       OR (TG_OP <> 'DELETE' AND NEW.estado = 'Esperando') THEN
+        PERFORM marcar_cambio('chats_esperando');
+    END IF;
+    IF TG_OP <> 'INSERT' AND OLD.id_agente IS NOT NULL THEN
+        PERFORM marcar_cambio('chats_agente:' || OLD.id_agente);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.id_agente IS NOT NULL
+       AND (TG_OP = 'INSERT' OR NEW.id_agente IS DISTINCT FROM OLD.id_agente) THEN
+        PERFORM marcar_cambio('chats_agente:' || NEW.id_agente);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cambios_chat ON Chat;
+CREATE TRIGGER trg_cambios_chat AFTER INSERT OR UPDATE OR DELETE ON Chat
+    FOR EACH ROW EXECUTE FUNCTION cambios_chat();
+
+-- --- Mensaje_Chat ---
+
+CREATE OR REPLACE FUNCTION cambios_mensaje_chat() RETURNS trigger AS $$
+BEGIN
+    PERFORM marcar_cambio('chat:' || NEW.id_chat);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cambios_mensaje_chat ON Mensaje_Chat;
+CREATE TRIGGER trg_cambios_mensaje_chat AFTER INSERT ON Mensaje_Chat
+    FOR EACH ROW EXECUTE FUNCTION cambios_mensaje_chat();
@@ -0,0 +1,19 @@
+-- ===================================================================
+-- RESPUESTA DE AUDITORÍA COMO TEXTO
+-- ===================================================================
+-- La migración 007 creó Auditoria_Respuesta.respuesta como VARCHAR(30): una
+-- respuesta más larga hacía fallar (y deshacer) todo guardar_auditoria.
+-- Ahora es TEXT; respuestas_auditoria.py acota el largo para el índice.
+-- VARCHAR -> TEXT no reescribe la tabla ni sus índices.
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'auditoria_respuesta'
+          AND column_name = 'respuesta'
+          AND data_type = 'character varying'
+    ) THEN
+        ALTER TABLE Auditoria_Respuesta ALTER COLUMN respuesta TYPE TEXT;
+    END IF;
+END $$;
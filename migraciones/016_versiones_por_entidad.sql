@@ -0,0 +1,72 @@
+-- ===================================================================
+-- VERSIONES DE CAMBIO: UN FRAGMENTO POR ENTIDAD Y PODA DE CHATS CERRADOS
+-- ===================================================================
+-- La migración 014 repartía toda clave en 16 fragmentos. Eso solo sirve a
+-- las claves calientes (tickets, chats_esperando); las de una entidad
+-- (chat:<id>, tickets_agente:<id>, chats_agente:<id>) casi no tienen
+-- escrituras concurrentes y dejaban hasta 16 renglones por chat para siempre.
+--
+-- Ahora las claves con ':' usan solo el fragmento 0, y al cerrarse (o
+-- borrarse) un chat se borran los renglones de chat:<id>. Su versión vuelve
+-- a 0, distinta de la que conozca cualquier pantalla abierta, así que el
+-- cierre se sigue notando en /api/agente/changes.
+
+CREATE OR REPLACE FUNCTION marcar_cambio(p_clave TEXT) RETURNS void AS $$
+    INSERT INTO Version_Cambio (clave, fragmento, valor)
+    VALUES (p_clave, CASE WHEN strpos(p_clave, ':') > 0 THEN 0 ELSE pg_backend_pid() % 16 END, 1)
+    ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Version_Cambio.valor + 1;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION cambios_chat() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM Version_Cambio WHERE clave = 'chat:' || OLD.id_chat;
+    ELSIF NEW.estado = 'Cerrado' THEN
+        -- Un chat cerrado ya no cambia: su clave no necesita renglones
+        DELETE FROM Version_Cambio WHERE clave = 'chat:' || NEW.id_chat;
+    ELSE
+        PERFORM marcar_cambio('chat:' || NEW.id_chat);
+    END IF;
+
+    IF (TG_OP <> 'INSERT' AND OLD.estado = 'Esperando')
+       OR (TG_OP <> 'DELETE' AND NEW.estado = 'Esperando') THEN
+        PERFORM marcar_cambio('chats_esperando');
+    END IF;
+    IF TG_OP <> 'INSERT' AND OLD.id_agente IS NOT NULL THEN
+        PERFORM marcar_cambio('chats_agente:' || OLD.id_agente);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.id_agente IS NOT NULL
+       AND (TG_OP = 'INSERT' OR NEW.id_agente IS DISTINCT FROM OLD.id_agente) THEN
+        PERFORM marcar_cambio('chats_agente:' || NEW.id_agente);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cambios_mensaje_chat() RETURNS trigger AS $$
+BEGIN
+    -- Un mensaje tardío en un chat cerrado no vuelve a crear su clave
+    IF EXISTS (SELECT 1 FROM Chat WHERE id_chat = NEW.id_chat AND estado <> 'Cerrado') THEN
+        PERFORM marcar_cambio('chat:' || NEW.id_chat);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- --- Una sola vez: juntar los fragmentos por entidad y podar chats cerrados ---
+
+WITH movidos AS (
+    DELETE FROM Version_Cambio
+    WHERE strpos(clave, ':') > 0 AND fragmento <> 0
+    RETURNING clave, valor
+)
+INSERT INTO Version_Cambio (clave, fragmento, valor)
+SELECT clave, 0, SUM(valor) FROM movidos GROUP BY clave
+ON CONFLICT (clave, fragmento) DO UPDATE SET valor = Version_Cambio.valor + EXCLUDED.valor;
+
+DELETE FROM Version_Cambio v
+WHERE v.clave LIKE 'chat:%'
+  AND NOT EXISTS (
+      SELECT 1 FROM Chat c
+      WHERE c.id_chat = split_part(v.clave, ':', 2)::int AND c.estado <> 'Cerrado'
+  );
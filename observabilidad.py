@@ -0,0 +1,394 @@
+"""
+Latencias por ruta y perfilador por muestreo.
+Cada petición se registra en un histograma estilo HDR por (ruta, método,
+estado): cubetas log-lineales de microsegundos con error relativo < 1 %, así
+que p50/p99/p99.9 salen exactos a esa precisión sin guardar muestras y dos
+histogramas se combinan sumando cubetas. Un hilo por worker vuelca sus
+histogramas a DIRECTORIO cada INTERVALO_VOLCADO segundos; los endpoints de
+admin combinan los de todos los workers vivos.
+
+El perfilador se enciende desde el panel de admin con un porcentaje de
+peticiones a muestrear. La configuración se comparte por archivo entre los
+workers; mientras está activo el mismo hilo toma la pila de los hilos que
+atienden peticiones muestreadas cada INTERVALO_MUESTREO segundos y la acumula
+en formato "colapsado" (ruta;func;func N), la entrada de flamegraph.pl,
+speedscope o inferno.
+"""
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+DIRECTORIO = os.environ.get(
+    'OBSERVABILIDAD_DIR',
+    os.path.join(tempfile.gettempdir(), 'bdcasino_observabilidad')
+)
+INTERVALO_VOLCADO = float(os.environ.get('OBSERVABILIDAD_VOLCADO_SEG', 10))
+INTERVALO_MUESTREO = float(os.environ.get('PERFILADOR_INTERVALO_SEG', 0.005))
+# Un archivo de otro worker más viejo que esto se ignora si su proceso ya no existe
+MAX_EDAD_ARCHIVO = 600
+PROFUNDIDAD_MAXIMA = 96
+PERCENTILES = (50, 90, 99, 99.9)
+
+ARCHIVO_CONFIG = os.path.join(DIRECTORIO, 'perfilador.json')
+
+
+# --- Histograma estilo HDR ---
+
+# 2 cifras significativas (como HdrHistogram): 256 sub-cubetas por potencia de dos,
+# error relativo máximo 1/128 ≈ 0.78 %
+_SUB_CUBETAS = 256
+_MITAD = _SUB_CUBETAS // 2
+_BITS = _SUB_CUBETAS.bit_length() - 1
+
+
+def _indice(valor):
+    if valor < _SUB_CUBETAS:
+        return valor
+    exponente = valor.bit_length() - _BITS
+    return exponente * _MITAD + (valor >> exponente)
+
+
+def _valor_de_indice(indice):
+    """Valor más alto equivalente a la cubeta (como HdrHistogram)"""
+    if indice < _SUB_CUBETAS:
+        return indice
+    exponente = indice // _MITAD - 1
+    mantisa = indice - exponente * _MITAD
+    return ((mantisa + 1) << exponente) - 1
+
+
+class Histograma:
+    """Conteos por cubeta log-lineal de valores enteros (microsegundos)"""
+
+    __slots__ = ('cubetas', 'total', 'suma', 'maximo')
+
+    def __init__(self):
+        self.cubetas = {}
+        self.total = 0
+        self.suma = 0
+        self.maximo = 0
+
+    def registrar(self, valor):
+        valor = max(0, int(valor))
+        indice = _indice(valor)
+        self.cubetas[indice] = self.cubetas.get(indice, 0) + 1
+        self.total += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def combinar(self, otro):
+        for indice, n in otro.cubetas.items():
+            self.cubetas[indice] = self.cubetas.get(indice, 0) + n
+        self.total += otro.total
+        self.suma += otro.suma
+        self.maximo = max(self.maximo, otro.maximo)
+
+    def percentil(self, p):
+        if not self.total:
+            return 0
+        objetivo = max(1, -(-self.total * p // 100))
+        acumulado = 0
+        for indice in sorted(self.cubetas):
+            acumulado += self.cubetas[indice]
+            if acumulado >= objetivo:
+                return min(_valor_de_indice(indice), self.maximo)
+        return self.maximo
+
+    def resumen(self):
+        """Percentiles en milisegundos"""
+        datos = {"conteo": self.total}
+        if self.total:
+            datos["promedio_ms"] = round(self.suma / self.total / 1000, 3)
+            for p in PERCENTILES:
+                datos[f"p{p:g}_ms"] = round(self.percentil(p) / 1000, 3)
+            datos["max_ms"] = round(self.maximo / 1000, 3)
+        return datos
+
+    def a_dict(self):
+        return {"c": {str(k): v for k, v in self.cubetas.items()}, "t": self.total, "s": self.suma, "m": self.maximo}
+
+    @classmethod
+    def de_dict(cls, datos):
+        h = cls()
+        h.cubetas = {int(k): v for k, v in datos["c"].items()}
+        h.total, h.suma, h.maximo = datos["t"], datos["s"], datos["m"]
+        return h
+
+
+# --- Estado del worker ---
+
+_lock = threading.Lock()
+_histogramas = {}          # (ruta, metodo, estado) -> Histograma
+_muestreadas = {}          # id del hilo -> ruta de la petición que se está perfilando
+_pilas = {}                # "ruta;f1;f2" -> muestras
+_config = {"porcentaje": 0.0, "hasta": 0.0, "rutas": [], "generacion": 0}
+_config_mtime = None
+_inicio_local = threading.local()
+
+_hilo = None
+_hilo_pid = None
+_hilo_lock = threading.Lock()
+
+
+def _perfilador_activo():
+    return _config["porcentaje"] > 0 and time.time() < _config["hasta"]
+
+
+def iniciar_peticion(ruta):
+    """Hook before_request: marca el inicio y decide si se muestrea esta petición"""
+    asegurar_hilo()
+    _inicio_local.inicio = time.perf_counter()
+    if _perfilador_activo() and random.random() * 100 < _config["porcentaje"]:
+        rutas = _config["rutas"]
+        if not rutas or any(ruta.startswith(r) for r in rutas):
+            with _lock:
+                _muestreadas[threading.get_ident()] = ruta
+
+
+def terminar_peticion(ruta, metodo, estado):
+    """Hook after_request/teardown: registra la latencia y deja de muestrear el hilo"""
+    inicio = getattr(_inicio_local, 'inicio', None)
+    if inicio is None:
+        return
+    _inicio_local.inicio = None
+    with _lock:
+        _muestreadas.pop(threading.get_ident(), None)
+    registrar_latencia(ruta, metodo, estado, (time.perf_counter() - inicio) * 1_000_000)
+
+
+def registrar_latencia(ruta, metodo, estado, microsegundos):
+    """Suma una petición al histograma de su ruta (las rutas async de asgi.py miden por su cuenta)"""
+    asegurar_hilo()
+    clave = (ruta, metodo, str(estado))
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = Histograma()
+        histograma.registrar(microsegundos)
+
+
+# --- Muestreo de pilas ---
+
+def _marco_texto(marco):
+    codigo = marco.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _muestrear():
+    with _lock:
+        objetivo = dict(_muestreadas)
+    if not objetivo:
+        return
+    marcos = sys._current_frames()
+    nuevas = []
+    for ident, ruta in objetivo.items():
+        marco = marcos.get(ident)
+        pila = []
+        while marco is not None and len(pila) < PROFUNDIDAD_MAXIMA:
+            pila.append(_marco_texto(marco))
+            marco = marco.f_back
+        if pila:
+            pila.append(ruta)
+            nuevas.append(";".join(reversed(pila)))
+    with _lock:
+        for clave in nuevas:
+            _pilas[clave] = _pilas.get(clave, 0) + 1
+
+
+# --- Archivos compartidos entre workers ---
+
+def _escribir_atomico(ruta, texto):
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(texto)
+        os.replace(temporal, ruta)
+    except Exception:
+        try:
+            os.unlink(temporal)
+        except OSError:
+            pass
+        raise
+
+
+def _leer_config():
+    global _config_mtime
+    try:
+        mtime = os.stat(ARCHIVO_CONFIG).st_mtime
+    except OSError:
+        return
+    if mtime == _config_mtime:
+        return
+    try:
+        with open(ARCHIVO_CONFIG, encoding='utf-8') as f:
+            nueva = json.load(f)
+    except (OSError, ValueError):
+        return
+    _config_mtime = mtime
+    with _lock:
+        if nueva.get("generacion") != _config["generacion"]:
+            # Nueva sesión de perfilado: descartar las pilas anteriores
+            _pilas.clear()
+        _config.update(nueva)
+
+
+def _volcar():
+    pid = os.getpid()
+    with _lock:
+        histogramas = [
+            {"ruta": r, "metodo": m, "estado": e, "h": h.a_dict()}
+            for (r, m, e), h in _histogramas.items()
+        ]
+        pilas = dict(_pilas)
+        generacion = _config["generacion"]
+    _escribir_atomico(os.path.join(DIRECTORIO, f"latencias-{pid}.json"), json.dumps(histogramas))
+    if pilas:
+        _escribir_atomico(
+            os.path.join(DIRECTORIO, f"perfil-{pid}.json"),
+            json.dumps({"generacion": generacion, "pilas": pilas})
+        )
+
+
+def _archivos_vigentes(patron):
+    """Archivos por worker cuyo proceso sigue vivo o que se escribieron hace poco"""
+    propio = os.getpid()
+    vigentes = []
+    for ruta in glob.glob(os.path.join(DIRECTORIO, patron)):
+        try:
+            pid = int(os.path.basename(ruta).split('-')[1].split('.')[0])
+        except (IndexError, ValueError):
+            continue
+        if pid == propio:
+            continue
+        try:
+            os.kill(pid, 0)
+            vivo = True
+        except OSError:
+            vivo = False
+        try:
+            reciente = time.time() - os.stat(ruta).st_mtime < MAX_EDAD_ARCHIVO
+        except OSError:
+            continue
+        if vivo or reciente:
+            vigentes.append(ruta)
+    return vigentes
+
+
+def _ciclo():
+    ultimo_volcado = time.monotonic()
+    ultima_config = 0.0
+    while True:
+        try:
+            ahora = time.monotonic()
+            if ahora - ultima_config >= 1.0:
+                _leer_config()
+                ultima_config = ahora
+            if ahora - ultimo_volcado >= INTERVALO_VOLCADO:
+                _volcar()
+                ultimo_volcado = ahora
+            if _perfilador_activo():
+                _muestrear()
+                time.sleep(INTERVALO_MUESTREO)
+            else:
+                time.sleep(0.5)
+        except Exception as e:
+            print(f"Error en observabilidad: {e}")
+            time.sleep(1.0)
+
+
+def asegurar_hilo():
+    global _hilo, _hilo_pid
+    if _hilo is not None and _hilo_pid == os.getpid():
+        return
+    with _hilo_lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_ciclo, name="observabilidad", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
+
+
+# --- Consultas (endpoints de admin y /metrics) ---
+
+def latencias(todos_los_workers=True):
+    """{(ruta, metodo, estado): Histograma} combinando los workers vivos"""
+    combinados = {}
+    with _lock:
+        for clave, h in _histogramas.items():
+            combinados[clave] = Histograma()
+            combinados[clave].combinar(h)
+    if not todos_los_workers:
+        return combinados
+    for ruta in _archivos_vigentes("latencias-*.json"):
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                entradas = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for entrada in entradas:
+            clave = (entrada["ruta"], entrada["metodo"], entrada["estado"])
+            if clave not in combinados:
+                combinados[clave] = Histograma()
+            combinados[clave].combinar(Histograma.de_dict(entrada["h"]))
+    return combinados
+
+
+def resumen_latencias(ruta=None):
+    """Lista de {ruta, metodo, estado, conteo, p50_ms, p99_ms, ...} ordenada por p99"""
+    filas = []
+    for (r, m, e), h in latencias().items():
+        if ruta and r != ruta:
+            continue
+        filas.append({"ruta": r, "metodo": m, "estado": e, **h.resumen()})
+    filas.sort(key=lambda f: f.get("p99_ms", 0), reverse=True)
+    return filas
+
+
+def configurar_perfilador(porcentaje, duracion_seg=300, rutas=None):
+    """Enciende (porcentaje > 0) o apaga el perfilador en todos los workers"""
+    porcentaje = min(100.0, max(0.0, float(porcentaje)))
+    actual = estado_perfilador()
+    generacion = actual["generacion"] + 1 if porcentaje > 0 else actual["generacion"]
+    nueva = {
+        "porcentaje": porcentaje,
+        "hasta": time.time() + float(duracion_seg) if porcentaje > 0 else 0.0,
+        "rutas": list(rutas or []),
+        "generacion": generacion,
+    }
+    _escribir_atomico(ARCHIVO_CONFIG, json.dumps(nueva))
+    _leer_config()
+    return estado_perfilador()
+
+
+def estado_perfilador():
+    _leer_config()
+    with _lock:
+        estado = dict(_config)
+        estado["muestras_locales"] = sum(_pilas.values())
+    estado["activo"] = estado["porcentaje"] > 0 and time.time() < estado["hasta"]
+    return estado
+
+
+def pilas_colapsadas():
+    """Texto "ruta;f1;f2 N" de la sesión de perfilado actual, combinando los workers"""
+    with _lock:
+        combinadas = dict(_pilas)
+        generacion = _config["generacion"]
+    for ruta in _archivos_vigentes("perfil-*.json"):
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if datos.get("generacion") != generacion:
+            continue
+        for clave, n in datos["pilas"].items():
+            combinadas[clave] = combinadas.get(clave, 0) + n
+    return "".join(f"{clave} {n}\n" for clave, n in sorted(combinadas.items()))
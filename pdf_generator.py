@@ -12,10 +12,15 @@ from reportlab.graphics.charts.piecharts import Pie
 import json
 import io
 
-def generar_pdf_profesional(datos, id_auditoria):
+def generar_pdf_profesional(datos, id_auditoria, progreso=None):
     """
-    Genera un PDF ejecutivo formal con gráficos y análisis detallado
+    Genera un PDF ejecutivo formal con gráficos y análisis detallado.
+    `progreso`, si se pasa, recibe el porcentaje (0-100) al terminar cada sección.
     """
+    def reportar(porcentaje):
+        if progreso:
+            progreso(porcentaje)
+
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
@@ -37,6 +42,7 @@ def generar_pdf_profesional(datos, id_auditoria):
     no_conformidades = datos_audit.get('no_conformidades', {})
     buenas_practicas = no_conformidades.get('buenas_practicas', [])
     metricas = no_conformidades.get('metricas', {})
+    reportar(5)
     
     # --- FUNCIÓN AUXILIAR PARA SALTO DE PÁGINA ---
     def check_new_page(y_pos, space_needed=100):
@@ -162,6 +168,8 @@ def generar_pdf_profesional(datos, id_auditoria):
         drawing.drawOn(c, 150, y - 180)
         y -= 200
     
+    reportar(25)
+
     # ============================================
     # ALERTAS CRÍTICAS
     # ============================================
@@ -257,6 +265,8 @@ def generar_pdf_profesional(datos, id_auditoria):
             
             y -= 60
     
+    reportar(45)
+
     # ============================================
     # RESULTADOS DETALLADOS POR PREGUNTA
     # ============================================
@@ -297,6 +307,8 @@ def generar_pdf_profesional(datos, id_auditoria):
         c.setFillColorRGB(0, 0, 0)
         y -= 20
     
+    reportar(75)
+
     # ============================================
     # COMENTARIOS Y OBSERVACIONES
     # ============================================
@@ -353,4 +365,5 @@ def generar_pdf_profesional(datos, id_auditoria):
     
     c.save()
     buffer.seek(0)
+    reportar(95)
     return buffer
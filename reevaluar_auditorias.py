@@ -0,0 +1,40 @@
+"""
+Recalifica el archivo de auditorías con las reglas actuales de
+reglas_auditoria.json y guarda el resultado en Auditoria_Puntaje.
+Antes normaliza las auditorías que aún no están en Auditoria_Respuesta.
+
+    python reevaluar_auditorias.py [--todas] [--lote 2000]
+"""
+import argparse
+
+from db_config import get_db_connection
+from reglas_auditoria import obtener_motor, reevaluar_archivo, TAMANO_LOTE_PUNTAJES
+from respuestas_auditoria import backfill_lote
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalifica auditorías con las reglas actuales")
+    parser.add_argument('--todas', action='store_true', help="recalificar aunque la versión de reglas coincida")
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE_PUNTAJES, help="auditorías por commit")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if not conn:
+        print("No se pudo conectar a la base de datos.")
+        return
+
+    try:
+        ultimo_id = 0
+        while ultimo_id is not None:
+            ultimo_id, _, _ = backfill_lote(conn, ultimo_id)
+
+        motor = obtener_motor()
+        print(f"Reglas versión {motor.version}")
+        resumen = reevaluar_archivo(conn, motor, todas=args.todas, tamano_lote=args.lote)
+        print(f"Listo: {resumen['auditorias']} auditorías recalificadas en {resumen['segundos']}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
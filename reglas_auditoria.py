@@ -0,0 +1,336 @@
+"""
+Motor de reglas de no conformidad del checklist.
+Las reglas (rachas de respuestas consecutivas y escalamientos como "3 menores
+= 1 mayor") se leen de configuración (reglas_auditoria.json o la ruta en
+REGLAS_AUDITORIA), se compilan una vez por proceso y se evalúan en UNA pasada
+sobre las respuestas, emitiendo hallazgos conforme aparecen. El mismo motor
+sirve para recalificar en lote el archivo histórico (ver reevaluar_auditorias.py).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+
+from psycopg2.extras import execute_values
+
+RUTA_REGLAS = os.environ.get(
+    'REGLAS_AUDITORIA',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reglas_auditoria.json')
+)
+
+# Reglas vigentes antes del motor (se usan si no hay archivo de configuración)
+REGLAS_POR_DEFECTO = {
+    "categorias": {
+        "Cumple": "cumple",
+        "No Cumple": "falla",
+        "Cumple Parcialmente": "falla",
+        "No Aplica": "no_aplica",
+    },
+    "metricas": {
+        "cumple": "Cumple",
+        "no_cumple": "No Cumple",
+        "parcial": "Cumple Parcialmente",
+        "no_aplica": "No Aplica",
+    },
+    "rachas": [
+        {
+            "lista": "menores",
+            "categoria": "falla",
+            "largo": 3,
+            "tipo": "menor",
+            "descripcion": "No Conformidad Menor: {largo} incumplimientos consecutivos",
+        },
+        {
+            "lista": "buenas_practicas",
+            "categoria": "cumple",
+            "largo": 3,
+            "descripcion": "Buena Práctica: {largo} cumplimientos consecutivos",
+        },
+    ],
+    "escalamientos": [
+        {
+            "lista": "mayores",
+            "de": "menores",
+            "cantidad": 3,
+            "tipo": "mayor",
+            "descripcion": "No Conformidad Mayor: {total} NC menores acumuladas",
+            "relacionadas": "nc_menores_relacionadas",
+        },
+        {
+            "bandera": "sancion",
+            "de": "mayores",
+            "cantidad": 3,
+        },
+    ],
+}
+
+
+class ReglasInvalidas(ValueError):
+    """La configuración de reglas no tiene la forma esperada"""
+
+
+class _Racha:
+    __slots__ = ('lista', 'categoria', 'largo', 'tipo', 'descripcion')
+
+    def __init__(self, regla):
+        try:
+            self.lista = regla['lista']
+            self.categoria = regla['categoria']
+            self.largo = int(regla['largo'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ReglasInvalidas(f"Regla de racha inválida: {regla}") from e
+        if self.largo < 1:
+            raise ReglasInvalidas(f"El largo de la racha debe ser >= 1: {regla}")
+        self.tipo = regla.get('tipo')
+        self.descripcion = regla.get('descripcion', "{largo} respuestas consecutivas")
+
+
+class MotorReglas:
+    """Reglas compiladas; `evaluar` es O(n) en el número de respuestas"""
+
+    def __init__(self, config):
+        try:
+            self.categorias = dict(config['categorias'])
+            self.metricas = dict(config.get('metricas', {}))
+            self._rachas = [_Racha(r) for r in config.get('rachas', [])]
+            self._escalamientos = [dict(e) for e in config.get('escalamientos', [])]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ReglasInvalidas(str(e)) from e
+        for escalamiento in self._escalamientos:
+            if 'de' not in escalamiento or 'cantidad' not in escalamiento:
+                raise ReglasInvalidas(f"Escalamiento inválido: {escalamiento}")
+            if 'lista' not in escalamiento and 'bandera' not in escalamiento:
+                raise ReglasInvalidas(f"El escalamiento necesita 'lista' o 'bandera': {escalamiento}")
+
+        # Índices precalculados para el ciclo caliente
+        self._rachas_por_categoria = {}
+        for racha in self._rachas:
+            self._rachas_por_categoria.setdefault(racha.categoria, []).append(racha)
+        self._metrica_de_respuesta = {respuesta: clave for clave, respuesta in self.metricas.items()}
+        self._memoria = max([r.largo for r in self._rachas] or [1])
+        self.listas = [r.lista for r in self._rachas] + [e['lista'] for e in self._escalamientos if 'lista' in e]
+        self.banderas = [e['bandera'] for e in self._escalamientos if 'bandera' in e]
+        self.version = hashlib.sha1(
+            json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:12]
+
+    def largo_racha(self, lista, defecto=None):
+        """Largo de la racha que alimenta `lista` (para la analítica vectorizada)"""
+        for racha in self._rachas:
+            if racha.lista == lista:
+                return racha.largo
+        return defecto
+
+    def cantidad_escalamiento(self, destino, defecto=None):
+        """Cuántos hallazgos hacen falta para `destino` (lista o bandera)"""
+        for escalamiento in self._escalamientos:
+            if destino in (escalamiento.get('lista'), escalamiento.get('bandera')):
+                return int(escalamiento['cantidad'])
+        return defecto
+
+    # --- Evaluación ---
+
+    def hallazgos(self, respuestas, conteos=None):
+        """Genera (lista, hallazgo) conforme se detectan las rachas, en una sola pasada.
+
+        `respuestas` es cualquier iterable de (pregunta, respuesta). Si se pasa
+        `conteos` (dict) se acumulan ahí las métricas por respuesta.
+        """
+        contadores = {id(r): 0 for r in self._rachas}
+        recientes = deque(maxlen=self._memoria)
+        rachas_por_categoria = self._rachas_por_categoria
+        metrica_de_respuesta = self._metrica_de_respuesta
+        todas = self._rachas
+
+        i = -1
+        for i, (pregunta, respuesta) in enumerate(respuestas):
+            recientes.append(pregunta)
+            if conteos is not None:
+                clave = metrica_de_respuesta.get(respuesta)
+                if clave:
+                    conteos[clave] = conteos.get(clave, 0) + 1
+
+            activas = rachas_por_categoria.get(self.categorias.get(respuesta), ())
+            for racha in todas:
+                if racha not in activas:
+                    contadores[id(racha)] = 0
+                    continue
+                contadores[id(racha)] += 1
+                if contadores[id(racha)] >= racha.largo:
+                    inicio = i - racha.largo + 1
+                    hallazgo = {
+                        "descripcion": racha.descripcion.format(largo=contadores[id(racha)]),
+                        "preguntas": list(recientes)[-racha.largo:],
+                        "ubicacion": f"Preguntas {inicio + 1} a {i + 1}",
+                    }
+                    if racha.tipo:
+                        hallazgo = {"tipo": racha.tipo, **hallazgo}
+                    contadores[id(racha)] = 0
+                    yield racha.lista, hallazgo
+        if conteos is not None:
+            conteos['_total'] = i + 1
+
+    def evaluar(self, respuestas):
+        """Resultado con la misma forma que guardaba calcular_no_conformidades"""
+        if isinstance(respuestas, dict):
+            respuestas = respuestas.items()
+        conteos = {}
+        resultado = {lista: [] for lista in self.listas}
+        for lista, hallazgo in self.hallazgos(respuestas, conteos):
+            resultado[lista].append(hallazgo)
+
+        for bandera in self.banderas:
+            resultado[bandera] = False
+        for escalamiento in self._escalamientos:
+            total = len(resultado.get(escalamiento['de'], ()))
+            if total < int(escalamiento['cantidad']):
+                continue
+            if 'bandera' in escalamiento:
+                resultado[escalamiento['bandera']] = True
+                continue
+            hallazgo = {
+                "descripcion": escalamiento.get('descripcion', "{total} acumuladas").format(total=total),
+            }
+            if escalamiento.get('tipo'):
+                hallazgo = {"tipo": escalamiento['tipo'], **hallazgo}
+            if escalamiento.get('relacionadas'):
+                hallazgo[escalamiento['relacionadas']] = total
+            resultado[escalamiento['lista']].append(hallazgo)
+
+        for lista in self.listas:
+            resultado[f"total_{lista}"] = len(resultado[lista])
+        resultado["metricas"] = self._metricas(conteos)
+        return resultado
+
+    def _metricas(self, conteos):
+        total = conteos.pop('_total', 0)
+        valores = {clave: conteos.get(clave, 0) for clave in self.metricas}
+        aplicables = total - valores.get('no_aplica', 0)
+        metricas = {"total_preguntas": total, "preguntas_aplicables": aplicables, **valores}
+        for clave in ('cumple', 'no_cumple', 'parcial'):
+            if clave in valores:
+                nombre = {'cumple': 'cumplimiento', 'no_cumple': 'no_cumplimiento', 'parcial': 'parcial'}[clave]
+                porcentaje = valores[clave] / aplicables * 100 if aplicables > 0 else 0
+                metricas[f"porcentaje_{nombre}"] = round(porcentaje, 2)
+        return metricas
+
+
+# --- Motor compilado por proceso ---
+
+_motor = None
+_lock = threading.Lock()
+
+
+def cargar_config(ruta=RUTA_REGLAS):
+    """Reglas del archivo de configuración o las reglas por defecto si no existe"""
+    if ruta and os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            return json.load(archivo)
+    return REGLAS_POR_DEFECTO
+
+
+def obtener_motor():
+    global _motor
+    if _motor is None:
+        with _lock:
+            if _motor is None:
+                _motor = MotorReglas(cargar_config())
+    return _motor
+
+
+def recargar_reglas(config=None):
+    """Compila de nuevo (al cambiar el archivo); devuelve el motor nuevo"""
+    global _motor
+    motor = MotorReglas(config if config is not None else cargar_config())
+    with _lock:
+        _motor = motor
+    return motor
+
+
+# --- Recalificación en lote ---
+
+TAMANO_LOTE_PUNTAJES = 2000
+
+SQL_GUARDAR_PUNTAJES = """
+    INSERT INTO Auditoria_Puntaje (id_auditoria, version_reglas, total_menores, total_mayores, sancion,
+                                   total_buenas_practicas, porcentaje_cumplimiento, resultado, fecha_calculo)
+    VALUES %s
+    ON CONFLICT (id_auditoria) DO UPDATE SET
+        version_reglas = EXCLUDED.version_reglas,
+        total_menores = EXCLUDED.total_menores,
+        total_mayores = EXCLUDED.total_mayores,
+        sancion = EXCLUDED.sancion,
+        total_buenas_practicas = EXCLUDED.total_buenas_practicas,
+        porcentaje_cumplimiento = EXCLUDED.porcentaje_cumplimiento,
+        resultado = EXCLUDED.resultado,
+        fecha_calculo = EXCLUDED.fecha_calculo
+"""
+
+
+def fila_puntaje(id_auditoria, version, resultado):
+    return (
+        id_auditoria,
+        version,
+        resultado.get('total_menores', 0),
+        resultado.get('total_mayores', 0),
+        bool(resultado.get('sancion', False)),
+        resultado.get('total_buenas_practicas', 0),
+        resultado.get('metricas', {}).get('porcentaje_cumplimiento', 0),
+        json.dumps(resultado, ensure_ascii=False),
+    )
+
+
+def guardar_puntajes(cursor, filas):
+    """Upsert de (id, version, menores, mayores, sancion, bp, %cumplimiento, resultado_json)"""
+    if filas:
+        execute_values(cursor, SQL_GUARDAR_PUNTAJES, filas,
+                       template="(%s, %s, %s, %s, %s, %s, %s, %s, NOW())", page_size=1000)
+
+
+def reevaluar_archivo(conn, motor=None, todas=False, tamano_lote=TAMANO_LOTE_PUNTAJES):
+    """Recalifica las auditorías cuyo puntaje es de otra versión de reglas (o todas).
+
+    Lee Auditoria_Respuesta en orden (id_auditoria, posicion) con un cursor de
+    servidor, evalúa cada auditoría en una pasada y guarda por lotes con commit.
+    """
+    motor = motor or obtener_motor()
+    inicio = time.monotonic()
+    lectura = conn.cursor(name="reevaluar_auditorias", withhold=True)
+    lectura.itersize = 20000
+    escritura = conn.cursor()
+    total = 0
+    pendientes = []
+    try:
+        lectura.execute("""
+            SELECT r.id_auditoria, r.pregunta, r.respuesta
+            FROM Auditoria_Respuesta r
+            LEFT JOIN Auditoria_Puntaje p ON p.id_auditoria = r.id_auditoria
+            WHERE %s OR p.version_reglas IS DISTINCT FROM %s
+            ORDER BY r.id_auditoria, r.posicion
+        """, (todas, motor.version))
+        conn.commit()
+
+        for id_auditoria, filas in groupby(lectura, key=itemgetter(0)):
+            resultado = motor.evaluar((pregunta, respuesta) for _, pregunta, respuesta in filas)
+            pendientes.append(fila_puntaje(id_auditoria, motor.version, resultado))
+            if len(pendientes) >= tamano_lote:
+                guardar_puntajes(escritura, pendientes)
+                conn.commit()
+                total += len(pendientes)
+                pendientes = []
+        guardar_puntajes(escritura, pendientes)
+        conn.commit()
+        total += len(pendientes)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        lectura.close()
+        escritura.close()
+
+    return {"auditorias": total, "version_reglas": motor.version,
+            "segundos": round(time.monotonic() - inicio, 2)}
@@ -0,0 +1,266 @@
+"""
+Reportes financieros por hora, día y mes (migración 010).
+Un hilo agregador por worker (uno a la vez, con advisory lock) recalcula las
+horas recientes de Transaccion en Reporte_Hora y de ahí los días y meses
+afectados. La API y las exportaciones CSV/JSON leen solo estas tablas, así
+que una consulta de un año de curvas diarias toca ~365 × tipos renglones en
+lugar de sumar el libro completo en el primario.
+
+El GGR (apuestas - premios) sale de los tipos de Transaccion que indiquen
+REPORTES_TIPOS_APUESTA y REPORTES_TIPOS_PREMIO (separados por comas). La
+billetera solo escribe 'Depósito' y 'Retiro', así que por omisión no hay tipos
+de juego: las curvas traen apuestas/premios/ggr en null y la API responde
+ggr_configurado=false en lugar de reportar ceros.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+import psycopg2
+
+# Segundos entre corridas del agregador
+INTERVALO_AGREGADOR = float(os.environ.get('REPORTES_AGREGAR_SEG', 60))
+# Horas ya agregadas que se vuelven a leer en cada corrida (commits tardíos,
+# cambios de estado de transacciones recientes)
+HORAS_RELECTURA = int(os.environ.get('REPORTES_HORAS_RELECTURA', 3))
+# Tamaño de cada transacción al cargar el histórico
+DIAS_POR_BLOQUE = 7
+LLAVE_ADVISORY = 'reportes_financieros'
+
+# Tipos del libro que entran en el GGR (ingreso bruto de juego = apuestas - premios);
+# vacíos por omisión porque nada en la app escribe todavía apuestas ni premios
+TIPOS_APUESTA = tuple(t.strip() for t in os.environ.get('REPORTES_TIPOS_APUESTA', '').split(',') if t.strip())
+TIPOS_PREMIO = tuple(t.strip() for t in os.environ.get('REPORTES_TIPOS_PREMIO', '').split(',') if t.strip())
+GGR_CONFIGURADO = bool(TIPOS_APUESTA)
+
+# granularidad -> (tabla, columna del periodo)
+GRANULARIDADES = {
+    'hora': ('Reporte_Hora', 'hora'),
+    'dia': ('Reporte_Dia', 'dia'),
+    'mes': ('Reporte_Mes', 'mes'),
+}
+
+COLUMNAS_EXPORTACION = ('periodo', 'tipo_transaccion', 'monto', 'conteo')
+
+
+# --- Agregación ---
+
+SQL_HORAS = [
+    "DELETE FROM Reporte_Hora WHERE hora >= %(desde)s AND hora < %(hasta)s",
+    """
+    INSERT INTO Reporte_Hora (hora, tipo_transaccion, monto, conteo)
+    SELECT date_trunc('hour', fecha_transaccion), tipo_transaccion, SUM(monto), COUNT(*)
+    FROM Transaccion
+    WHERE estado = 'Completada'
+      AND fecha_transaccion >= %(desde)s AND fecha_transaccion < %(hasta)s
+    GROUP BY 1, 2
+    """,
+]
+
+# Días y meses tocados por la ventana, recalculados desde el nivel inferior
+SQL_SUPERIORES = [
+    """
+    DELETE FROM Reporte_Dia
+    WHERE dia >= date_trunc('day', %(desde)s::timestamp) AND dia < date_trunc('day', %(hasta)s::timestamp - interval '1 microsecond') + interval '1 day'
+    """,
+    """
+    INSERT INTO Reporte_Dia (dia, tipo_transaccion, monto, conteo)
+    SELECT date_trunc('day', hora)::date, tipo_transaccion, SUM(monto), SUM(conteo)
+    FROM Reporte_Hora
+    WHERE hora >= date_trunc('day', %(desde)s::timestamp)
+      AND hora < date_trunc('day', %(hasta)s::timestamp - interval '1 microsecond') + interval '1 day'
+    GROUP BY 1, 2
+    """,
+    """
+    DELETE FROM Reporte_Mes
+    WHERE mes >= date_trunc('month', %(desde)s::timestamp) AND mes < date_trunc('month', %(hasta)s::timestamp - interval '1 microsecond') + interval '1 month'
+    """,
+    """
+    INSERT INTO Reporte_Mes (mes, tipo_transaccion, monto, conteo)
+    SELECT date_trunc('month', dia)::date, tipo_transaccion, SUM(monto), SUM(conteo)
+    FROM Reporte_Dia
+    WHERE dia >= date_trunc('month', %(desde)s::timestamp)
+      AND dia < date_trunc('month', %(hasta)s::timestamp - interval '1 microsecond') + interval '1 month'
+    GROUP BY 1, 2
+    """,
+]
+
+
+def _agregar_ventana(cursor, desde, hasta):
+    params = {"desde": desde, "hasta": hasta}
+    for sql in SQL_HORAS + SQL_SUPERIORES:
+        cursor.execute(sql, params)
+
+
+def agregar(conn, horas_relectura=HORAS_RELECTURA):
+    """Pone al día los rollups hasta la hora actual (incluida, parcial).
+
+    La primera vez recorre todo el histórico en bloques de DIAS_POR_BLOQUE con
+    un commit por bloque. Devuelve cuántas ventanas procesó.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT agregado_hasta FROM Reporte_Agregador WHERE id = 1")
+        fila = cursor.fetchone()
+        agregado_hasta = fila[0] if fila else None
+        cursor.execute("SELECT date_trunc('hour', LOCALTIMESTAMP) + interval '1 hour'")
+        hasta_final = cursor.fetchone()[0]
+
+        if agregado_hasta is None:
+            cursor.execute("SELECT date_trunc('hour', MIN(fecha_transaccion)) FROM Transaccion")
+            desde = cursor.fetchone()[0] or hasta_final - timedelta(hours=1)
+        else:
+            desde = min(agregado_hasta, hasta_final) - timedelta(hours=horas_relectura)
+
+        ventanas = 0
+        while desde < hasta_final:
+            hasta = min(desde + timedelta(days=DIAS_POR_BLOQUE), hasta_final)
+            _agregar_ventana(cursor, desde, hasta)
+            # Lo que queda antes de la hora en curso ya está cerrado
+            cursor.execute(
+                "UPDATE Reporte_Agregador SET agregado_hasta = LEAST(%s, date_trunc('hour', LOCALTIMESTAMP)), actualizado = NOW() WHERE id = 1",
+                (hasta,)
+            )
+            conn.commit()
+            ventanas += 1
+            desde = hasta
+        return ventanas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# --- Consultas ---
+
+def consultar(cursor, granularidad, desde, hasta, tipos=None):
+    """[(periodo, tipo_transaccion, monto, conteo)] del rollup, ordenado por periodo"""
+    tabla, columna = GRANULARIDADES[granularidad]
+    filtros = [f"{columna} >= %s", f"{columna} < %s"]
+    params = [desde, hasta]
+    if tipos:
+        filtros.append("tipo_transaccion = ANY(%s)")
+        params.append(list(tipos))
+    cursor.execute(f"""
+        SELECT {columna} AS periodo, tipo_transaccion, monto, conteo
+        FROM {tabla}
+        WHERE {' AND '.join(filtros)}
+        ORDER BY {columna}, tipo_transaccion
+    """, params)
+    return cursor
+
+
+def curvas(filas):
+    """Pivotea las filas en curvas por periodo: depósitos, retiros, neto, apuestas, premios y GGR.
+
+    Sin tipos de juego configurados, apuestas, premios y ggr van en None (no 0).
+    """
+    por_periodo = {}
+    for periodo, tipo, monto, conteo in filas:
+        clave = periodo.isoformat()
+        punto = por_periodo.get(clave)
+        if punto is None:
+            punto = por_periodo[clave] = {
+                "periodo": clave, "depositos": 0.0, "retiros": 0.0, "apuestas": 0.0, "premios": 0.0,
+                "transacciones": 0, "por_tipo": {},
+            }
+        monto = float(monto)
+        punto["por_tipo"][tipo] = {"monto": monto, "conteo": int(conteo)}
+        punto["transacciones"] += int(conteo)
+        if tipo == 'Depósito':
+            punto["depositos"] += monto
+        elif tipo == 'Retiro':
+            punto["retiros"] += monto
+        if tipo in TIPOS_APUESTA:
+            punto["apuestas"] += monto
+        if tipo in TIPOS_PREMIO:
+            punto["premios"] += monto
+
+    resultado = list(por_periodo.values())
+    for punto in resultado:
+        punto["neto"] = round(punto["depositos"] - punto["retiros"], 2)
+        if GGR_CONFIGURADO:
+            punto["ggr"] = round(punto["apuestas"] - punto["premios"], 2)
+        else:
+            punto["apuestas"] = punto["premios"] = punto["ggr"] = None
+    return resultado
+
+
+# --- Exportación en streaming ---
+
+def exportar_csv(filas):
+    """Generador de texto CSV, un bloque por cada ~500 renglones"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_EXPORTACION)
+    for n, (periodo, tipo, monto, conteo) in enumerate(filas, 1):
+        escritor.writerow((periodo.isoformat(), tipo, f"{monto:.2f}", conteo))
+        if n % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def exportar_json(filas):
+    """Generador de un arreglo JSON sin armar la lista completa en memoria"""
+    yield "["
+    separador = ""
+    for periodo, tipo, monto, conteo in filas:
+        yield separador + json.dumps({
+            "periodo": periodo.isoformat(),
+            "tipo_transaccion": tipo,
+            "monto": float(monto),
+            "conteo": int(conteo),
+        }, ensure_ascii=False)
+        separador = ",\n"
+    yield "]\n"
+
+
+# --- Hilo agregador (uno por worker, uno a la vez) ---
+
+_hilo = None
+_hilo_pid = None
+_lock = threading.Lock()
+
+
+def agregar_ahora():
+    """Corre el agregador con una conexión propia si ningún otro worker lo está corriendo"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        return None
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        # Lock de sesión: agregar() hace varios commits
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (LLAVE_ADVISORY,))
+        if not cursor.fetchone()[0]:
+            return None
+        conn.commit()
+        return agregar(conn)
+    finally:
+        conn.close()
+
+
+def _ciclo_agregador():
+    while True:
+        try:
+            agregar_ahora()
+        except Exception as e:
+            print(f"Error agregando reportes financieros: {e}")
+        time.sleep(INTERVALO_AGREGADOR)
+
+
+def asegurar_agregador():
+    global _hilo, _hilo_pid
+    with _lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_ciclo_agregador, name="reportes-agregador", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
@@ -0,0 +1,129 @@
+"""
+Respuestas de auditoría normalizadas (tabla Auditoria_Respuesta).
+Auditoria.datos_auditoria sigue guardando el JSON completo (lo usa el PDF),
+y además cada respuesta se escribe como un renglón indexado en la misma
+transacción. Así preguntas como "qué auditorías fallaron la pregunta 7 este
+mes" se contestan con un índice en vez de leer y parsear todo el JSON.
+"""
+import json
+
+from psycopg2.extras import execute_values
+
+RESPUESTAS_FALLA = ('No Cumple', 'Cumple Parcialmente')
+TAMANO_LOTE_BACKFILL = 500
+# Pregunta y respuesta vienen del cliente: el renglón guarda a lo más esto (el
+# JSON completo sigue en datos_auditoria). Juntas, aun con 4 bytes por carácter,
+# caben en una entrada de idx_respuesta_pregunta (límite de ~2700 bytes del btree)
+LARGO_MAX_PREGUNTA = 400
+LARGO_MAX_RESPUESTA = 200
+
+SQL_INSERTAR = """
+    INSERT INTO Auditoria_Respuesta (id_auditoria, posicion, pregunta, respuesta, id_usuario, fecha_auditoria)
+    VALUES %s
+    ON CONFLICT (id_auditoria, posicion) DO NOTHING
+"""
+
+
+def _respuestas(datos_auditoria):
+    if isinstance(datos_auditoria, str):
+        try:
+            datos_auditoria = json.loads(datos_auditoria)
+        except ValueError:
+            return {}
+    return (datos_auditoria or {}).get('respuestas') or {}
+
+
+def _texto_respuesta(respuesta):
+    """Cualquier valor que mande el cliente, como texto acotado"""
+    if respuesta is None:
+        return ''
+    if not isinstance(respuesta, str):
+        respuesta = json.dumps(respuesta, default=str, ensure_ascii=False)
+    return respuesta[:LARGO_MAX_RESPUESTA]
+
+
+def _texto_pregunta(pregunta):
+    return str(pregunta)[:LARGO_MAX_PREGUNTA]
+
+
+def filas_respuestas(id_auditoria, id_usuario, fecha_auditoria, datos_auditoria):
+    """Renglones (id_auditoria, posicion, pregunta, respuesta, id_usuario, fecha) de una auditoría"""
+    return [
+        (id_auditoria, posicion, _texto_pregunta(pregunta), _texto_respuesta(respuesta),
+         id_usuario, fecha_auditoria)
+        for posicion, (pregunta, respuesta) in enumerate(_respuestas(datos_auditoria).items(), 1)
+    ]
+
+
+def insertar_respuestas(cursor, id_auditoria, id_usuario, fecha_auditoria, datos_auditoria):
+    """Escribe las respuestas de una auditoría (dentro de la transacción del llamador)"""
+    filas = filas_respuestas(id_auditoria, id_usuario, fecha_auditoria, datos_auditoria)
+    if filas:
+        execute_values(cursor, SQL_INSERTAR, filas, page_size=500)
+    return len(filas)
+
+
+def backfill_lote(conn, desde_id=0, tamano=TAMANO_LOTE_BACKFILL):
+    """Normaliza el siguiente lote de auditorías sin renglones y hace commit.
+
+    Devuelve (último id procesado, auditorías, respuestas); último id None al terminar.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT a.id_auditoria, a.id_usuario, a.fecha_auditoria, a.datos_auditoria
+            FROM Auditoria a
+            WHERE a.id_auditoria > %s
+              AND NOT EXISTS (SELECT 1 FROM Auditoria_Respuesta r WHERE r.id_auditoria = a.id_auditoria)
+            ORDER BY a.id_auditoria
+            LIMIT %s
+        """, (desde_id, tamano))
+        auditorias = cursor.fetchall()
+        if not auditorias:
+            conn.commit()
+            return None, 0, 0
+
+        filas = []
+        for id_auditoria, id_usuario, fecha, datos in auditorias:
+            filas.extend(filas_respuestas(id_auditoria, id_usuario, fecha, datos))
+        if filas:
+            execute_values(cursor, SQL_INSERTAR, filas, page_size=1000)
+        conn.commit()
+        return auditorias[-1][0], len(auditorias), len(filas)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def consultar_fallas(cursor, pregunta=None, posicion=None, email=None, desde=None, hasta=None,
+                     respuestas=RESPUESTAS_FALLA, limite=200):
+    """Auditorías cuya respuesta a una pregunta (por texto o número) está en `respuestas`"""
+    filtros = ["r.respuesta = ANY(%s)"]
+    params = [list(respuestas)]
+    if pregunta:
+        filtros.append("r.pregunta = %s")
+        params.append(_texto_pregunta(pregunta))  # se guardó recortada
+    if posicion:
+        filtros.append("r.posicion = %s")
+        params.append(posicion)
+    if email:
+        filtros.append("r.id_usuario = (SELECT id_usuario FROM Usuario WHERE email = %s)")
+        params.append(email)
+    if desde:
+        filtros.append("r.fecha_auditoria >= %s")
+        params.append(desde)
+    if hasta:
+        filtros.append("r.fecha_auditoria < %s::date + 1")
+        params.append(hasta)
+    params.append(limite)
+
+    cursor.execute(f"""
+        SELECT r.id_auditoria, r.fecha_auditoria, r.posicion, r.pregunta, r.respuesta
+        FROM Auditoria_Respuesta r
+        WHERE {' AND '.join(filtros)}
+        ORDER BY r.fecha_auditoria DESC, r.id_auditoria DESC
+        LIMIT %s
+    """, params)
+    return cursor.fetchall()
@@ -0,0 +1,347 @@
+"""
+Ruteo automático de tickets de soporte (migración 012).
+Con TICKETS_POLITICA definida, un hilo por worker asigna los tickets nuevos
+('Abierto' y sin agente) en cuanto llega el NOTIFY de su alta, en lugar de
+esperar a que un agente refresque la lista de sin asignar.
+
+Cada worker guarda en memoria cuántos tickets abiertos tiene cada agente
+(el mismo filtro que obtener_tickets_agente). La tabla se siembra con un solo
+COUNT agrupado y después se ajusta con el delta de cada aviso del trigger
+(altas, asignaciones manuales, cierres, bajas), así que elegir agente no
+consulta la base. Se vuelve a sembrar cada TICKETS_RESIEMBRA_SEG y tras una
+reconexión del canal, por si se perdió algún aviso.
+
+Políticas (TICKETS_POLITICA):
+  round_robin     por turnos, en orden de id_agente
+  menor_carga     el agente con menos tickets abiertos
+  palabras_clave  el asunto elige una cola de ruteo_tickets.json y dentro de
+                  ella el de menor carga; sin coincidencia, la política "respaldo"
+Se agregan más con @registrar_politica.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import unicodedata
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from chat_eventos import TICKETS, suscribir, desuscribir
+from metricas_dashboard import invalidar_metricas_globales
+
+POLITICA = os.environ.get('TICKETS_POLITICA', '').strip().lower()
+# Tickets abiertos por agente a partir de los cuales deja de recibir automáticos
+MAX_TICKETS_POR_AGENTE = int(os.environ.get('TICKETS_MAX_POR_AGENTE', 25))
+# Segundos entre siembras completas de la tabla de carga
+RESIEMBRA = float(os.environ.get('TICKETS_RESIEMBRA_SEG', 300))
+# Segundos entre rondas si no llegan avisos
+INTERVALO_RUTEO = float(os.environ.get('TICKETS_RUTEO_SEG', 30))
+# Tickets asignados por ronda
+LOTE_RUTEO = 100
+LLAVE_ADVISORY = 'ruteo_tickets'
+
+RUTA_CONFIG = os.environ.get(
+    'TICKETS_RUTEO_CONFIG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ruteo_tickets.json')
+)
+
+CONFIG_POR_DEFECTO = {"colas": {}, "respaldo": "menor_carga"}
+
+
+def cargar_config(ruta=RUTA_CONFIG):
+    """Colas del archivo de configuración o ninguna si no existe"""
+    if ruta and os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            return {**CONFIG_POR_DEFECTO, **json.load(archivo)}
+    return CONFIG_POR_DEFECTO
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, para comparar palabras clave con el asunto"""
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+# --- Políticas ---
+
+POLITICAS = {}
+
+
+def registrar_politica(nombre):
+    """Decorador: politica(motor, ticket, cargas) -> id_agente o None.
+
+    `cargas` son los agentes con cupo en esta ronda ({id_agente: tickets abiertos});
+    `ticket` es un dict con id_ticket y asunto.
+    """
+    def decorador(funcion):
+        POLITICAS[nombre] = funcion
+        return funcion
+    return decorador
+
+
+@registrar_politica('menor_carga')
+def menor_carga(motor, ticket, cargas):
+    if not cargas:
+        return None
+    return min(cargas, key=lambda id_agente: (cargas[id_agente], id_agente))
+
+
+@registrar_politica('round_robin')
+def round_robin(motor, ticket, cargas):
+    if not cargas:
+        return None
+    agentes = sorted(cargas)
+    ultimo = motor.ultimo
+    return next((a for a in agentes if ultimo is None or a > ultimo), agentes[0])
+
+
+@registrar_politica('palabras_clave')
+def palabras_clave(motor, ticket, cargas):
+    asunto = normalizar(ticket.get('asunto'))
+    for palabras, agentes in motor.colas.values():
+        if any(palabra in asunto for palabra in palabras):
+            candidatos = cargas if agentes is None else {a: c for a, c in cargas.items() if a in agentes}
+            if candidatos:
+                return menor_carga(motor, ticket, candidatos)
+    respaldo = POLITICAS.get(motor.config.get('respaldo'))
+    if respaldo is None or respaldo is palabras_clave:
+        return None
+    return respaldo(motor, ticket, cargas)
+
+
+# --- Tabla de carga ---
+
+# Carga = tickets no cerrados del agente, como en obtener_tickets_agente
+SQL_SEMBRAR = """
+    SELECT u.id_usuario, u.email, COUNT(s.id_ticket) AS carga
+    FROM Usuario u
+    JOIN Rol r ON u.id_rol = r.id_rol
+    LEFT JOIN Soporte s ON s.id_agente = u.id_usuario AND s.estado != 'Cerrado'
+    WHERE r.nombre = 'Agente de Soporte' AND u.activo = true
+    GROUP BY u.id_usuario, u.email
+"""
+
+
+class MotorRuteo:
+    """Carga por agente de este worker y la política con la que se reparten los tickets"""
+
+    def __init__(self, politica, config=None, maximo=MAX_TICKETS_POR_AGENTE):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de ruteo desconocida: {politica}")
+        self.politica = politica
+        self.config = config or CONFIG_POR_DEFECTO
+        self.maximo = maximo
+        self.cargas = {}
+        self.colas = {}
+        self.ultimo = None
+        self.sembrado = 0.0
+        # (id_ticket, id_agente) ya contados al asignar; su aviso no se vuelve a sumar
+        self._propios = set()
+        self._lock = threading.Lock()
+
+    def sembrar(self, cursor):
+        cursor.execute(SQL_SEMBRAR)
+        filas = cursor.fetchall()
+        por_email = {email: id_agente for id_agente, email, _ in filas}
+        colas = {}
+        for nombre, cola in self.config.get('colas', {}).items():
+            agentes = cola.get('agentes') or []
+            ids = {a if isinstance(a, int) else por_email.get(a) for a in agentes} - {None}
+            colas[nombre] = ([normalizar(p) for p in cola.get('palabras', [])], ids if agentes else None)
+        with self._lock:
+            self.cargas = {id_agente: carga for id_agente, _, carga in filas}
+            self.colas = colas
+            self._propios.clear()
+            self.sembrado = time.monotonic()
+
+    def aplicar_evento(self, evento):
+        """Ajusta la carga con el antes/después de un aviso del trigger de Soporte"""
+        antes = evento.get('agente_anterior') if evento.get('abierto_anterior') else None
+        despues = evento.get('agente') if evento.get('abierto') else None
+        if antes == despues:
+            return
+        with self._lock:
+            if antes is None and (evento.get('id_ticket'), despues) in self._propios:
+                self._propios.discard((evento.get('id_ticket'), despues))
+                return
+            if antes in self.cargas:
+                self.cargas[antes] = max(0, self.cargas[antes] - 1)
+            if despues in self.cargas:
+                self.cargas[despues] += 1
+            if antes is None and despues is not None:
+                # Asignación de otro worker o manual: el turno sigue desde ahí
+                self.ultimo = despues
+
+    def repartir(self, tickets):
+        """[(id_ticket, id_agente)] para los tickets que tienen agente con cupo"""
+        funcion = POLITICAS[self.politica]
+        with self._lock:
+            cargas = {a: c for a, c in self.cargas.items() if c < self.maximo}
+            asignaciones = []
+            for ticket in tickets:
+                id_agente = funcion(self, ticket, cargas)
+                if id_agente is None:
+                    continue
+                asignaciones.append((ticket['id_ticket'], id_agente))
+                self.ultimo = id_agente
+                cargas[id_agente] += 1
+                if cargas[id_agente] >= self.maximo:
+                    del cargas[id_agente]
+            return asignaciones
+
+    def confirmar(self, asignaciones):
+        """Suma a la tabla las asignaciones ya confirmadas en la base"""
+        with self._lock:
+            for id_ticket, id_agente in asignaciones:
+                if id_agente in self.cargas:
+                    self.cargas[id_agente] += 1
+                self._propios.add((id_ticket, id_agente))
+
+    def estado(self):
+        with self._lock:
+            return {
+                "politica": self.politica,
+                "max_por_agente": self.maximo,
+                "cargas": dict(self.cargas),
+                "colas": {nombre: sorted(agentes) if agentes is not None else None
+                          for nombre, (_, agentes) in self.colas.items()},
+                "segundos_desde_siembra": round(time.monotonic() - self.sembrado, 1) if self.sembrado else None,
+            }
+
+
+# --- Asignación ---
+
+# Índice parcial idx_soporte_pendientes (migración 001)
+SQL_PENDIENTES = """
+    SELECT id_ticket, asunto FROM Soporte
+    WHERE id_agente IS NULL AND estado = 'Abierto'
+    ORDER BY fecha_creacion, id_ticket
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+SQL_ASIGNAR = """
+    UPDATE Soporte s
+    SET id_agente = v.id_agente, estado = 'En Proceso'
+    FROM (VALUES %s) AS v (id_ticket, id_agente)
+    WHERE s.id_ticket = v.id_ticket
+"""
+
+
+def rutear(conn, motor):
+    """Una ronda de ruteo. Devuelve las asignaciones o None si otro worker está ruteando."""
+    cursor = conn.cursor()
+    try:
+        # Uno a la vez: dos rondas simultáneas repartirían con la misma carga
+        cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (LLAVE_ADVISORY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+
+        cursor.execute(SQL_PENDIENTES, (LOTE_RUTEO,))
+        tickets = [{'id_ticket': fila[0], 'asunto': fila[1]} for fila in cursor.fetchall()]
+        asignaciones = motor.repartir(tickets) if tickets else []
+        if asignaciones:
+            execute_values(cursor, SQL_ASIGNAR, asignaciones)
+        conn.commit()
+        if asignaciones:
+            motor.confirmar(asignaciones)
+            invalidar_metricas_globales()
+        return asignaciones
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# --- Hilo ruteador (uno por worker, uno a la vez) ---
+
+_motor = None
+_hilo = None
+_hilo_pid = None
+_lock = threading.Lock()
+
+
+def obtener_motor():
+    """Motor de este proceso, o None si el ruteo automático está apagado"""
+    global _motor
+    if not POLITICA:
+        return None
+    if _motor is None:
+        with _lock:
+            if _motor is None:
+                _motor = MotorRuteo(POLITICA, cargar_config())
+    return _motor
+
+
+def _leer_avisos(cola, motor):
+    """Bloquea hasta el próximo aviso (o INTERVALO_RUTEO) y aplica todos los acumulados.
+
+    Devuelve True si hay que volver a sembrar (el canal se reconectó).
+    """
+    try:
+        eventos = [cola.get(timeout=INTERVALO_RUTEO)]
+    except queue.Empty:
+        return False
+    while True:
+        try:
+            eventos.append(cola.get_nowait())
+        except queue.Empty:
+            break
+    resembrar = False
+    for evento in eventos:
+        if evento.get('tipo') == 'resync':
+            resembrar = True
+        else:
+            motor.aplicar_evento(evento)
+    return resembrar
+
+
+def _ciclo_ruteador(motor):
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("ERROR: Falta DATABASE_URL (ruteo_tickets)")
+        return
+    cola = suscribir(TICKETS)
+    conn = None
+    resembrar = True
+    try:
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(database_url)
+                    resembrar = True
+                if resembrar or time.monotonic() - motor.sembrado >= RESIEMBRA:
+                    with conn.cursor() as cursor:
+                        motor.sembrar(cursor)
+                    conn.commit()
+                    resembrar = False
+                asignaciones = rutear(conn, motor)
+                if asignaciones:
+                    print(f"🎫 Tickets asignados automáticamente ({motor.politica}): {asignaciones}")
+            except Exception as e:
+                print(f"Error ruteando tickets: {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(2)
+            resembrar = _leer_avisos(cola, motor) or resembrar
+    finally:
+        desuscribir(TICKETS, cola)
+
+
+def asegurar_ruteador():
+    """Arranca el hilo de ruteo si TICKETS_POLITICA está definida"""
+    global _hilo, _hilo_pid
+    motor = obtener_motor()
+    if motor is None:
+        return
+    with _lock:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_ciclo_ruteador, args=(motor,), name="tickets-ruteo", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
@@ -0,0 +1,148 @@
+"""
+Servicio de hashing de contraseñas (Argon2) fuera de los hilos web.
+Argon2 es caro a propósito (CPU + memoria); hacerlo inline bloquea al worker
+de gunicorn. Aquí se manda a un pool de procesos acotado, con control de
+admisión (si la cola está llena se rechaza rápido en vez de apilar peticiones)
+y métricas de cola. Los parámetros de Argon2 se configuran por entorno y los
+hashes con parámetros viejos se regeneran de forma transparente al hacer login.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# Parámetros de Argon2 (cambiarlos hace que needs_update() marque los hashes viejos)
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 3))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 4))
+
+# Procesos dedicados a hashing (0 = hacerlo en el mismo hilo, útil en desarrollo)
+HASH_PROCESOS = int(os.environ.get('HASH_PROCESOS', 2))
+# Máximo de operaciones en cola + en proceso antes de rechazar
+HASH_MAX_PENDIENTES = int(os.environ.get('HASH_MAX_PENDIENTES', 16))
+# Segundos que una petición espera lugar en la cola
+HASH_ESPERA_ADMISION = float(os.environ.get('HASH_ESPERA_ADMISION', 2))
+# Segundos máximos esperando el resultado
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+
+# Configuración de seguridad (Argon2)
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+
+class ServicioSaturado(Exception):
+    """La cola de hashing está llena; el cliente debe reintentar más tarde"""
+
+
+# --- Trabajo que corre en los procesos del pool ---
+
+def _hash_en_proceso(password):
+    return pwd_context.hash(password)
+
+
+def _verificar_en_proceso(password, password_hash):
+    # verify_and_update devuelve (válida, hash_nuevo_o_None)
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+# --- Pool y control de admisión ---
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+_admision = threading.BoundedSemaphore(HASH_MAX_PENDIENTES)
+_metricas = {
+    "pendientes": 0,
+    "completadas": 0,
+    "rechazadas": 0,
+    "errores": 0,
+    "rehash": 0,
+    "espera_total_ms": 0.0,
+    "proceso_total_ms": 0.0,
+}
+
+
+def _obtener_pool():
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn: no heredar hilos ni conexiones del worker web
+            _pool = ProcessPoolExecutor(
+                max_workers=HASH_PROCESOS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _ejecutar(funcion, *args):
+    """Corre `funcion` en el pool respetando el límite de pendientes"""
+    inicio = time.monotonic()
+    if not _admision.acquire(timeout=HASH_ESPERA_ADMISION):
+        with _lock:
+            _metricas["rechazadas"] += 1
+        raise ServicioSaturado("Demasiadas solicitudes de autenticación, intenta de nuevo")
+
+    with _lock:
+        _metricas["pendientes"] += 1
+    try:
+        admitida = time.monotonic()
+        if HASH_PROCESOS > 0:
+            resultado = _obtener_pool().submit(funcion, *args).result(timeout=HASH_TIMEOUT)
+        else:
+            resultado = funcion(*args)
+        fin = time.monotonic()
+        with _lock:
+            _metricas["completadas"] += 1
+            _metricas["espera_total_ms"] += (admitida - inicio) * 1000
+            _metricas["proceso_total_ms"] += (fin - admitida) * 1000
+        return resultado
+    except Exception:
+        with _lock:
+            _metricas["errores"] += 1
+        raise
+    finally:
+        with _lock:
+            _metricas["pendientes"] -= 1
+        _admision.release()
+
+
+# --- API pública ---
+
+def hash_password(password):
+    """Hash Argon2 con los parámetros actuales"""
+    return _ejecutar(_hash_en_proceso, password)
+
+
+def verificar_password(password, password_hash):
+    """Devuelve (válida, hash_nuevo); hash_nuevo no es None si hay que re-hashear"""
+    valida, nuevo_hash = _ejecutar(_verificar_en_proceso, password, password_hash)
+    if valida and nuevo_hash:
+        with _lock:
+            _metricas["rehash"] += 1
+    return valida, nuevo_hash
+
+
+def metricas_hash():
+    """Estado de la cola de hashing del worker actual"""
+    with _lock:
+        datos = dict(_metricas)
+    completadas = datos["completadas"] or 1
+    datos["espera_promedio_ms"] = round(datos.pop("espera_total_ms") / completadas, 2)
+    datos["proceso_promedio_ms"] = round(datos.pop("proceso_total_ms") / completadas, 2)
+    datos["procesos"] = HASH_PROCESOS
+    datos["max_pendientes"] = HASH_MAX_PENDIENTES
+    datos["argon2"] = {
+        "time_cost": ARGON2_TIME_COST,
+        "memory_cost": ARGON2_MEMORY_COST,
+        "parallelism": ARGON2_PARALLELISM,
+    }
+    return datos
@@ -0,0 +1,41 @@
+/**
+ * FEED DE CAMBIOS - Panel de agente
+ * Cada pantalla vigila sus claves en /api/agente/changes y solo vuelve a pedir
+ * sus datos cuando alguna cambió. Si el feed no responde, recarga como antes.
+ *
+ *   vigilarCambios(['tickets', `tickets_agente:${idAgente}`], cargarTickets, 15000);
+ *
+ * alCambiar recibe la lista de claves que cambiaron (todas en la carga inicial).
+ */
+function vigilarCambios(claves, alCambiar, intervaloMs) {
+    const versiones = {};
+
+    async function revisar() {
+        const since = claves.map(c => (c in versiones ? `${c}@${versiones[c]}` : c)).join(',');
+        const response = await fetch(`/api/agente/changes?${new URLSearchParams({ since })}`);
+        if (!response.ok) throw new Error('Feed de cambios no disponible');
+
+        const data = await response.json();
+        Object.assign(versiones, data.versiones);
+        return Object.keys(data.versiones);
+    }
+
+    async function ciclo() {
+        let cambiadas;
+        try {
+            cambiadas = await revisar();
+        } catch (error) {
+            console.error('Error:', error);
+            cambiadas = claves;
+        }
+        if (cambiadas.length) alCambiar(cambiadas);
+    }
+
+    // Conocer las versiones antes de la primera carga: un cambio intermedio se vuelve a pedir
+    revisar()
+        .catch(error => console.error('Error:', error))
+        .finally(() => {
+            alCambiar(claves);
+            setInterval(ciclo, intervaloMs);
+        });
+}
@@ -2,7 +2,8 @@
 Script para verificar que existe un usuario con rol 'Agente de Soporte'
 y crear uno si no existe.
 """
-from db_config import get_db_connection, pwd_context
+from db_config import get_db_connection
+from servicio_hash import pwd_context
 
 def verificar_y_crear_agente():
     conn = get_db_connection()
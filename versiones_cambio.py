@@ -0,0 +1,56 @@
+"""
+Feed de cambios del panel de agente (migración 014).
+Cada pantalla manda las versiones que ya conoce de sus claves
+(`since=tickets@12,chats_agente:5@3`) y recibe solo las que cambiaron; si
+nada cambió no vuelve a pedir su lista, y el sondeo cuesta una lectura por PK
+de Version_Cambio en lugar de la consulta con JOINs de cada pantalla.
+
+Las versiones las suben los triggers de la migración 014 (016 deja un solo
+fragmento a las claves por entidad y borra las de un chat al cerrarse); aquí
+solo se leen.
+Una clave sin versión (`since=tickets`) siempre se devuelve, para conocerla.
+"""
+import re
+
+# Claves por petición (una pantalla vigila 1 a 4)
+MAX_CLAVES = 20
+
+PATRON_CLAVE = re.compile(r'^(tickets|tickets_agente:\d+|chats_esperando|chats_agente:\d+|chat:\d+)$')
+
+SQL_VERSIONES = """
+    SELECT clave, SUM(valor) AS version
+    FROM Version_Cambio
+    WHERE clave = ANY(%s)
+    GROUP BY clave
+"""
+
+
+def parsear_since(texto):
+    """{clave: versión conocida o None} a partir de 'clave@versión,...' (ignora lo inválido)"""
+    conocidas = {}
+    for parte in (texto or '').split(','):
+        clave, _, version = parte.strip().partition('@')
+        if not PATRON_CLAVE.match(clave) or len(conocidas) >= MAX_CLAVES:
+            continue
+        conocidas[clave] = int(version) if version.isdigit() else None
+    return conocidas
+
+
+def cambios(conocidas, filas):
+    """{clave: versión actual} de las claves cuya versión difiere de la conocida.
+
+    Una clave que nunca cambió (o la de un chat cerrado) no tiene renglones: su versión es 0.
+    """
+    actuales = {clave: int(version) for clave, version in filas}
+    return {
+        clave: actuales.get(clave, 0)
+        for clave, conocida in conocidas.items()
+        if actuales.get(clave, 0) != conocida
+    }
+
+
+def leer_cambios(cursor, conocidas):
+    if not conocidas:
+        return {}
+    cursor.execute(SQL_VERSIONES, (list(conocidas),))
+    return cambios(conocidas, cursor.fetchall())